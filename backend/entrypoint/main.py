@@ -1,19 +1,27 @@
+import asyncio
 import base64
+import json
 import sys
 import os
 import traceback
 from datetime import datetime
 from typing import Optional, TYPE_CHECKING
-from fastapi import FastAPI, UploadFile, Form, File, Header, HTTPException
+from fastapi import FastAPI, UploadFile, Form, File, Header, HTTPException, Depends, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, ConfigDict
 from dotenv import load_dotenv
 from collections import deque
-from fastapi.responses import PlainTextResponse, FileResponse
+from fastapi.responses import PlainTextResponse, FileResponse, JSONResponse, StreamingResponse, Response
 from contextlib import asynccontextmanager
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from files.db_controller import DBController
+from files.db_controller import DBController, get_mongo_client, close_mongo_client, pool_options
+from files.attendance_export import AttendanceExporter
+from files.attendance_journal import AttendanceWriteBehind
+from files.blob_store import ImageStore
+from files.db_metrics import db_metrics
+from files.inference_pool import InferenceBusyError
+from files.liveness import LivenessBusyError, LivenessManager
 from files.logger import logger
 from files.processing import DataProcessor
 
@@ -22,6 +30,7 @@ if TYPE_CHECKING:
 
 load_dotenv()
 _AI: Optional["AIModules"] = None
+_LIVENESS: Optional[LivenessManager] = None
 
 def get_ai() -> "AIModules":
     global _AI
@@ -32,15 +41,100 @@ def get_ai() -> "AIModules":
         logger.info("AIModules loaded.")
     return _AI
 
+def get_liveness() -> LivenessManager:
+    global _LIVENESS
+    if _LIVENESS is None:
+        _LIVENESS = LivenessManager()
+    return _LIVENESS
+
+def get_db(request: Request) -> DBController:
+    """FastAPI dependency: the DBController bound to the process-wide Motor client."""
+    db = getattr(request.app.state, "db", None)
+    if db is None:
+        db = request.app.state.db = DBController()
+    return db
+
+def get_image_store(request: Request) -> ImageStore:
+    store = getattr(request.app.state, "image_store", None)
+    if store is None:
+        store = request.app.state.image_store = ImageStore(get_db(request).db)
+    return store
+
+def get_attendance_writer(request: Request) -> Optional[AttendanceWriteBehind]:
+    # None unless ATTENDANCE_WRITE_BEHIND is on and the journal opened at startup
+    return getattr(request.app.state, "attendance_writer", None)
+
+async def _refresh_gallery(db: DBController, interval: float):
+    # Other workers register/delete students too; periodically re-sync this worker's copy.
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await get_ai().gallery.load(db)
+        except Exception as e:
+            logger.error(f"Gallery refresh failed: {e}")
+
+async def _sweep_images(db: DBController, store: ImageStore, interval: float, grace: float):
+    # Photos are content-addressed and shared, so unreferenced ones are dropped here, not inline.
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await store.sweep(db.images_in_use, grace)
+        except Exception as e:
+            logger.error(f"Image sweep failed: {e}")
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     try:
         logger.info("Lifespan: warming up models...")
-        get_ai()
+        ai = get_ai()
+        if os.environ.get("MODEL_WARMUP", "false").strip().lower() in ("1", "true", "yes"):
+            await ai.pool.run(ai.warmup)
         logger.info("Lifespan: models ready.")
     except Exception as e:
         logger.error(f"Lifespan warm-up failed: {e}\n{traceback.format_exc()}")
+    app.state.db = None
+    try:
+        app.state.db = DBController(client=get_mongo_client())
+        await app.state.db.ensure_indexes()
+        app.state.image_store = ImageStore(app.state.db.db)
+        count = await get_ai().gallery.load(app.state.db)
+        logger.info(f"Lifespan: embedding gallery ready ({count} students).")
+    except Exception as e:
+        logger.error(f"Lifespan gallery load failed: {e}\n{traceback.format_exc()}")
+    app.state.attendance_writer = None
+    if os.environ.get("ATTENDANCE_WRITE_BEHIND", "false").strip().lower() in ("1", "true", "yes") and app.state.db is not None:
+        try:
+            writer = AttendanceWriteBehind(app.state.db)
+            await writer.start()
+            app.state.attendance_writer = writer
+        except Exception as e:
+            logger.error(f"Lifespan: write-behind disabled, marks go straight to Mongo: {e}")
+    refresh_task = None
+    try:
+        refresh_sec = float(os.environ.get("GALLERY_REFRESH_SEC", 0) or 0)
+    except ValueError:
+        logger.warning("Lifespan: invalid GALLERY_REFRESH_SEC, periodic gallery refresh disabled")
+        refresh_sec = 0.0
+    if refresh_sec > 0 and app.state.db is not None:
+        refresh_task = asyncio.create_task(_refresh_gallery(app.state.db, refresh_sec))
+    sweep_task = None
+    try:
+        sweep_sec = float(os.environ.get("IMAGE_SWEEP_SEC", 3600))
+        sweep_grace = float(os.environ.get("IMAGE_SWEEP_GRACE_SEC", 3600))
+    except ValueError:
+        sweep_sec, sweep_grace = 3600.0, 3600.0
+    if sweep_sec > 0 and app.state.db is not None and getattr(app.state, "image_store", None) is not None:
+        sweep_task = asyncio.create_task(_sweep_images(app.state.db, app.state.image_store, sweep_sec, max(60.0, sweep_grace)))
     yield
+    if refresh_task is not None:
+        refresh_task.cancel()
+    if sweep_task is not None:
+        sweep_task.cancel()
+    if app.state.attendance_writer is not None:
+        try:
+            await app.state.attendance_writer.stop()
+        except Exception as e:
+            logger.error(f"Lifespan: attendance journal flush failed: {e}\n{traceback.format_exc()}")
     try:
         import signal
         reason = "Normal shutdown or deployment restart"
@@ -49,8 +143,15 @@ async def lifespan(app: FastAPI):
         logger.info(f"Lifespan: shutting down FastAPI app. Reason: {reason}")
         global _AI
         if _AI is not None:
+            _AI.gallery.save()
+            _AI.pool.shutdown()
             _AI = None
             logger.info("Lifespan: released AI models from memory.")
+        global _LIVENESS
+        if _LIVENESS is not None:
+            _LIVENESS.shutdown()
+            _LIVENESS = None
+        close_mongo_client()
     except Exception as e:
         logger.error(f"Lifespan shutdown error: {e}\n{traceback.format_exc()}")
 
@@ -64,6 +165,10 @@ app.add_middleware(
 )
 logger.info("FastAPI app initialized (lazy model loading enabled).")
 
+def _busy(content: dict) -> JSONResponse:
+    # Inference pool saturated: fail fast so clients retry instead of piling up
+    return JSONResponse(status_code=503, content=content, headers={"Retry-After": "1"})
+
 class StudentData(BaseModel):
     name: str
     roll: str
@@ -77,84 +182,232 @@ def wakeup_call():
     return {"success": "true"}
 
 @app.post("/register")
-async def receive_data(name: str = Form(...), roll: str = Form(...), image: UploadFile = File(...)):
+async def receive_data(
+    name: str = Form(...),
+    roll: str = Form(...),
+    image: UploadFile = File(...),
+    courses: Optional[str] = Form(None),
+    db: DBController = Depends(get_db),
+    store: ImageStore = Depends(get_image_store),
+):
     try:
         logger.info(f"API /register called by roll={roll}")
-        processor = DataProcessor(ai_modules=get_ai())
+        processor = DataProcessor(ai_modules=get_ai(), image_store=store)
         processed_data = await processor.process_input(name, roll, image)
-        db = DBController()
+        enrolled = None
+        if courses is not None:
+            # comma-separated course ids; omitted on re-register keeps the existing enrollment
+            enrolled = sorted({c.strip() for c in courses.split(",") if c.strip()})
+            processed_data["courses"] = enrolled
         result = await db.register_student(processed_data)
-        logger.info(f"Data successfully stored for roll={roll}")
-        return {"success": True, "result": result}
+        get_ai().gallery.upsert(processed_data["roll"], processed_data["embedding"], courses=enrolled)
+        logger.info(f"Data successfully stored for roll={roll} | timings={processor.timings}")
+        return {"success": True, "result": result, "timings": processor.timings}
+    except InferenceBusyError as e:
+        return _busy({"success": False, "error": str(e)})
     except Exception as e:
         logger.error(f"Error in /register for roll={roll}: {e}\n{traceback.format_exc()}")
         return {"success": False, "error": str(e)}
 
+async def _set_enrollment(db: DBController, roll: str, course_id: str, enrolled: bool):
+    courses = await db.set_enrollment(roll, course_id, enrolled=enrolled)
+    if courses is None:
+        return {"success": False, "message": f"No student found with roll {roll}"}
+    get_ai().gallery.set_courses(roll, courses)
+    return {"success": True, "roll": roll.strip().lower(), "courses": courses}
+
+@app.post("/enroll")
+async def enroll(roll: str = Form(...), course_id: str = Form(...), db: DBController = Depends(get_db)):
+    try:
+        return await _set_enrollment(db, roll, course_id, True)
+    except Exception as e:
+        logger.error(f"Error in /enroll for roll={roll}: {e}\n{traceback.format_exc()}")
+        return {"success": False, "error": str(e)}
+
+@app.post("/unenroll")
+async def unenroll(roll: str = Form(...), course_id: str = Form(...), db: DBController = Depends(get_db)):
+    try:
+        return await _set_enrollment(db, roll, course_id, False)
+    except Exception as e:
+        logger.error(f"Error in /unenroll for roll={roll}: {e}\n{traceback.format_exc()}")
+        return {"success": False, "error": str(e)}
+
+def _with_image_urls(request: Request, student: dict) -> dict:
+    """Replace stored image fields with links to /student_image (no base64 in JSON)."""
+    ref = student.pop("image_ref", None)
+    student.pop("image_data", None)
+    url = str(request.url_for("student_image", roll=student.get("roll", "")))
+    student["image_url"] = url
+    student["thumb_url"] = f"{url}?variant=thumb"
+    if ref:
+        student["image_etag"] = ref.get("sha256")
+    return student
+
 @app.post("/login")
-async def login(name: str = Form(...), roll: str = Form(...)):
+async def login(request: Request, name: str = Form(...), roll: str = Form(...), db: DBController = Depends(get_db)):
     try:
-        db = DBController()
-        student = await db.check_login(roll=roll, name=name)
+        student = await db.check_login(roll=roll, name=name, exclude=("embedding", "image_data"))
         if not student or (name and student.get("name") != name):
             return {"success": False, "message": "Invalid credentials or student not found"}
-        image_bytes = student.get("image_data")
-        if image_bytes:
-            student["image_base64"] = base64.b64encode(image_bytes).decode("utf-8")
-        student.pop("embedding", None)
-        student.pop("image_data", None)
+        student = _with_image_urls(request, student)
         return {"success": True, "message": "Login successful", "student": student}
     except Exception as e:
         logger.error(f"Error in /login: {e}\n{traceback.format_exc()}")
         return {"success": False, "message": "Internal server error", "error": str(e)}
 
 @app.post("/spoof")
-async def spoof(image: UploadFile = File(...), authorization: Optional[str] = Header(None)):
+async def spoof(image: UploadFile = File(...), compact: bool = False, authorization: Optional[str] = Header(None)):
     try:
         content = await image.read()
-        if not content:
-            return {"success": False, "reason": "Empty file"}
-        if len(content) > int(os.environ.get("MAX_IMAGE_BYTES", 5 * 1024 * 1024)):
-            return {"success": False, "reason": "Image too large"}
         ai = get_ai()
-        result = ai.spoof_detect(content)
+        try:
+            ai.ingest.check(content)
+        except ValueError as e:
+            return {"success": False, "reason": str(e)}
+        result = await ai.detect_spoof(content, compact=compact)
         return {"success": True, **result}
+    except InferenceBusyError as e:
+        return _busy({"success": False, "reason": str(e)})
     except HTTPException as e:
         return {"success": False, "reason": str(e.detail)}
     except Exception as e:
         logger.error(f"/spoof error: {e}\n{traceback.format_exc()}")
         return {"success": False, "reason": "Internal server error"}
 
+async def _mark_matched(
+    db: DBController, match: dict, roll: str, course_id: str, writer: Optional[AttendanceWriteBehind] = None
+) -> dict:
+    """Turn a face match into an attendance mark for the claimed roll."""
+    matched_roll_raw = (match.get("matched_roll") or "").strip()
+    similarity = match.get("similarity", "")
+    provided_roll = roll.strip().lower()
+    matched_roll = matched_roll_raw.lower()
+    if not matched_roll:
+        return {"success": False, "status": "unmarked", "similarity": similarity, "reason": "No face match found"}
+    matched_student = await db.read_entry({"roll": matched_roll}, fields=("roll", "name"))
+    if not matched_student:
+        return {"success": False, "status": "unmarked", "similarity": similarity, "reason": "Matched student not found in DB", "details": {"roll": matched_roll_raw or "", "name": ""}}
+    if matched_roll != provided_roll:
+        now = datetime.now().isoformat()
+        return {"success": False, "status": "unmarked", "similarity": similarity, "reason": f"Roll mismatch: face matched a different student ({matched_student.get('roll')}).", "details": {"name": matched_student.get("name"), "roll": matched_student.get("roll"), "timestamp": now}}
+    now = datetime.now()
+    attendance_data = {"roll": matched_student.get("roll"), "name": matched_student.get("name"), "course": course_id, "timestamp": now.isoformat(), "date": now.strftime("%Y-%m-%d"), "similarity": similarity, "status": "marked"}
+    if writer is not None:
+        outcome = await writer.enqueue(attendance_data)  # acked once journaled; Mongo write is batched
+    else:
+        outcome = await db.insert_attendance(attendance_data)
+    details = {"name": matched_student.get("name"), "roll": matched_student.get("roll"), "timestamp": now.isoformat()}
+    if outcome == "duplicate":
+        return {"success": False, "status": "already_marked", "similarity": similarity, "reason": f"Attendance already marked today for course {course_id}", "details": details}
+    if outcome not in ("inserted", "queued"):
+        return {"success": False, "status": "unmarked", "similarity": similarity, "reason": "Could not save attendance", "details": details}
+    logger.info(f"Attendance marked for roll={matched_student.get('roll')}")
+    return {"success": True, "status": "marked", "similarity": similarity, "reason": "", "details": details}
+
 @app.post("/mark_attendance")
-async def mark_attendance(roll: str = Form(...), course_id: str = Form(...), image: UploadFile = File(...)):
+async def mark_attendance(
+    roll: str = Form(...),
+    course_id: str = Form(...),
+    image: UploadFile = File(...),
+    db: DBController = Depends(get_db),
+    writer: Optional[AttendanceWriteBehind] = Depends(get_attendance_writer),
+):
     try:
         logger.info(f"/mark_attendance called with provided roll={roll}")
         if image.content_type not in ("image/jpeg", "image/png"):
             return {"success": False, "status": "unmarked", "similarity": "", "reason": "Only JPG/PNG allowed"}
         image_bytes = await image.read()
         logger.info(f"Received image of size {len(image_bytes)} bytes")
-        match = await get_ai().match_face("unknown", image_bytes)
-        matched_roll_raw = (match.get("matched_roll") or "").strip()
-        similarity = match.get("similarity", "")
-        provided_roll = roll.strip().lower()
-        matched_roll = matched_roll_raw.lower()
-        if not matched_roll:
-            return {"success": False, "status": "unmarked", "similarity": similarity, "reason": "No face match found"}
-        db = DBController()
-        matched_student = await db.read_entry({"roll": matched_roll})
-        if not matched_student:
-            return {"success": False, "status": "unmarked", "similarity": similarity, "reason": "Matched student not found in DB", "details": {"roll": matched_roll_raw or "", "name": ""}}
-        if matched_roll != provided_roll:
-            now = datetime.now().isoformat()
-            return {"success": False, "status": "unmarked", "similarity": similarity, "reason": f"Roll mismatch: face matched a different student ({matched_student.get('roll')}).", "details": {"name": matched_student.get("name"), "roll": matched_student.get("roll"), "timestamp": now}}
-        now = datetime.now()
-        attendance_data = {"roll": matched_student.get("roll"), "name": matched_student.get("name"), "course": course_id, "timestamp": now.isoformat(), "date": now.strftime("%Y-%m-%d"), "similarity": similarity, "status": "marked"}
-        await db.insert_attendance(attendance_data)
-        logger.info(f"Attendance marked for roll={matched_student.get('roll')}")
-        return {"success": True, "status": "marked", "similarity": similarity, "reason": "", "details": {"name": matched_student.get("name"), "roll": matched_student.get("roll"), "timestamp": now.isoformat()}}
+        match = await get_ai().match_face(roll, image_bytes, db=db, course=course_id)
+        return await _mark_matched(db, match, roll, course_id, writer)
+    except InferenceBusyError as e:
+        return _busy({"success": False, "status": "unmarked", "similarity": "", "reason": str(e)})
     except Exception as e:
         logger.error(f"Error in mark_attendance: {e}\n{traceback.format_exc()}")
         return {"success": False, "status": "unmarked", "similarity": "", "reason": "Internal server error"}
 
+@app.post("/verify_and_mark")
+async def verify_and_mark(
+    roll: str = Form(...),
+    course_id: str = Form(...),
+    image: UploadFile = File(...),
+    db: DBController = Depends(get_db),
+    writer: Optional[AttendanceWriteBehind] = Depends(get_attendance_writer),
+):
+    try:
+        logger.info(f"/verify_and_mark called with provided roll={roll}")
+        if image.content_type not in ("image/jpeg", "image/png"):
+            return {"success": False, "status": "unmarked", "similarity": "", "reason": "Only JPG/PNG allowed", "spoof": None}
+        image_bytes = await image.read()
+        get_ai().ingest.check(image_bytes)  # empty / byte / header-pixel limits, before any decode
+        result = await get_ai().spoof_and_match(image_bytes, db=db, course=course_id, roll=roll)
+        spoof = result["spoof"]
+        if spoof["is_spoof"]:
+            logger.info(f"/verify_and_mark spoof rejected for roll={roll}")
+            return {"success": False, "status": "unmarked", "similarity": "", "reason": "Spoof detected", "spoof": spoof}
+        if not result["face_found"] or spoof["overall"] == "no_face":
+            return {"success": False, "status": "unmarked", "similarity": "", "reason": "No face detected", "spoof": spoof}
+        response = await _mark_matched(db, result["match"], roll, course_id, writer)
+        response["spoof"] = spoof
+        return response
+    except InferenceBusyError as e:
+        return _busy({"success": False, "status": "unmarked", "similarity": "", "reason": str(e), "spoof": None})
+    except ValueError as e:
+        return {"success": False, "status": "unmarked", "similarity": "", "reason": str(e), "spoof": None}
+    except Exception as e:
+        logger.error(f"Error in verify_and_mark: {e}\n{traceback.format_exc()}")
+        return {"success": False, "status": "unmarked", "similarity": "", "reason": "Internal server error", "spoof": None}
+
+@app.post("/mark_attendance_multi")
+async def mark_attendance_multi(
+    course_id: str = Form(...),
+    image: UploadFile = File(...),
+    spoof: bool = Form(True),
+    db: DBController = Depends(get_db),
+    writer: Optional[AttendanceWriteBehind] = Depends(get_attendance_writer),
+):
+    """Mark everyone recognised in one frame: one detect, one embed batch, one gallery product, one bulk write."""
+    try:
+        if image.content_type not in ("image/jpeg", "image/png"):
+            return {"success": False, "reason": "Only JPG/PNG allowed", "faces": []}
+        image_bytes = await image.read()
+        get_ai().ingest.check(image_bytes)
+        result = await get_ai().match_faces(image_bytes, db=db, course=course_id, check_spoof=spoof)
+        faces = result["faces"]
+
+        matched = [f for f in faces if f["status"] == "matched"]
+        students = await db.read_entries([f["matched_roll"] for f in matched], fields=("roll", "name"))
+        now = datetime.now()
+        records, marked_faces = [], []
+        for face in faces:
+            face["attendance"] = "unmarked"
+            student = students.get(face["matched_roll"]) if face["status"] == "matched" else None
+            if face["status"] == "matched" and student is None:
+                face["status"] = "not_in_db"
+            if student is None:
+                continue
+            face["name"] = student.get("name")
+            records.append({"roll": student.get("roll"), "name": student.get("name"), "course": course_id, "timestamp": now.isoformat(), "date": now.strftime("%Y-%m-%d"), "similarity": face["similarity"], "status": "marked"})
+            marked_faces.append(face)
+
+        if writer is not None:
+            outcomes = await writer.enqueue_many(records)  # one stored-mark lookup, one journal fsync
+        else:
+            outcomes = (await db.bulk_insert_attendance(records))["outcomes"]
+        for face, outcome in zip(marked_faces, outcomes):
+            face["attendance"] = {"duplicate": "already_marked", "error": "error"}.get(outcome, "marked")
+
+        marked = sum(1 for f in faces if f["attendance"] == "marked")
+        logger.info(f"/mark_attendance_multi course={course_id} faces={len(faces)} marked={marked}")
+        return {"success": True, "course": course_id, "count": len(faces), "marked": marked, "scope": result["scope"], "faces": faces, "timestamp": now.isoformat()}
+    except InferenceBusyError as e:
+        return _busy({"success": False, "reason": str(e), "faces": []})
+    except ValueError as e:
+        return {"success": False, "reason": str(e), "faces": []}
+    except Exception as e:
+        logger.error(f"Error in mark_attendance_multi: {e}\n{traceback.format_exc()}")
+        return {"success": False, "reason": "Internal server error", "faces": []}
+
 def _tail_filter_log(path: str, max_lines: int, level: Optional[str], grep: Optional[str]):
     max_lines = max(1, min(max_lines, 5000))
     level = (level or "").strip().upper() or None
@@ -179,6 +432,91 @@ def _tail_filter_log(path: str, max_lines: int, level: Optional[str], grep: Opti
         meta = {"exists": True, "size": None, "mtime": None}
     return list(q), meta
 
+@app.post("/liveness/session")
+def create_liveness_session(request: Request):
+    try:
+        liveness = get_liveness()
+        session = liveness.create()
+        ws_url = str(request.url_for("liveness_stream", session_id=session.id))
+        ws_url = "ws" + ws_url[len("http"):] if ws_url.startswith("http") else ws_url
+        logger.info(f"/liveness/session opened {session.id[:8]}")
+        return {
+            "success": True,
+            "session_id": session.id,
+            "ws_url": ws_url,
+            "challenges": session.total,
+            "challenge_sec": liveness.challenge_sec,
+            "expires_in": liveness.ttl,
+            "frame_side": liveness.frame_side,
+            "max_frame_bytes": liveness.max_frame_bytes,
+        }
+    except LivenessBusyError as e:
+        return _busy({"success": False, "error": str(e)})
+    except Exception as e:
+        logger.error(f"Error in /liveness/session: {e}\n{traceback.format_exc()}")
+        return {"success": False, "error": str(e)}
+
+@app.get("/liveness/session/{session_id}")
+def get_liveness_session(session_id: str):
+    session = get_liveness().get(session_id)
+    if session is None:
+        return {"success": False, "error": "Unknown or expired liveness session"}
+    return {"success": True, **session.status()}
+
+async def _liveness_sender(websocket: WebSocket, outbox: asyncio.Queue):
+    # forwards scheduler events; returns after the verdict
+    while True:
+        event = await outbox.get()
+        await websocket.send_json(event)
+        if event.get("type") == "verdict":
+            return
+
+@app.websocket("/liveness/ws/{session_id}", name="liveness_stream")
+async def liveness_stream(websocket: WebSocket, session_id: str):
+    """Binary messages in (one JPEG frame each); JSON events out: challenge, face, result, verdict, error."""
+    liveness = get_liveness()
+    session = liveness.get(session_id)
+    if session is None or session.busy or session.verdict is not None:
+        await websocket.close(code=4404)
+        return
+    session.busy = True
+    sender = None
+    try:
+        await websocket.accept()
+        sender = asyncio.create_task(_liveness_sender(websocket, liveness.attach(session)))
+        while not sender.done():
+            receive = asyncio.ensure_future(websocket.receive())
+            done, _ = await asyncio.wait({receive, sender}, timeout=session.remaining(), return_when=asyncio.FIRST_COMPLETED)
+            if receive not in done:
+                receive.cancel()
+                if sender not in done:  # TTL reached without a verdict
+                    liveness.emit(session, [liveness.expire(session)])
+                    await sender
+                break
+            message = receive.result()
+            if message.get("type") == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            data = message.get("bytes")
+            if data:
+                liveness.submit(session, data)
+            else:
+                liveness.emit(session, [{"type": "error", "reason": "Send each frame as a binary JPEG message"}])
+        await sender
+        await websocket.close(code=1000)
+    except WebSocketDisconnect:
+        logger.info(f"/liveness/ws {session_id[:8]}: client disconnected")
+    except Exception as e:
+        logger.error(f"/liveness/ws {session_id[:8]} error: {e}\n{traceback.format_exc()}")
+        try:
+            await websocket.close(code=1011)
+        except Exception:
+            pass
+    finally:
+        if sender is not None and not sender.done():
+            sender.cancel()
+        liveness.detach(session)
+        session.busy = False
+
 @app.get("/logs", response_class=PlainTextResponse)
 def get_logs(lines: int = 200, level: Optional[str] = None, grep: Optional[str] = None, raw: bool = True):
     log_path = getattr(logger, "log_path", None)
@@ -196,38 +534,97 @@ def download_logs():
         return {"success": False, "error": "Log file not found."}
     return FileResponse(log_path, media_type="text/plain", filename="app.log")
 
+@app.get("/metrics/db")
+def get_db_metrics(writer: Optional[AttendanceWriteBehind] = Depends(get_attendance_writer)):
+    return {
+        "success": True,
+        "pool": pool_options(),
+        "metrics": db_metrics.snapshot(),
+        "write_behind": writer.stats() if writer is not None else None,
+    }
+
+@app.get("/metrics/inference")
+def get_inference_metrics():
+    ai = get_ai()
+    return {"success": True, "backend": ai.backend_stats(), "pool": ai.pool.stats(), "batching": ai.batch_stats()}
+
+@app.get("/metrics/liveness")
+def get_liveness_metrics():
+    return {"success": True, "liveness": get_liveness().stats()}
+
+@app.get("/metrics/gallery")
+def get_gallery_metrics(recall_sample: int = 0):
+    gallery = get_ai().gallery
+    out = {"success": True, "gallery": gallery.info()}
+    if recall_sample > 0:
+        out["recall"] = gallery.recall(sample=min(recall_sample, 2000))
+    return out
+
 @app.get("/get_student/{roll}")
-async def retrieve_student(roll: str):
+async def retrieve_student(request: Request, roll: str, db: DBController = Depends(get_db)):
     try:
-        db = DBController()
-        student = await db.read_entry({"roll": roll})
+        student = await db.read_entry({"roll": roll}, exclude=("embedding", "image_data"))
         if not student:
             return {"success": False, "status": "not_found", "message": f"No record found for roll {roll}"}
-        image_bytes = student.get("image_data")
-        if image_bytes:
-            student["image_base64"] = base64.b64encode(image_bytes).decode("utf-8")
-        student.pop("image_data", None)
-        student.pop("embedding", None)
-        student.pop("_id", None)
+        student = _with_image_urls(request, student)
         return {"success": True, "status": "found", "student_details": student}
     except Exception as e:
         return {"success": False, "status": "error", "message": str(e)}
 
+@app.get("/student_image/{roll}", name="student_image")
+async def student_image(
+    roll: str,
+    variant: str = "full",
+    if_none_match: Optional[str] = Header(None),
+    db: DBController = Depends(get_db),
+    store: ImageStore = Depends(get_image_store),
+):
+    try:
+        doc = await db.read_entry({"roll": roll}, fields=("image_ref",))
+        if doc is None:
+            return JSONResponse(status_code=404, content={"success": False, "message": f"No record found for roll {roll}"})
+        ref = doc.get("image_ref")
+        if not ref:
+            # not migrated yet: serve the inline bytes once, without caching help
+            legacy = await db.read_entry({"roll": roll}, fields=("image_data",))
+            data = (legacy or {}).get("image_data")
+            if not data:
+                return JSONResponse(status_code=404, content={"success": False, "message": "No image stored"})
+            return Response(content=bytes(data), media_type="image/jpeg")
+
+        thumb = variant == "thumb"
+        key = store.thumb_key(ref["sha256"]) if thumb else ref["sha256"]
+        etag = f'"{key}"'
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}  # revalidate: the roll may get a new photo
+        if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+        if thumb:
+            key = await store.thumbnail(ref["sha256"])
+        opened = await store.open(key) if key else None
+        if opened is None:
+            return JSONResponse(status_code=404, content={"success": False, "message": "Image missing from store"})
+        size, chunks = opened
+        headers["Content-Length"] = str(size)
+        media_type = "image/jpeg" if thumb else ref.get("content_type", "image/jpeg")
+        return StreamingResponse(chunks, media_type=media_type, headers=headers)
+    except Exception as e:
+        logger.error(f"Error in /student_image for roll={roll}: {e}\n{traceback.format_exc()}")
+        return JSONResponse(status_code=500, content={"success": False, "message": str(e)})
+
 @app.delete("/delete_student/{roll}")
-async def delete_student_api(roll: str):
+async def delete_student_api(roll: str, db: DBController = Depends(get_db)):
     try:
-        db = DBController()
         result = await db.delete_student(roll)
         if result == "deleted":
+            get_ai().gallery.remove(roll)  # the photo stays until the image sweep finds it unreferenced
             return {"success": True, "message": f"Student with roll {roll} deleted"}
         return {"success": False, "message": f"No student found with roll {roll}"}
     except Exception as e:
         return {"success": False, "message": str(e)}
 
 @app.get("/attendance/by_date/{date}")
-async def get_attendance_by_date(date: str):
+async def get_attendance_by_date(date: str, db: DBController = Depends(get_db)):
     try:
-        db = DBController()
         records = await db.get_attendance_by_date(date)
         if not records:
             return {"success": False, "message": "No attendance found for this date"}
@@ -236,9 +633,8 @@ async def get_attendance_by_date(date: str):
         return {"success": False, "error": str(e)}
 
 @app.get("/attendance/by_course")
-async def get_attendance_by_course(date: str, course: str):
+async def get_attendance_by_course(date: str, course: str, db: DBController = Depends(get_db)):
     try:
-        db = DBController()
         result = await db.get_attendance_by_course(date, course)
         if not result:
             return {"success": False, "message": "No records for given date & course"}
@@ -247,12 +643,107 @@ async def get_attendance_by_course(date: str, course: str):
         return {"success": False, "error": str(e)}
 
 @app.get("/attendance/by_roll")
-async def get_attendance_by_roll(date: str, roll: str):
+async def get_attendance_by_roll(date: str, roll: str, db: DBController = Depends(get_db)):
     try:
-        db = DBController()
         result = await db.get_attendance_by_roll(date, roll)
         if not result:
             return {"success": False, "message": "Not marked for this date"}
         return {"success": True, "date": date, "roll": roll, "details": result}
     except Exception as e:
         return {"success": False, "error": str(e)}
+
+def _check_range(start: str, end: str):
+    for value in (start, end):
+        datetime.strptime(value, "%Y-%m-%d")  # ValueError -> 400-style {"success": False}
+    if start > end:
+        raise ValueError("start must not be after end")
+
+def _encode_cursor(after) -> Optional[str]:
+    if after is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(after).encode("utf-8")).decode("ascii")
+
+def _decode_cursor(cursor: Optional[str]):
+    if not cursor:
+        return None
+    try:
+        after = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not (isinstance(after, list) and len(after) == 2 and all(isinstance(v, str) for v in after)):
+        raise ValueError("Invalid cursor")
+    return after
+
+@app.get("/attendance/range/by_roll")
+async def get_attendance_range_by_roll(
+    roll: str, start: str, end: str, limit: int = 100, cursor: Optional[str] = None, db: DBController = Depends(get_db)
+):
+    try:
+        _check_range(start, end)
+        rows, after = await db.attendance_range(
+            start, end, roll=roll.strip().lower(), after=_decode_cursor(cursor), limit=max(1, min(limit, 500))
+        )
+        return {"success": True, "roll": roll, "start": start, "end": end, "records": rows, "next_cursor": _encode_cursor(after)}
+    except ValueError as e:
+        return {"success": False, "error": str(e)}
+    except Exception as e:
+        logger.error(f"Error in /attendance/range/by_roll: {e}\n{traceback.format_exc()}")
+        return {"success": False, "error": str(e)}
+
+@app.get("/attendance/range/by_course")
+async def get_attendance_range_by_course(
+    course: str, start: str, end: str, limit: int = 100, cursor: Optional[str] = None, db: DBController = Depends(get_db)
+):
+    try:
+        _check_range(start, end)
+        rows, after = await db.attendance_range(
+            start, end, course=course, after=_decode_cursor(cursor), limit=max(1, min(limit, 500))
+        )
+        return {"success": True, "course": course, "start": start, "end": end, "records": rows, "next_cursor": _encode_cursor(after)}
+    except ValueError as e:
+        return {"success": False, "error": str(e)}
+    except Exception as e:
+        logger.error(f"Error in /attendance/range/by_course: {e}\n{traceback.format_exc()}")
+        return {"success": False, "error": str(e)}
+
+@app.get("/attendance/range/summary")
+async def get_attendance_range_summary(course: str, start: str, end: str, db: DBController = Depends(get_db)):
+    try:
+        _check_range(start, end)
+        summary = await db.attendance_summary(course, start, end)
+        return {"success": True, "course": course, "start": start, "end": end, **summary}
+    except ValueError as e:
+        return {"success": False, "error": str(e)}
+    except Exception as e:
+        logger.error(f"Error in /attendance/range/summary: {e}\n{traceback.format_exc()}")
+        return {"success": False, "error": str(e)}
+
+def _csv_list(value: Optional[str]):
+    items = [v.strip() for v in (value or "").split(",") if v.strip()]
+    return items or None
+
+@app.get("/attendance/export")
+async def export_attendance(
+    start: str,
+    end: str,
+    format: str = "csv",
+    courses: Optional[str] = None,
+    rolls: Optional[str] = None,
+    db: DBController = Depends(get_db),
+):
+    try:
+        _check_range(start, end)
+        exporter = AttendanceExporter(db)
+        fmt = exporter.check_format(format)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"success": False, "error": str(e)})
+    roll_list = _csv_list(rolls)
+    if roll_list:
+        roll_list = [r.lower() for r in roll_list]
+    logger.info(f"/attendance/export {fmt} start={start} end={end} courses={courses} rolls={rolls}")
+    filename = f"attendance_{start}_{end}.{fmt}"
+    return StreamingResponse(
+        exporter.stream(fmt, start, end, courses=_csv_list(courses), rolls=roll_list),
+        media_type=exporter.MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
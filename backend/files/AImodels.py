@@ -1,12 +1,22 @@
 # files/AImodels.py
+import asyncio
 import os
-from typing import List, Dict, Any, Optional
+import threading
+import time
+from typing import List, Dict, Any, Optional, Tuple
 
 import numpy as np
 import cv2
-from numpy.linalg import norm
 
+from files.batcher import MicroBatcher
 from files.db_controller import DBController
+from files.gallery import EmbeddingGallery
+from files.image_utils import DecodedImage, ImageIngest, decode_for_detection
+from files.inference_backend import (
+    BACKENDS, Detections, OnnxFaceNet, OnnxYolo, backend_info, forbid_framework_imports, from_ultralytics,
+    loaded_frameworks,
+)
+from files.inference_pool import InferencePool
 from files.logger import logger
 from dotenv import load_dotenv
 
@@ -28,6 +38,33 @@ class AIModules:
         self._yolo_spoof_cls = None     # type: ignore
         self._spoof_model = None        # YOLO spoof model instance
 
+        # ---- Inference executor + per-model locks ----
+        # Ultralytics predictors keep per-call state, so each model instance is
+        # used by one worker thread at a time; different models run in parallel.
+        self.pool = InferencePool()
+        self._load_lock = threading.Lock()
+        self._face_lock = threading.Lock()
+        self._embed_lock = threading.Lock()
+        self._spoof_lock = threading.Lock()
+
+        # ---- Micro-batchers: concurrent requests share one model call ----
+        self._face_batcher = MicroBatcher("face", self._detect_faces_batch, self.pool)
+        self._embed_batcher = MicroBatcher("embed", self._embed_faces_batch, self.pool)
+        self._spoof_batcher = MicroBatcher("spoof", self._run_yolo_spoof_batch, self.pool)
+        self._spoof_crop_batcher = MicroBatcher("spoof_crop", self._run_yolo_spoof_crop_batch, self.pool)
+
+        # ---- Inference backend: native (ultralytics + keras-facenet) | onnx (ONNX Runtime) ----
+        self.backend: str = os.environ.get("INFERENCE_BACKEND", "native").strip().lower()
+        if self.backend not in BACKENDS:
+            logger.warning(f"{self.module_name}: unknown INFERENCE_BACKEND={self.backend!r}; using 'native'")
+            self.backend = "native"
+        # onnx + strict: torch / TensorFlow / ultralytics can never be imported in this process
+        self.strict: bool = os.environ.get("INFERENCE_STRICT", "false").strip().lower() in ("1", "true", "yes")
+        if self.strict:
+            if self.backend != "onnx":
+                raise RuntimeError("INFERENCE_STRICT=true requires INFERENCE_BACKEND=onnx")
+            forbid_framework_imports()
+
         # ---- Model paths (env or defaults) ----
         # Face detector (Ultralytics YOLO) — default to your repo model
         self.face_model_path = self._resolve_path(
@@ -39,6 +76,16 @@ class AIModules:
             os.environ.get("SPOOF_MODEL_PATH"),
             default_rel="models/best.pt"  # if your file is elsewhere, set SPOOF_MODEL_PATH in .env
         )
+        # ONNX exports of the same three models (tools/export_onnx.py writes these);
+        # ONNX_PRECISION=int8 defaults to the calibrated variants from tools/quantize_onnx.py
+        self.onnx_precision: str = os.environ.get("ONNX_PRECISION", "fp32").strip().lower()
+        if self.onnx_precision not in ("fp32", "int8"):
+            logger.warning(f"{self.module_name}: unknown ONNX_PRECISION={self.onnx_precision!r}; using 'fp32'")
+            self.onnx_precision = "fp32"
+        suffix = ".int8.onnx" if self.onnx_precision == "int8" else ".onnx"
+        self.face_onnx_path = self._resolve_path(os.environ.get("FACE_ONNX_PATH"), default_rel=f"models/yolov11n-face{suffix}")
+        self.spoof_onnx_path = self._resolve_path(os.environ.get("SPOOF_ONNX_PATH"), default_rel=f"models/best{suffix}")
+        self.facenet_onnx_path = self._resolve_path(os.environ.get("FACENET_ONNX_PATH"), default_rel=f"models/facenet{suffix}")
 
         # ---- Spoof options from env (attendance_server parity) ----
         # Order must match your training!
@@ -51,9 +98,65 @@ class AIModules:
             self.img_size: int = int(os.environ.get("IMG_SIZE", 640))
         except ValueError:
             self.img_size = 640
+        try:
+            self.match_threshold: float = float(os.environ.get("MATCH_THRESHOLD", 0.6))
+        except ValueError:
+            self.match_threshold = 0.6
+        try:
+            # min IoU for a spoof-YOLO box to count as "the same face" as the face-YOLO box
+            self.face_iou_thresh: float = float(os.environ.get("SPOOF_FACE_IOU", 0.3))
+        except ValueError:
+            self.face_iou_thresh = 0.3
+        # off: always 1:N | auto: course partition when it has members, else 1:N | strict: course partition only
+        self.course_scope: str = os.environ.get("MATCH_COURSE_SCOPE", "auto").strip().lower()
+        if self.course_scope not in ("off", "auto", "strict"):
+            logger.warning(f"{self.module_name}: unknown MATCH_COURSE_SCOPE={self.course_scope!r}; using 'auto'")
+            self.course_scope = "auto"
+        # verify: 1:1 against the claimed roll | identify: 1:N search, then compare
+        self.match_mode: str = os.environ.get("MATCH_MODE", "verify").strip().lower()
+        if self.match_mode not in ("verify", "identify"):
+            logger.warning(f"{self.module_name}: unknown MATCH_MODE={self.match_mode!r}; using 'verify'")
+            self.match_mode = "verify"
+        # in verify mode, also run the 1:N search and log when it disagrees with the claimed roll
+        self.match_audit: bool = os.environ.get("MATCH_AUDIT_IDENTIFY", "false").strip().lower() in ("1", "true", "yes")
+
+        # ---- Spoof mode: full frame at IMG_SIZE | crop around each detected face at SPOOF_CROP_SIZE ----
+        self.spoof_mode: str = os.environ.get("SPOOF_MODE", "full").strip().lower()
+        if self.spoof_mode not in ("full", "crop"):
+            logger.warning(f"{self.module_name}: unknown SPOOF_MODE={self.spoof_mode!r}; using 'full'")
+            self.spoof_mode = "full"
+        try:
+            # margins in % of the face box, as offsetW/offsetH in dataCollector.py (the training labels)
+            self.spoof_offset_w: float = float(os.environ.get("SPOOF_OFFSET_W", 10))
+            self.spoof_offset_h: float = float(os.environ.get("SPOOF_OFFSET_H", 15))
+        except ValueError:
+            self.spoof_offset_w, self.spoof_offset_h = 10.0, 15.0
+        try:
+            self.spoof_crop_size: int = int(os.environ.get("SPOOF_CROP_SIZE", 320))
+        except ValueError:
+            self.spoof_crop_size = 320
+
+        # ---- Reduced-resolution JPEG decode for detection ----
+        self.reduced_decode: bool = os.environ.get("DECODE_REDUCED", "true").strip().lower() in ("1", "true", "yes")
+        try:
+            # faces narrower than this in the reduced frame are cropped from a full-res decode instead
+            self.face_min_crop: int = int(os.environ.get("FACE_MIN_CROP_PX", 160))
+        except ValueError:
+            self.face_min_crop = 160
+        try:
+            # multi-face check-in: largest N faces per frame are embedded and matched
+            self.multi_face_max: int = max(1, int(os.environ.get("MULTI_FACE_MAX", 32)))
+        except ValueError:
+            self.multi_face_max = 32
+
+        # ---- Upload normalization (size limits, downscale, re-encode) ----
+        self.ingest = ImageIngest()
+
+        # ---- Resident embedding gallery (filled at lifespan startup) ----
+        self.gallery = EmbeddingGallery()
 
         logger.info(
-            f"{self.module_name} init (v{self.version}) | "
+            f"{self.module_name} init (v{self.version}) | backend={self.backend} | "
             f"FACE_MODEL_PATH={self.face_model_path} | SPOOF_MODEL_PATH={self.spoof_model_path}"
         )
 
@@ -88,6 +191,13 @@ class AIModules:
                 self._facenet_cls = None
 
     def _ensure_face_models(self):
+        with self._load_lock:
+            self._load_face_models()
+
+    def _load_face_models(self):
+        if self.backend == "onnx":
+            self._load_face_models_onnx()
+            return
         self._ensure_face_classes()
 
         if self.detector is None:
@@ -112,6 +222,22 @@ class AIModules:
                 logger.error(f"{self.module_name}: FaceNet load failed: {e}")
                 self.embedder = None
 
+    def _load_face_models_onnx(self):
+        if self.detector is None:
+            try:
+                self.detector = OnnxYolo(self.face_onnx_path, imgsz=self.img_size)
+                logger.info(f"{self.module_name}: ONNX face detector loaded from {self.face_onnx_path}")
+            except Exception as e:
+                logger.error(f"{self.module_name}: ONNX face load failed: {e}")
+                self.detector = None
+        if self.embedder is None:
+            try:
+                self.embedder = OnnxFaceNet(self.facenet_onnx_path)
+                logger.info(f"{self.module_name}: ONNX FaceNet loaded from {self.facenet_onnx_path}")
+            except Exception as e:
+                logger.error(f"{self.module_name}: ONNX FaceNet load failed: {e}")
+                self.embedder = None
+
     # ---------------- Spoof model lazy loaders ----------------
     def _ensure_spoof_class(self):
         if self._yolo_spoof_cls is None:
@@ -123,6 +249,19 @@ class AIModules:
                 self._yolo_spoof_cls = None
 
     def _ensure_spoof_model(self):
+        with self._load_lock:
+            self._load_spoof_model()
+
+    def _load_spoof_model(self):
+        if self.backend == "onnx":
+            if self._spoof_model is None:
+                try:
+                    self._spoof_model = OnnxYolo(self.spoof_onnx_path, imgsz=self.img_size, conf=self.conf_thresh)
+                    logger.info(f"{self.module_name}: ONNX spoof model loaded from {self.spoof_onnx_path}")
+                except Exception as e:
+                    logger.error(f"{self.module_name}: ONNX spoof load failed: {e}")
+                    self._spoof_model = None
+            return
         self._ensure_spoof_class()
         if self._spoof_model is None:
             if self._yolo_spoof_cls is None:
@@ -137,218 +276,513 @@ class AIModules:
                 self._spoof_model = None
 
     # ---------------- Face API ----------------
-    async def create_embeddings(self, roll: str, image_bytes: bytes) -> List[float]:
-        """Create FaceNet embedding from the first detected face."""
+    def _require_face_models(self):
         self._ensure_face_models()
         if self.embedder is None or self.detector is None:
             raise RuntimeError("Face models not initialized")
 
-        np_img = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(np_img, cv2.IMREAD_COLOR)
-        if img is None:
-            raise ValueError("Invalid image bytes")
-
-        # Run YOLO face on BGR image
-        results = self.detector(img)
-        if not results or len(results[0].boxes) == 0:
-            raise ValueError("No face detected")
+    @staticmethod
+    def _yolo(model, frames: List[np.ndarray], **kwargs) -> List[Detections]:
+        """Run a YOLO model of either backend over a batch of BGR frames."""
+        if isinstance(model, OnnxYolo):
+            return model.predict(frames, conf=kwargs.get("conf"), imgsz=kwargs.get("imgsz"))
+        return [from_ultralytics(r) for r in model(frames, verbose=False, **kwargs)]
+
+    def _detect_faces_batch(self, frames: List[np.ndarray]) -> List[np.ndarray]:
+        """One YOLO face call for the whole batch; returns an (N, 4) xyxy array per frame."""
+        self._require_face_models()
+        with self._face_lock:
+            results = self._yolo(self.detector, frames)
+        return [r.xyxy for r in results]
 
-        # First detection only
-        x1, y1, x2, y2 = map(int, results[0].boxes.xyxy[0])
-        h, w = img.shape[:2]
+    @staticmethod
+    def _face_crop(frame: np.ndarray, box) -> Optional[np.ndarray]:
+        """Clamp the box to the frame and return the 160x160 RGB FaceNet input, or None if empty."""
+        x1, y1, x2, y2 = map(int, box)
+        h, w = frame.shape[:2]
         x1, y1 = max(0, x1), max(0, y1)
         x2, y2 = min(w, x2), min(h, y2)
 
-        face = img[y1:y2, x1:x2]
+        face = frame[y1:y2, x1:x2]
         if face.size == 0:
-            raise ValueError("Empty face crop")
+            return None
 
         face_rgb = cv2.cvtColor(face, cv2.COLOR_BGR2RGB)
-        face_resized = cv2.resize(face_rgb, (160, 160))
-        face_input = np.expand_dims(face_resized, axis=0)
-
-        embedding = self.embedder.embeddings(face_input)[0]
-        logger.info(f"{self.module_name}: embeddings created for roll={roll}")
-        return embedding.tolist()
-
-    async def match_face(self, roll: str, image_bytes: bytes) -> Dict[str, Any]:
-        """Return best matching roll (cosine similarity) from stored embeddings."""
-        self._ensure_face_models()
-        if self.embedder is None or self.detector is None:
-            raise RuntimeError("Face models not initialized")
+        return cv2.resize(face_rgb, (160, 160))
 
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        if frame is None:
-            return {"matched_roll": None, "similarity": 0.0}
+    def _embed_faces_batch(self, items: List[Tuple[Any, np.ndarray]]) -> List[Optional[np.ndarray]]:
+        """
+        Crop every (frame, box) pair and embed all valid crops in a single FaceNet call.
+        A DecodedImage source picks reduced vs full-resolution pixels per face.
+        """
+        self._require_face_models()
+        crops = []
+        for src, box in items:
+            if isinstance(src, DecodedImage):
+                src, box = src.crop_source(box, self.face_min_crop)
+            crops.append(self._face_crop(src, box))
+        out: List[Optional[np.ndarray]] = [None] * len(items)
+        valid = [i for i, c in enumerate(crops) if c is not None]
+        if valid:
+            with self._embed_lock:
+                embeddings = self.embedder.embeddings(np.stack([crops[i] for i in valid]))
+            for row, i in enumerate(valid):
+                out[i] = embeddings[row]
+        return out
+
+    async def _embed_first_face(self, image) -> Optional[np.ndarray]:
+        """Detect faces on a BGR frame (or DecodedImage) and embed the first one; None if nothing usable."""
+        boxes = await self._face_batcher.submit(image.frame if isinstance(image, DecodedImage) else image)
+        if len(boxes) == 0:
+            return None
+        # First detection only
+        return await self._embed_batcher.submit((image, boxes[0]))
 
-        results = self.detector(frame)
-        if not results or len(results[0].boxes) == 0:
-            return {"matched_roll": None, "similarity": 0.0}
+    def _decode(self, image_bytes: bytes) -> Optional[DecodedImage]:
+        """Decode an upload for detection: reduced JPEG scale covering IMG_SIZE when DECODE_REDUCED is on."""
+        return decode_for_detection(image_bytes, self.img_size if self.reduced_decode else 0)
 
-        x1, y1, x2, y2 = map(int, results[0].boxes.xyxy[0])
-        h, w = frame.shape[:2]
-        x1, y1 = max(0, x1), max(0, y1)
-        x2, y2 = min(w, x2), min(h, y2)
+    @staticmethod
+    def _scale_detections(detections: Detections, image: DecodedImage) -> Detections:
+        # report boxes in the coordinates of the uploaded image, whatever scale YOLO saw
+        if image.factor == 1:
+            return detections
+        return Detections(detections.xyxy * np.float32(image.factor), detections.conf, detections.cls)
 
-        face = frame[y1:y2, x1:x2]
-        if face.size == 0:
-            return {"matched_roll": None, "similarity": 0.0}
+    async def create_embeddings(self, roll: str, image_bytes: bytes) -> List[float]:
+        """Create FaceNet embedding from the first detected face."""
+        async with self.pool.admit():
+            img = await self.pool.run(self._decode, image_bytes)
+            if img is None:
+                raise ValueError("Invalid image bytes")
+            embedding = await self._embed_first_face(img)
 
-        face_rgb = cv2.cvtColor(face, cv2.COLOR_BGR2RGB)
-        face_resized = cv2.resize(face_rgb, (160, 160))
-        face_input = np.expand_dims(face_resized, axis=0)
-        input_embedding = self.embedder.embeddings(face_input)[0]
-
-        # Compare with DB
-        db = DBController()
-        students = await db.fetch_all_entries()
-        if not students:
-            return {"matched_roll": None, "similarity": 0.0}
+        if embedding is None:
+            raise ValueError("No face detected")
+        logger.info(f"{self.module_name}: embeddings created for roll={roll}")
+        return embedding.tolist()
 
-        best_score = -1.0
-        best_roll: Optional[str] = None
+    async def ingest_and_embed(self, roll: str, image_bytes: bytes) -> Tuple[List[float], bytes, Dict[str, Any]]:
+        """
+        Registration path: normalize the upload once (see ImageIngest), then detect and embed
+        on that same frame. Returns (embedding, normalized JPEG bytes to store, meta with timings).
+        """
+        async with self.pool.admit():
+            frame, normalized, meta = await self.pool.run(self.ingest.normalize, image_bytes)
+            t0 = time.perf_counter()
+            embedding = await self._embed_first_face(frame)
+            meta["timings"]["embed_ms"] = round((time.perf_counter() - t0) * 1000.0, 3)
 
-        for s in students:
-            emb = s.get("embedding")
-            if not emb:
-                continue
-            emb_arr = np.asarray(emb, dtype=np.float32)
-            denom = float(norm(input_embedding) * norm(emb_arr))
-            if denom == 0.0:
-                continue
-            score = float(np.dot(input_embedding, emb_arr) / denom)
-            if score > best_score:
-                best_score = score
-                best_roll = s.get("roll")
+        if embedding is None:
+            raise ValueError("No face detected")
+        logger.info(f"{self.module_name}: embeddings created for roll={roll}")
+        return embedding.tolist(), normalized, meta
 
-        if best_roll is not None and best_score > 0.6:
-            logger.info(f"{self.module_name}: matched roll={best_roll} score={best_score:.3f}")
-            return {"matched_roll": best_roll, "similarity": float(best_score)}
+    async def match_face(
+        self, roll: str, image_bytes: bytes, db: Optional[DBController] = None, course: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Match the first face in the image. With a known `roll` and MATCH_MODE=verify this is a
+        1:1 check against that student; otherwise the best roll from the in-memory gallery
+        (scoped to `course` if given) is returned.
+        """
+        async with self.pool.admit():
+            image = await self.pool.run(self._decode, image_bytes)
+            input_embedding = await self._embed_first_face(image) if image is not None else None
+        if input_embedding is None:
+            return {"matched_roll": None, "similarity": 0.0}
+        return await self._match_claim(input_embedding, roll, db, course)
+
+    async def _match_claim(
+        self, embedding: np.ndarray, roll: Optional[str], db: Optional[DBController], course: Optional[str]
+    ) -> Dict[str, Any]:
+        if self.match_mode == "verify" and roll and roll.strip().lower() != "unknown":
+            return await self._verify_embedding(embedding, roll, db, course)
+        return await self._match_embedding(embedding, db, course)
+
+    async def _claimed_vector(self, roll: str, db: Optional[DBController]) -> Optional[np.ndarray]:
+        """Fetch one student's embedding from Mongo when the gallery does not hold it (yet)."""
+        doc = await (db or DBController()).read_entry({"roll": roll}, fields=("roll", "embedding", "courses"))
+        if not doc or not doc.get("embedding"):
+            return None
+        if self.gallery.loaded:
+            self.gallery.upsert(roll, doc["embedding"], courses=doc.get("courses") or ())
+        vec = np.asarray(doc["embedding"], dtype=np.float32)
+        norm = float(np.linalg.norm(vec))
+        return vec / norm if norm > 0 else None
+
+    async def _verify_embedding(
+        self, input_embedding: np.ndarray, roll: str, db: Optional[DBController] = None, course: Optional[str] = None
+    ) -> Dict[str, Any]:
+        roll = roll.strip().lower()
+        scope = self._match_scope(course)
+        result = {"matched_roll": None, "similarity": 0.0, "scope": scope or "all", "mode": "verify"}
+        if scope and self.gallery.loaded and not self.gallery.enrolled(roll, scope):
+            logger.info(f"{self.module_name}: roll={roll} not enrolled in course={scope}")
+            return result
+
+        score = self.gallery.score(roll, input_embedding)
+        if score is None:
+            stored = await self._claimed_vector(roll, db)
+            if stored is None:
+                logger.info(f"{self.module_name}: no stored embedding for roll={roll}")
+                return result
+            probe = np.asarray(input_embedding, dtype=np.float32).reshape(-1)
+            norm = float(np.linalg.norm(probe))
+            score = float(stored @ probe / norm) if norm > 0 else 0.0
+
+        result["similarity"] = max(score, 0.0)
+        if score > self.match_threshold:
+            result["matched_roll"] = roll
+            logger.info(f"{self.module_name}: verified roll={roll} score={score:.3f}")
+        else:
+            logger.info(f"{self.module_name}: verification failed for roll={roll} (score={score:.3f})")
+
+        if self.match_audit and self.gallery.loaded:
+            best_roll, best_score = self.gallery.search(input_embedding, course=scope)
+            if best_roll is not None and best_roll != roll and best_score > self.match_threshold:
+                logger.warning(
+                    f"{self.module_name}: audit | claimed roll={roll} ({score:.3f}) but 1:N best is "
+                    f"roll={best_roll} ({best_score:.3f})"
+                )
+        return result
+
+    def _match_scope(self, course: Optional[str]) -> Optional[str]:
+        """Course partition to search per MATCH_COURSE_SCOPE, or None for the whole gallery."""
+        if not course or self.course_scope == "off":
+            return None
+        if self.course_scope == "strict" or self.gallery.has_course(course):
+            return course
+        return None
+
+    async def _match_embedding(
+        self, input_embedding: np.ndarray, db: Optional[DBController] = None, course: Optional[str] = None
+    ) -> Dict[str, Any]:
+        # Compare against the resident gallery (built lazily if startup could not reach the DB)
+        if not self.gallery.loaded:
+            await self.gallery.load(db or DBController())
+        scope = self._match_scope(course)
+        best_roll, best_score = self.gallery.search(input_embedding, course=scope)
+
+        if best_roll is not None and best_score > self.match_threshold:
+            logger.info(f"{self.module_name}: matched roll={best_roll} score={best_score:.3f} scope={scope or 'all'}")
+            return {"matched_roll": best_roll, "similarity": float(best_score), "scope": scope or "all"}
+
+        logger.info(f"{self.module_name}: no good match (best={best_score:.3f}) scope={scope or 'all'}")
+        return {"matched_roll": None, "similarity": float(best_score if best_score >= 0 else 0.0), "scope": scope or "all"}
+
+    # ---------------- Combined check-in ----------------
+    async def spoof_and_match(
+        self,
+        image_bytes: bytes,
+        db: Optional[DBController] = None,
+        course: Optional[str] = None,
+        roll: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        Decode once (reduced JPEG scale when possible), run spoof YOLO and face YOLO
+        concurrently on the same frame (SPOOF_MODE=crop: face first, then spoof on its crop),
+        and only embed + match when the face that would be matched is judged live.
+        """
+        async with self.pool.admit():
+            image = await self.pool.run(self._decode, image_bytes)
+            if image is None:
+                raise ValueError("Invalid image file")
+            if self.spoof_mode == "crop":
+                boxes = await self._face_batcher.submit(image.frame)
+                detections = (await self._spoof_on_faces(image, boxes[:1]))[0] if len(boxes) else Detections.empty()
+            else:
+                detections, boxes = await asyncio.gather(
+                    self._spoof_batcher.submit(image.frame),
+                    self._face_batcher.submit(image.frame),
+                )
+                detections = self._scale_detections(detections, image)
+            face_box = boxes[0] if len(boxes) else None
+            full_box = None if face_box is None else np.asarray(face_box, dtype=np.float32) * image.factor
+            spoof = self._reconcile_spoof(self._summarize_spoof(detections), detections, full_box)
+
+            embedding = None
+            if face_box is not None and not spoof["is_spoof"] and spoof["overall"] != "no_face":
+                embedding = await self._embed_batcher.submit((image, face_box))
+
+        match = {"matched_roll": None, "similarity": 0.0}
+        if embedding is not None:
+            match = await self._match_claim(embedding, roll, db, course)
+        return {"spoof": spoof, "face_found": face_box is not None, "embedded": embedding is not None, "match": match}
+
+    # ---------------- Multi-face check-in ----------------
+    async def match_faces(
+        self,
+        image_bytes: bytes,
+        db: Optional[DBController] = None,
+        course: Optional[str] = None,
+        check_spoof: bool = True,
+    ) -> Dict[str, Any]:
+        """
+        Match every face in one frame (e.g. a classroom camera). Faces are detected once,
+        the largest MULTI_FACE_MAX are cropped and embedded in a single FaceNet batch, and
+        the batch is scored against the gallery with one matrix product
+        (``EmbeddingGallery.search_many``). With `check_spoof`, each face is paired with
+        the spoof box it overlaps and faces labelled spoof are not embedded.
+
+        Each entry of ``faces`` has box (original image coordinates), spoof, matched_roll,
+        similarity and status: matched | no_match | spoof | no_embedding | duplicate
+        (the same roll already matched by a better-scoring face in this frame).
+        """
+        async with self.pool.admit():
+            image = await self.pool.run(self._decode, image_bytes)
+            if image is None:
+                raise ValueError("Invalid image file")
+            if check_spoof and self.spoof_mode == "full":
+                detections, boxes = await asyncio.gather(
+                    self._spoof_batcher.submit(image.frame),
+                    self._face_batcher.submit(image.frame),
+                )
+                detections = self._scale_detections(detections, image)
+            else:
+                detections, boxes = Detections.empty(), await self._face_batcher.submit(image.frame)
+
+            boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+            areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+            boxes = boxes[np.argsort(-areas, kind="stable")[: self.multi_face_max]]
+            per_face = await self._spoof_on_faces(image, boxes) if check_spoof and self.spoof_mode == "crop" else None
+
+            faces: List[Dict[str, Any]] = []
+            to_embed: List[int] = []
+            for i, box in enumerate(boxes):
+                full_box = box * image.factor
+                spoof = None
+                if check_spoof:
+                    spoof = self._face_spoof_detection(per_face[i] if per_face is not None else detections, full_box)
+                is_spoof = spoof is not None and str(spoof.get("label", "")).lower() == "spoof"
+                faces.append({
+                    "box": [round(float(v), 1) for v in full_box],
+                    "spoof": spoof,
+                    "matched_roll": None,
+                    "similarity": 0.0,
+                    "status": "spoof" if is_spoof else "no_embedding",
+                })
+                if not is_spoof:
+                    to_embed.append(i)
+
+            embeddings: List[Optional[np.ndarray]] = []
+            if to_embed:
+                # already a batch: one FaceNet call, no need to go through the embed micro-batcher
+                embeddings = await self.pool.run(self._embed_faces_batch, [(image, boxes[i]) for i in to_embed])
+
+        scope = self._match_scope(course)
+        embedded = [(i, e) for i, e in zip(to_embed, embeddings) if e is not None]
+        if embedded:
+            if not self.gallery.loaded:
+                await self.gallery.load(db or DBController())
+            results = self.gallery.search_many(np.stack([e for _, e in embedded]), course=scope)
+            best_face: Dict[str, int] = {}
+            for (i, _), (best_roll, score) in zip(embedded, results):
+                face = faces[i]
+                face["similarity"] = float(max(score, 0.0))
+                if best_roll is None or score <= self.match_threshold:
+                    face["status"] = "no_match"
+                    continue
+                face["matched_roll"] = best_roll
+                face["status"] = "matched"
+                other = best_face.get(best_roll)
+                if other is None or faces[other]["similarity"] < face["similarity"]:
+                    if other is not None:
+                        faces[other]["status"] = "duplicate"
+                    best_face[best_roll] = i
+                else:
+                    face["status"] = "duplicate"
+
+        matched = sum(1 for f in faces if f["status"] == "matched")
+        logger.info(
+            f"{self.module_name}: multi-face | faces={len(faces)} embedded={len(embedded)} matched={matched} "
+            f"scope={scope or 'all'}"
+        )
+        return {"faces": faces, "count": len(faces), "matched": matched, "scope": scope or "all"}
 
-        logger.info(f"{self.module_name}: no good match (best={best_score:.3f})")
-        return {"matched_roll": None, "similarity": float(best_score if best_score >= 0 else 0.0)}
+    def _reconcile_spoof(self, summary: Dict[str, Any], detections: Detections, face_box) -> Dict[str, Any]:
+        """
+        Tie the spoof verdict to the face that will be matched: the spoof box with the
+        highest IoU against the face-detector box is reported as `face_detection`, and a
+        'spoof' label there blocks the check-in even if the frame-level tally says 'real'.
+        """
+        summary["face_detection"] = self._face_spoof_detection(detections, face_box)
+        if summary["face_detection"] is not None and str(summary["face_detection"].get("label", "")).lower() == "spoof":
+            summary["is_spoof"] = True
+        return summary
 
-    # ---------------- Spoof API (parity with attendance_server.py) ----------------
     @staticmethod
-    def _read_imagefile(file_bytes: bytes):
-        try:
-            arr = np.frombuffer(file_bytes, dtype=np.uint8)
-            img = cv2.imdecode(arr, cv2.IMREAD_COLOR)  # BGR
-            return img
-        except Exception:
+    def _ious(box, xyxy: np.ndarray) -> np.ndarray:
+        """IoU of one xyxy box against an (N, 4) array."""
+        x1, y1, x2, y2 = (float(v) for v in box)
+        iw = (np.minimum(xyxy[:, 2], x2) - np.maximum(xyxy[:, 0], x1)).clip(min=0)
+        ih = (np.minimum(xyxy[:, 3], y2) - np.maximum(xyxy[:, 1], y1)).clip(min=0)
+        inter = iw * ih
+        union = (x2 - x1) * (y2 - y1) + (xyxy[:, 2] - xyxy[:, 0]) * (xyxy[:, 3] - xyxy[:, 1]) - inter
+        return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+    def _face_spoof_detection(self, detections: Detections, face_box) -> Optional[Dict[str, Any]]:
+        """The spoof detection overlapping `face_box` best (with its IoU), if it clears SPOOF_FACE_IOU."""
+        if face_box is None or not len(detections):
             return None
+        ious = self._ious(face_box, detections.xyxy)
+        best = int(np.argmax(ious))
+        if ious[best] < self.face_iou_thresh:
+            return None
+        picked = Detections(detections.xyxy[best:best + 1], detections.conf[best:best + 1], detections.cls[best:best + 1])
+        return {**self._spoof_detections(picked)[0], "iou": round(float(ious[best]), 3)}
 
-    def _run_yolo_spoof(self, bgr_img) -> List[Dict[str, Any]]:
-        """
-        Equivalent to attendance_server.run_yolo_on_image().
-        Returns list of detections with: x1,y1,x2,y2,conf,cls,label,probs
-        """
+    # ---------------- Spoof API (parity with attendance_server.py) ----------------
+    def _run_yolo_spoof_batch(self, frames: List[np.ndarray], imgsz: Optional[int] = None) -> List[Detections]:
+        """Run the spoof YOLO once over a list of BGR frames; one Detections (arrays) per frame."""
         self._ensure_spoof_model()
         if self._spoof_model is None:
             raise RuntimeError("Spoof model not initialized")
 
-        if bgr_img is None:
-            return []
-
         try:
-            res = self._spoof_model(
-                bgr_img,
-                conf=self.conf_thresh,
-                imgsz=self.img_size,
-                verbose=False
-            )[0]
+            with self._spoof_lock:
+                return self._yolo(self._spoof_model, frames, conf=self.conf_thresh, imgsz=imgsz or self.img_size)
         except Exception as e:
             raise RuntimeError(f"Inference error: {e}")
 
-        detections: List[Dict[str, Any]] = []
-        boxes = getattr(res, "boxes", None)
-        if not boxes:
-            return detections
+    def _run_yolo_spoof_crop_batch(self, crops: List[np.ndarray]) -> List[Detections]:
+        """Spoof YOLO over face crops at the small SPOOF_CROP_SIZE input."""
+        return self._run_yolo_spoof_batch(crops, imgsz=self.spoof_crop_size)
+
+    def _spoof_crop_box(self, box, shape) -> Tuple[int, int, int, int]:
+        """Face box grown like dataCollector.py labels: +-offsetW% sideways, 2x offsetH% up, 0.5x down."""
+        x1, y1, x2, y2 = (float(v) for v in box)
+        dw = int(self.spoof_offset_w / 100.0 * (x2 - x1))
+        dh = int(self.spoof_offset_h / 100.0 * (y2 - y1))
+        h, w = shape[:2]
+        return (
+            max(0, int(x1) - dw), max(0, int(y1) - 2 * dh),
+            min(w, int(x2) + dw), min(h, int(y2) + int(dh * 0.5)),
+        )
 
+    async def _spoof_on_faces(self, image: DecodedImage, boxes) -> List[Detections]:
+        """
+        SPOOF_MODE=crop: one margin-expanded crop per face box (reduced-frame coordinates),
+        all sent through the spoof-crop micro-batcher. Small faces are cropped from a
+        full-resolution decode. Detections come back in original-image coordinates.
+        """
+        jobs, placements = [], []
         for box in boxes:
-            # xyxy
-            try:
-                xy = box.xyxy[0].tolist()
-            except Exception:
-                try:
-                    xy = [float(x) for x in box.xyxy]
-                except Exception:
-                    xy = [0.0, 0.0, 0.0, 0.0]
-
-            # cls & conf
-            try:
-                cls_id = int(box.cls)
-            except Exception:
-                cls_id = int(getattr(box, "cls", -1) or -1)
-
-            try:
-                conf = float(box.conf)
-            except Exception:
-                conf = 0.0
-
-            x1, y1, x2, y2 = [float(v) for v in xy]
-
-            # 2-class heuristic probs like your server
-            probs: Optional[List[float]] = None
-            if len(self.class_names) == 2 and 0 <= cls_id < 2:
-                probs = [0.0, 0.0]
-                probs[cls_id] = conf
-                probs[1 - cls_id] = max(0.0, 1.0 - conf)
-
-            detections.append({
-                "x1": x1, "y1": y1, "x2": x2, "y2": y2,
-                "conf": conf,
-                "cls": cls_id,
-                "label": self.class_names[cls_id] if 0 <= cls_id < len(self.class_names) else str(cls_id),
-                "probs": probs
-            })
-
-        return detections
-
-    def spoof_detect(self, image_bytes: bytes) -> Dict[str, Any]:
+            src, src_box = image.crop_source(box, self.spoof_crop_size)
+            x1, y1, x2, y2 = self._spoof_crop_box(src_box, src.shape)
+            if x2 <= x1 or y2 <= y1:
+                placements.append(None)
+                continue
+            placements.append((x1, y1, image.factor if src is image.frame else 1))
+            jobs.append(self._spoof_crop_batcher.submit(src[y1:y2, x1:x2]))
+        results = iter(await asyncio.gather(*jobs))
+        out: List[Detections] = []
+        for placed in placements:
+            if placed is None:
+                out.append(Detections.empty())
+                continue
+            det = next(results)
+            x1, y1, scale = placed
+            shift = np.array([x1, y1, x1, y1], dtype=np.float32)
+            out.append(Detections((det.xyxy + shift) * np.float32(scale), det.conf, det.cls))
+        return out
+
+    def _label_kinds(self) -> np.ndarray:
+        """Class id -> 0 real / 1 spoof / 2 unknown, plus a trailing 2 for out-of-range ids."""
+        names = [n.strip().lower() for n in self.class_names]
+        return np.array([0 if n == "real" else 1 if n == "spoof" else 2 for n in names] + [2], dtype=np.int64)
+
+    def _spoof_detections(self, res: Detections) -> List[Dict[str, Any]]:
+        """Per-detection dicts (x1,y1,x2,y2,conf,cls,label,probs) for the JSON response."""
+        n = len(res)
+        if n == 0:
+            return []
+        cls = res.cls.astype(np.int64)
+        conf = res.conf.astype(np.float64)
+        labels = [self.class_names[c] if 0 <= c < len(self.class_names) else str(c) for c in cls.tolist()]
+        # 2-class heuristic probs like your server
+        probs: List[Optional[List[float]]] = [None] * n
+        if len(self.class_names) == 2:
+            two = np.stack([np.where(cls == 0, conf, 1.0 - conf), np.where(cls == 1, conf, 1.0 - conf)], axis=1).clip(min=0.0)
+            valid = (cls >= 0) & (cls < 2)
+            probs = [p if ok else None for p, ok in zip(two.tolist(), valid.tolist())]
+        return [
+            {"x1": x1, "y1": y1, "x2": x2, "y2": y2, "conf": c, "cls": k, "label": lbl, "probs": pr}
+            for (x1, y1, x2, y2), c, k, lbl, pr in zip(res.xyxy.tolist(), conf.tolist(), cls.tolist(), labels, probs)
+        ]
+
+    def _summarize_spoof(self, detections: Detections, compact: bool = False) -> Dict[str, Any]:
         """
-        Mirror attendance_server /api/attendance decision:
-        - decode
-        - run YOLO
-        - tally 'real' vs 'spoof'
-        - choose overall: 'real' | 'spoof' | 'no_face' | best-by-conf (on tie/unknown)
-        - return boolean is_spoof along with details
+        Tally and verdict on whole arrays: one bincount for the label counts, one argmax for
+        the best-by-conf tie-break. `compact` leaves out the per-detection dicts.
         """
-        bgr = self._read_imagefile(image_bytes)
-        if bgr is None:
-            raise ValueError("Invalid image file")
-
-        detections = self._run_yolo_spoof(bgr)
-
-        counts = {"real": 0, "spoof": 0, "no_face": 0, "unknown": 0}
-        for d in detections:
-            lbl = str(d.get("label", "")).lower()
-            if lbl == "real":
-                counts["real"] += 1
-            elif lbl == "spoof":
-                counts["spoof"] += 1
-            else:
-                counts["unknown"] += 1
+        n = len(detections)
+        kinds = self._label_kinds()
+        cls = detections.cls.astype(np.int64)
+        tally = np.bincount(kinds[np.where((cls >= 0) & (cls < len(kinds) - 1), cls, -1)], minlength=3)
+        counts = {"real": int(tally[0]), "spoof": int(tally[1]), "no_face": 0, "unknown": int(tally[2])}
 
-        if not detections:
+        if n == 0:
             overall = "no_face"
+        elif counts["real"] > counts["spoof"]:
+            overall = "real"
+        elif counts["spoof"] > counts["real"]:
+            overall = "spoof"
         else:
-            if counts["real"] > counts["spoof"]:
-                overall = "real"
-            elif counts["spoof"] > counts["real"]:
-                overall = "spoof"
+            # tie / unknown -> pick highest conf label
+            best = int(cls[int(np.argmax(detections.conf))])
+            overall = (self.class_names[best] if 0 <= best < len(self.class_names) else str(best)).lower()
+
+        summary = {"is_spoof": overall == "spoof", "overall": overall, "counts": counts, "count": n}
+        if not compact:
+            summary["detections"] = self._spoof_detections(detections)
+        return summary
+
+    async def detect_spoof(self, image_bytes: bytes, compact: bool = False) -> Dict[str, Any]:
+        """Spoof verdict for one image: decode on the executor, YOLO via the spoof micro-batcher."""
+        async with self.pool.admit():
+            image = await self.pool.run(self._decode, image_bytes)
+            if image is None:
+                raise ValueError("Invalid image file")
+            if self.spoof_mode == "crop":
+                boxes = (await self._face_batcher.submit(image.frame))[: self.multi_face_max]
+                detections = Detections.concat(await self._spoof_on_faces(image, boxes))
             else:
-                # tie / unknown -> pick highest conf label
-                best = max(detections, key=lambda x: x.get("conf", 0.0))
-                overall = str(best.get("label", "unknown")).lower()
-
-        is_spoof = (overall == "spoof")
-
-        return {
-            "is_spoof": bool(is_spoof),
-            "overall": overall,
-            "counts": counts,
-            "detections": detections,
-            "count": len(detections),
+                detections = self._scale_detections(await self._spoof_batcher.submit(image.frame), image)
+        return self._summarize_spoof(detections, compact=compact)
+
+    def warmup(self) -> Dict[str, float]:
+        """
+        Load all three models and run each once on a blank frame, so the first request does not
+        pay for session creation and first-call graph optimization. Returns per-model ms.
+        """
+        timings: Dict[str, float] = {}
+        frame = np.zeros((self.img_size, self.img_size, 3), dtype=np.uint8)
+        t0 = time.perf_counter()
+        self._detect_faces_batch([frame])
+        timings["face_ms"] = (time.perf_counter() - t0) * 1000.0
+        t0 = time.perf_counter()
+        self._embed_faces_batch([(frame, (0, 0, 160, 160))])
+        timings["embed_ms"] = (time.perf_counter() - t0) * 1000.0
+        t0 = time.perf_counter()
+        if self.spoof_mode == "crop":
+            self._run_yolo_spoof_crop_batch([frame[: self.spoof_crop_size, : self.spoof_crop_size]])
+        else:
+            self._run_yolo_spoof_batch([frame])
+        timings["spoof_ms"] = (time.perf_counter() - t0) * 1000.0
+        timings = {k: round(v, 1) for k, v in timings.items()}
+        logger.info(f"{self.module_name}: warm-up done ({self.backend}) | {timings}")
+        return timings
+
+    def backend_stats(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {
+            "backend": self.backend, "strict": self.strict, "frameworks_loaded": loaded_frameworks(), "spoof_mode": self.spoof_mode,
         }
+        if self.backend == "onnx":
+            out["precision"] = self.onnx_precision
+            out.update(backend_info())
+        return out
+
+    def batch_stats(self) -> Dict[str, Any]:
+        batchers = (self._face_batcher, self._embed_batcher, self._spoof_batcher, self._spoof_crop_batcher)
+        return {b.name: b.stats() for b in batchers}
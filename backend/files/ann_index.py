@@ -0,0 +1,276 @@
+# files/ann_index.py
+import math
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from files.logger import logger
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k largest scores, best first."""
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < scores.shape[0]:
+        idx = np.argpartition(-scores, k - 1)[:k]
+    else:
+        idx = np.arange(scores.shape[0])
+    return idx[np.argsort(-scores[idx])]
+
+
+class IVFIndex:
+    """
+    Inverted-file index built in-process with NumPy.
+
+    Gallery rows are clustered with spherical k-means into ``nlist`` cells; a
+    query scores the centroids, then only the rows of the ``nprobe`` closest
+    cells. ``nprobe`` is the recall/latency knob (nprobe == nlist is exact).
+    Inserts and deletes only touch one cell. ``needs_rebuild`` turns true once
+    the gallery has doubled or halved since the last build, and the gallery
+    then retrains the centroids in the background.
+    """
+
+    name = "ivf"
+
+    def __init__(self, dim: int, nlist: int = 0, nprobe: int = 8, iters: int = 10, seed: int = 0):
+        self.dim = dim
+        self.nlist = nlist          # 0 -> ~4*sqrt(n)
+        self.nprobe = max(1, nprobe)
+        self.iters = iters
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None
+        self._lists: List[List[int]] = []
+        self._arrays: List[Optional[np.ndarray]] = []
+        self._cell_of: Dict[int, int] = {}
+        self.trained_size = 0
+
+    @property
+    def ready(self) -> bool:
+        return self.centroids is not None
+
+    def needs_rebuild(self, size: int) -> bool:
+        return not self.ready or size > 2 * self.trained_size or size * 2 < self.trained_size
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "nlist": 0 if self.centroids is None else int(self.centroids.shape[0]),
+            "nprobe": self.nprobe,
+            "trained_size": self.trained_size,
+        }
+
+    def _kmeans(self, data: np.ndarray, nlist: int) -> np.ndarray:
+        rng = np.random.default_rng(self.seed)
+        centroids = data[rng.choice(data.shape[0], nlist, replace=False)].copy()
+        for _ in range(self.iters):
+            assign = np.argmax(data @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, data)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            empty = norms[:, 0] == 0
+            # re-seed empty cells with random rows so every cell stays usable
+            if empty.any():
+                sums[empty] = data[rng.choice(data.shape[0], int(empty.sum()), replace=False)]
+                norms[empty] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+        return centroids
+
+    def train(self, matrix: np.ndarray, slots: np.ndarray) -> Optional[np.ndarray]:
+        """k-means centroids for these rows; leaves the index untouched, so it can run outside the gallery lock."""
+        n = int(slots.shape[0])
+        if n == 0:
+            return None
+        nlist = min(n, self.nlist or max(1, int(round(4 * math.sqrt(n)))))
+        rng = np.random.default_rng(self.seed)
+        sample = slots if n <= 256 * nlist else slots[rng.choice(n, 256 * nlist, replace=False)]
+        return self._kmeans(matrix[sample], nlist)
+
+    def build(self, matrix: np.ndarray, slots: np.ndarray, trained: Optional[np.ndarray] = None):
+        n = int(slots.shape[0])
+        if n == 0:
+            self.centroids = None
+            self._lists, self._arrays, self._cell_of = [], [], {}
+            self.trained_size = 0
+            return
+        self.centroids = trained if trained is not None else self.train(matrix, slots)
+        nlist = self.centroids.shape[0]
+        data = matrix[slots]
+
+        cells = np.empty(n, dtype=np.int64)
+        for start in range(0, n, 8192):
+            cells[start:start + 8192] = np.argmax(data[start:start + 8192] @ self.centroids.T, axis=1)
+        self._lists = [[] for _ in range(nlist)]
+        self._cell_of = {}
+        for slot, cell in zip(slots.tolist(), cells.tolist()):
+            self._lists[cell].append(slot)
+            self._cell_of[slot] = cell
+        self._arrays = [None] * nlist
+        self.trained_size = n
+
+    def add(self, slot: int, vec: np.ndarray):
+        if not self.ready:
+            return
+        self.remove(slot)
+        cell = int(np.argmax(self.centroids @ vec))
+        self._lists[cell].append(slot)
+        self._arrays[cell] = None
+        self._cell_of[slot] = cell
+
+    def remove(self, slot: int):
+        cell = self._cell_of.pop(slot, None)
+        if cell is not None:
+            self._lists[cell].remove(slot)
+            self._arrays[cell] = None
+
+    def _cell_array(self, cell: int) -> np.ndarray:
+        arr = self._arrays[cell]
+        if arr is None:
+            arr = self._arrays[cell] = np.asarray(self._lists[cell], dtype=np.int64)
+        return arr
+
+    def search(self, probe: np.ndarray, matrix: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        cells = top_k(self.centroids @ probe, self.nprobe)
+        cand = np.concatenate([self._cell_array(int(c)) for c in cells])
+        if cand.size == 0:
+            return cand, np.zeros(0, dtype=np.float32)
+        scores = matrix[cand] @ probe
+        best = top_k(scores, k)
+        return cand[best], scores[best]
+
+    # ---------------- Persistence ---------------- #
+    def state(self) -> Dict[str, np.ndarray]:
+        if not self.ready:
+            return {}
+        slots = np.fromiter(self._cell_of.keys(), dtype=np.int64, count=len(self._cell_of))
+        cells = np.fromiter(self._cell_of.values(), dtype=np.int64, count=len(self._cell_of))
+        return {"ivf_centroids": self.centroids, "ivf_slots": slots, "ivf_cells": cells,
+                "ivf_trained_size": np.asarray(self.trained_size)}
+
+    def load_state(self, state: Dict[str, np.ndarray], directory: str) -> bool:
+        if "ivf_centroids" not in state:
+            return False
+        self.centroids = state["ivf_centroids"].astype(np.float32)
+        nlist = self.centroids.shape[0]
+        self._lists = [[] for _ in range(nlist)]
+        self._cell_of = {}
+        for slot, cell in zip(state["ivf_slots"].tolist(), state["ivf_cells"].tolist()):
+            self._lists[cell].append(slot)
+            self._cell_of[slot] = cell
+        self._arrays = [None] * nlist
+        self.trained_size = int(state["ivf_trained_size"])
+        return True
+
+    def save_files(self, directory: str):
+        pass
+
+
+class HNSWIndex:
+    """Graph index backed by the optional ``hnswlib`` package (inner-product space)."""
+
+    name = "hnsw"
+
+    def __init__(self, dim: int, m: int = 16, ef_construction: int = 200, ef_search: int = 64):
+        import hnswlib  # optional dependency; ImportError is handled by make_index()
+
+        self._hnswlib = hnswlib
+        self.dim = dim
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self._index = None
+
+    @property
+    def ready(self) -> bool:
+        return self._index is not None
+
+    def needs_rebuild(self, size: int) -> bool:
+        return not self.ready
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "m": self.m,
+            "ef_construction": self.ef_construction,
+            "ef_search": self.ef_search,
+            "elements": 0 if self._index is None else int(self._index.get_current_count()),
+        }
+
+    def _new_index(self, capacity: int):
+        index = self._hnswlib.Index(space="ip", dim=self.dim)
+        index.init_index(max_elements=max(1024, capacity), ef_construction=self.ef_construction, M=self.m)
+        index.set_ef(self.ef_search)
+        return index
+
+    def train(self, matrix: np.ndarray, slots: np.ndarray):
+        return None  # nothing to pretrain; the graph is built by inserting
+
+    def build(self, matrix: np.ndarray, slots: np.ndarray, trained: Any = None):
+        self._index = self._new_index(2 * int(slots.shape[0]))
+        if slots.shape[0]:
+            self._index.add_items(matrix[slots], slots)
+
+    def add(self, slot: int, vec: np.ndarray):
+        if not self.ready:
+            return
+        if self._index.get_current_count() >= self._index.get_max_elements():
+            self._index.resize_index(2 * self._index.get_max_elements())
+        # re-adding a label that was marked deleted un-deletes and updates it
+        self._index.add_items(vec[None, :], np.asarray([slot]))
+
+    def remove(self, slot: int):
+        if not self.ready:
+            return
+        try:
+            self._index.mark_deleted(slot)
+        except RuntimeError:
+            pass  # label unknown or already deleted
+
+    def search(self, probe: np.ndarray, matrix: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        labels, distances = self._index.knn_query(probe[None, :], k=k)
+        slots = labels[0].astype(np.int64)
+        # exact re-score of the returned candidates against the resident matrix
+        return slots, matrix[slots] @ probe
+
+    # ---------------- Persistence ---------------- #
+    def state(self) -> Dict[str, np.ndarray]:
+        return {}
+
+    def load_state(self, state: Dict[str, np.ndarray], directory: str) -> bool:
+        path = os.path.join(directory, "hnsw.bin")
+        if not os.path.exists(path):
+            return False
+        index = self._hnswlib.Index(space="ip", dim=self.dim)
+        index.load_index(path, allow_replace_deleted=False)
+        index.set_ef(self.ef_search)
+        self._index = index
+        return True
+
+    def save_files(self, directory: str):
+        if self._index is not None:
+            self._index.save_index(os.path.join(directory, "hnsw.bin"))
+
+
+def make_index(dim: int):
+    """Build the ANN index selected by ANN_BACKEND (exact|ivf|hnsw); None means exact search."""
+    backend = os.environ.get("ANN_BACKEND", "exact").strip().lower()
+    try:
+        if backend == "ivf":
+            return IVFIndex(
+                dim,
+                nlist=int(os.environ.get("ANN_NLIST", 0)),
+                nprobe=int(os.environ.get("ANN_NPROBE", 8)),
+            )
+        if backend == "hnsw":
+            return HNSWIndex(
+                dim,
+                m=int(os.environ.get("ANN_HNSW_M", 16)),
+                ef_construction=int(os.environ.get("ANN_HNSW_EF_CONSTRUCTION", 200)),
+                ef_search=int(os.environ.get("ANN_HNSW_EF_SEARCH", 64)),
+            )
+    except ImportError as e:
+        logger.warning(f"ANN backend '{backend}' unavailable ({e}); using exact search")
+    except ValueError as e:
+        logger.warning(f"Invalid ANN settings ({e}); using exact search")
+    return None
@@ -0,0 +1,133 @@
+# files/attendance_export.py
+import asyncio
+import csv
+import io
+import os
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from files.db_controller import EXPORT_FIELDS, DBController
+from files.logger import logger
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency; CSV export works without it
+    pa = None
+    pq = None
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object that hands bytes to the HTTP stream instead of keeping a whole file."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+class AttendanceExporter:
+    """
+    Streams attendance rows from ``DBController.iter_attendance`` as CSV or Parquet.
+
+    CSV is emitted every ``chunk_rows`` rows. Parquet writes one row group per
+    chunk and sends it as soon as it is encoded; the footer goes out at the end.
+    Memory stays bounded by a single chunk. Parquet needs the optional
+    ``pyarrow`` package.
+    """
+
+    MEDIA_TYPES = {"csv": "text/csv; charset=utf-8", "parquet": "application/vnd.apache.parquet"}
+
+    def __init__(self, db: DBController, chunk_rows: Optional[int] = None):
+        self.version = "0.0.1"
+        self.module_name = "AttendanceExporter"
+        self.db = db
+        try:
+            self.chunk_rows: int = max(1, int(chunk_rows or os.environ.get("EXPORT_CHUNK_ROWS", 5000)))
+        except ValueError:
+            self.chunk_rows = 5000
+
+    def info(self) -> Dict[str, Any]:
+        return {"module_name": self.module_name, "version": self.version}
+
+    @staticmethod
+    def available_formats() -> List[str]:
+        return ["csv", "parquet"] if pa is not None else ["csv"]
+
+    def check_format(self, fmt: str) -> str:
+        fmt = (fmt or "csv").strip().lower()
+        if fmt not in self.MEDIA_TYPES:
+            raise ValueError(f"Unknown export format '{fmt}' (use csv or parquet)")
+        if fmt == "parquet" and pa is None:
+            raise ValueError("Parquet export needs the optional pyarrow package (pip install -r requirements-export.txt)")
+        return fmt
+
+    async def _chunks(self, start: str, end: str, courses, rolls) -> AsyncIterator[List[Dict[str, Any]]]:
+        chunk: List[Dict[str, Any]] = []
+        async for row in self.db.iter_attendance(start, end, courses=courses, rolls=rolls, batch_size=min(self.chunk_rows, 10000)):
+            chunk.append(row)
+            if len(chunk) >= self.chunk_rows:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    async def stream(
+        self, fmt: str, start: str, end: str, courses: Optional[List[str]] = None, rolls: Optional[List[str]] = None
+    ) -> AsyncIterator[bytes]:
+        fmt = self.check_format(fmt)
+        if fmt == "csv":
+            async for chunk in self._csv(start, end, courses, rolls):
+                yield chunk
+        else:
+            async for chunk in self._parquet(start, end, courses, rolls):
+                yield chunk
+        logger.info(f"{self.module_name}: export finished | format={fmt} start={start} end={end} courses={courses} rolls={rolls}")
+
+    async def _csv(self, start, end, courses, rolls) -> AsyncIterator[bytes]:
+        buf = io.StringIO()
+        writer = csv.DictWriter(buf, fieldnames=EXPORT_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        yield buf.getvalue().encode("utf-8")
+        async for chunk in self._chunks(start, end, courses, rolls):
+            buf.seek(0)
+            buf.truncate(0)
+            writer.writerows(chunk)
+            yield buf.getvalue().encode("utf-8")
+
+    @staticmethod
+    def _schema():
+        return pa.schema([(f, pa.float64() if f == "similarity" else pa.string()) for f in EXPORT_FIELDS])
+
+    @staticmethod
+    def _table(chunk: List[Dict[str, Any]], schema):
+        columns = {f: [row.get(f) for row in chunk] for f in EXPORT_FIELDS}
+        columns["similarity"] = [float(v) if isinstance(v, (int, float)) else None for v in columns["similarity"]]
+        for f in EXPORT_FIELDS:
+            if f != "similarity":
+                columns[f] = [None if v is None else str(v) for v in columns[f]]
+        return pa.Table.from_pydict(columns, schema=schema)
+
+    async def _parquet(self, start, end, courses, rolls) -> AsyncIterator[bytes]:
+        schema = self._schema()
+        sink = _ChunkSink()
+        writer = pq.ParquetWriter(sink, schema, compression="snappy")
+        try:
+            async for chunk in self._chunks(start, end, courses, rolls):
+                # encoding a row group is CPU work; keep it off the event loop
+                await asyncio.to_thread(writer.write_table, self._table(chunk, schema))
+                data = sink.drain()
+                if data:
+                    yield data
+        finally:
+            writer.close()
+        yield sink.drain()
@@ -0,0 +1,321 @@
+# files/attendance_journal.py
+import asyncio
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from files.db_controller import DBController
+from files.logger import logger
+
+try:
+    import fcntl  # POSIX only; used to keep two workers off the same journal
+except ImportError:  # pragma: no cover - Windows dev machines
+    fcntl = None
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class JournalLockedError(RuntimeError):
+    """Another process already owns the journal file."""
+
+
+class AttendanceWriteBehind:
+    """
+    Write-behind buffer for attendance marks.
+
+    ``enqueue`` appends the mark to a local JSONL journal and fsyncs it before
+    returning, so an acknowledged mark survives a crash. Marks already in Mongo
+    for the day, or already accepted here, come back as "duplicate". Concurrent appends share
+    one fsync. A background task drains the buffer into Mongo with
+    ``DBController.bulk_insert_attendance`` every ``flush_ms`` or as soon as
+    ``flush_max`` marks are waiting. After a flush an ``ack`` line records the
+    highest sequence number written, and the file is truncated once nothing is
+    pending. On start, marks after the last ack are replayed.
+    """
+
+    def __init__(
+        self,
+        db: DBController,
+        path: Optional[str] = None,
+        flush_ms: Optional[float] = None,
+        flush_max: Optional[int] = None,
+    ):
+        self.version = "0.0.1"
+        self.module_name = "AttendanceWriteBehind"
+        self.db = db
+        self.path = path or os.environ.get("ATTENDANCE_JOURNAL_PATH") or os.path.join(BASE_DIR, "journal", "attendance.jsonl")
+        try:
+            self.flush_ms: float = float(flush_ms if flush_ms is not None else os.environ.get("ATTENDANCE_FLUSH_MS", 200))
+        except ValueError:
+            self.flush_ms = 200.0
+        try:
+            self.flush_max: int = max(1, int(flush_max if flush_max is not None else os.environ.get("ATTENDANCE_FLUSH_MAX", 500)))
+        except ValueError:
+            self.flush_max = 500
+
+        self._file = None
+        self._file_lock = threading.Lock()  # journal writes happen on worker threads
+        self._seq = 0
+        self._pending: List[Tuple[int, Dict[str, Any]]] = []
+        self._keys: Set[Tuple[str, str, str]] = set()  # (date, course, roll) accepted by this process
+        self._to_sync: List[Tuple[str, asyncio.Future, bool]] = []  # (line, waiter, may compact the file)
+        self._sync_task: Optional[asyncio.Task] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._flushing = False
+        self._enqueuing = 0  # marks being journaled but not yet in _pending
+        self.counters = {"queued": 0, "duplicate": 0, "stored_duplicate": 0, "flushed": 0, "db_duplicate": 0, "batches": 0,
+                         "flush_errors": 0, "record_errors": 0, "replayed": 0, "fsyncs": 0}
+        self.last_flush_ms: Optional[float] = None
+        logger.info(f"{self.module_name} initialized | journal={self.path} flush_ms={self.flush_ms} flush_max={self.flush_max}")
+
+    def info(self) -> Dict[str, Any]:
+        return {"module_name": self.module_name, "version": self.version}
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            journal_bytes = os.path.getsize(self.path)
+        except OSError:
+            journal_bytes = None
+        return {
+            "journal": self.path,
+            "flush_ms": self.flush_ms,
+            "flush_max": self.flush_max,
+            "pending": len(self._pending),
+            "journal_bytes": journal_bytes,
+            "last_flush_ms": self.last_flush_ms,
+            **self.counters,
+        }
+
+    # ---------------- Lifecycle ---------------- #
+    async def start(self):
+        """Open (and lock) the journal, replay unacknowledged marks, start the flusher."""
+        await asyncio.to_thread(self._open)
+        replay, last_seq = await asyncio.to_thread(self._read_unacked)
+        self._seq = last_seq  # keep numbering above any ack still in the file
+        for seq, record in replay:
+            self._pending.append((seq, record))
+            self._keys.add(self._key(record))
+        self.counters["replayed"] = len(replay)
+        if replay:
+            logger.info(f"{self.module_name}: replaying {len(replay)} unacknowledged marks from {self.path}")
+        self._wake = asyncio.Event()
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Stop the flusher and write out whatever is still buffered."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        if self._sync_task is not None:
+            await self._sync_task
+        while self._pending and await self.flush():
+            pass
+        if self._pending:
+            logger.warning(f"{self.module_name}: {len(self._pending)} marks left in the journal for replay")
+        await asyncio.to_thread(self._close)
+
+    # ---------------- Journal file (worker threads) ---------------- #
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        f = open(self.path, "a+", encoding="utf-8")
+        if fcntl is not None:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()
+                raise JournalLockedError(f"{self.path} is in use by another process; set ATTENDANCE_JOURNAL_PATH per worker")
+        self._file = f
+
+    def _close(self):
+        with self._file_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _read_unacked(self) -> Tuple[List[Tuple[int, Dict[str, Any]]], int]:
+        marks: List[Tuple[int, Dict[str, Any]]] = []
+        acked = 0
+        last_seq = 0
+        with self._file_lock:
+            self._file.seek(0)
+            content = self._file.read()
+            if content and not content.endswith("\n"):
+                # torn last line from a crash mid-write: it was never acknowledged, and the
+                # next append must not be glued onto it (json.dumps output is ASCII)
+                content = content[: content.rfind("\n") + 1]
+                self._file.truncate(len(content))
+            for line in content.splitlines():
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if "ack" in entry:
+                    acked = max(acked, int(entry["ack"]))
+                    last_seq = max(last_seq, acked)
+                elif "seq" in entry:
+                    marks.append((int(entry["seq"]), entry["mark"]))
+                    last_seq = max(last_seq, marks[-1][0])
+        return [(seq, mark) for seq, mark in marks if seq > acked], last_seq
+
+    def _write_lines(self, lines: List[str], truncate: bool = False):
+        with self._file_lock:
+            if truncate:
+                self._file.truncate(0)
+            if lines:
+                self._file.write("".join(lines))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self.counters["fsyncs"] += 1
+
+    # ---------------- Durable append (group commit) ---------------- #
+    async def _append(self, line: str, compact: bool = False):
+        """
+        Durably append `line`. With `compact` (an ack), the journal is truncated instead
+        when no mark is pending or in flight at write time, checked in the sync loop.
+        """
+        fut = asyncio.get_running_loop().create_future()
+        self._to_sync.append((line, fut, compact))
+        if self._sync_task is None:
+            self._sync_task = asyncio.create_task(self._sync_loop())
+        await fut
+
+    async def _sync_loop(self):
+        try:
+            while self._to_sync:
+                batch, self._to_sync = self._to_sync, []
+                # decided on the loop right before the write: an enqueue that starts later queues
+                # its line behind this batch, so a truncate can never erase an acknowledged mark
+                truncate = any(compact for _, _, compact in batch) and not self._pending and not self._enqueuing
+                lines = [] if truncate else [line for line, _, _ in batch]
+                try:
+                    await asyncio.to_thread(self._write_lines, lines, truncate)
+                except Exception as e:
+                    for _, fut, _ in batch:
+                        if not fut.done():
+                            fut.set_exception(e)
+                    continue
+                for _, fut, _ in batch:
+                    if not fut.done():
+                        fut.set_result(None)
+        finally:
+            self._sync_task = None
+
+    # ---------------- Public API ---------------- #
+    @staticmethod
+    def _key(record: Dict[str, Any]) -> Tuple[str, str, str]:
+        return str(record.get("date")), str(record.get("course")), str(record.get("roll"))
+
+    async def _stored_rolls(self, date_str: str, course: str, rolls: List[str]) -> Set[str]:
+        try:
+            return await self.db.marked_rolls(date_str, course, rolls)
+        except Exception as e:
+            # Mongo being down is what the journal is for: queue, and let the flush drop a repeat
+            logger.warning(f"{self.module_name}: could not check stored marks for course={course} date={date_str}: {e}")
+            return set()
+
+    async def enqueue(self, data: Dict[str, Any], stored: Optional[bool] = None) -> str:
+        """
+        Journal one mark; returns "queued" once it is on disk, or "duplicate". `stored` skips
+        the Mongo lookup for today's mark when the caller already did it (enqueue_many).
+        """
+        if not (data.get("roll") and data.get("course") and data.get("date")):
+            raise ValueError("Missing roll/course/date in attendance data")
+        key = self._key(data)
+        if key in self._keys:
+            self.counters["duplicate"] += 1
+            return "duplicate"
+        self._keys.add(key)  # claimed before the lookup so a concurrent repeat is a duplicate too
+        if stored is None:
+            stored = key[2] in await self._stored_rolls(key[0], key[1], [key[2]])
+        if stored:
+            self.counters["duplicate"] += 1
+            self.counters["stored_duplicate"] += 1
+            return "duplicate"
+        self._seq += 1
+        seq = self._seq
+        self._enqueuing += 1
+        try:
+            await self._append(json.dumps({"seq": seq, "mark": data}, default=str) + "\n")
+            self._pending.append((seq, data))
+        except Exception:
+            self._keys.discard(key)
+            raise
+        finally:
+            self._enqueuing -= 1
+        self.counters["queued"] += 1
+        if len(self._pending) >= self.flush_max and self._wake is not None:
+            self._wake.set()
+        return "queued"
+
+    async def enqueue_many(self, records: List[Dict[str, Any]]) -> List[str]:
+        """enqueue for several marks: one stored-mark lookup per (date, course) and a shared fsync."""
+        groups: Dict[Tuple[str, str], List[str]] = {}
+        for r in records:
+            date_str, course, roll = self._key(r)
+            groups.setdefault((date_str, course), []).append(roll)
+        stored = {key: await self._stored_rolls(key[0], key[1], rolls) for key, rolls in groups.items()}
+        return list(await asyncio.gather(*(self.enqueue(r, stored=self._key(r)[2] in stored[self._key(r)[:2]]) for r in records)))
+
+    async def flush(self) -> int:
+        """
+        Write buffered marks to Mongo; returns how many were written. Marks that fail (the
+        whole batch, or single records) stay buffered, in order, for the next attempt.
+        """
+        if self._flushing or not self._pending:
+            return 0
+        self._flushing = True
+        batch = self._pending[: self.flush_max]
+        t0 = time.perf_counter()
+        try:
+            result = await self.db.bulk_insert_attendance([record for _, record in batch])
+        except Exception as e:
+            self.counters["flush_errors"] += 1
+            logger.error(f"{self.module_name}: flush of {len(batch)} marks failed, will retry: {e}")
+            return 0
+        finally:
+            self._flushing = False
+        failed = [item for item, outcome in zip(batch, result["outcomes"]) if outcome == "error"]
+        self._pending[: len(batch)] = failed
+        self.last_flush_ms = round((time.perf_counter() - t0) * 1000.0, 3)
+        self.counters["batches"] += 1
+        self.counters["flushed"] += result["inserted"]
+        self.counters["db_duplicate"] += result["duplicate"]
+        if failed:
+            self.counters["flush_errors"] += 1
+            self.counters["record_errors"] += len(failed)
+            logger.error(f"{self.module_name}: {len(failed)} of {len(batch)} marks failed to write, will retry them")
+
+        # replay restarts after the ack, so never ack past a mark that is still buffered
+        oldest = min((seq for seq, _ in self._pending), default=None)
+        ack = batch[-1][0] if oldest is None else min(batch[-1][0], oldest - 1)
+        await self._append(json.dumps({"ack": ack}) + "\n", compact=True)
+        self._prune_keys()
+        return len(batch) - len(failed)
+
+    def _prune_keys(self):
+        # keep only the newest date(s) still in play so the dedupe set does not grow forever
+        live = {self._key(r)[0] for _, r in self._pending}
+        if self._keys:
+            live.add(max(k[0] for k in self._keys))
+        self._keys = {k for k in self._keys if k[0] in live}
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_ms / 1000.0)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            failures = self.counters["flush_errors"]
+            while self._pending:
+                if not await self.flush():
+                    break
+            if self.counters["flush_errors"] > failures:
+                await asyncio.sleep(min(5.0, 10 * self.flush_ms / 1000.0))  # back off while Mongo is unhappy
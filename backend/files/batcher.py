@@ -0,0 +1,119 @@
+# files/batcher.py
+import asyncio
+import os
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from files.inference_pool import InferencePool
+from files.logger import logger
+
+
+def _env_number(names: Sequence[str], default, cast):
+    for name in names:
+        value = os.environ.get(name)
+        if value in (None, ""):
+            continue
+        try:
+            return cast(value)
+        except ValueError:
+            break
+    return default
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent single-item requests into one batched model call.
+
+    The first item of a batch starts a ``max_wait_ms`` timer; the batch is
+    dispatched when the timer fires or ``max_batch`` items are queued,
+    whichever comes first. ``batch_fn`` receives the list of items on the
+    inference executor and must return one result per item, in order.
+    Settings come from ``<PREFIX>_BATCH_MAX_SIZE`` / ``<PREFIX>_BATCH_MAX_WAIT_MS``
+    with ``BATCH_MAX_SIZE`` / ``BATCH_MAX_WAIT_MS`` as shared fallbacks;
+    ``max_batch <= 1`` or ``max_wait_ms <= 0`` disables batching.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        batch_fn: Callable[[List[Any]], List[Any]],
+        pool: InferencePool,
+        max_batch: Optional[int] = None,
+        max_wait_ms: Optional[float] = None,
+    ):
+        self.version = "0.0.1"
+        self.module_name = f"MicroBatcher[{name}]"
+        self.name = name
+        self.batch_fn = batch_fn
+        self.pool = pool
+
+        prefix = name.upper()
+        self.max_batch: int = max_batch if max_batch is not None else _env_number(
+            (f"{prefix}_BATCH_MAX_SIZE", "BATCH_MAX_SIZE"), 8, int)
+        self.max_wait_ms: float = max_wait_ms if max_wait_ms is not None else _env_number(
+            (f"{prefix}_BATCH_MAX_WAIT_MS", "BATCH_MAX_WAIT_MS"), 5.0, float)
+
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._inflight: Set[asyncio.Task] = set()  # the loop only keeps weak refs to tasks
+        self.counters = {"items": 0, "batches": 0, "max_seen": 0}
+        logger.info(f"{self.module_name} initialized | max_batch={self.max_batch} max_wait_ms={self.max_wait_ms}")
+
+    def info(self) -> Dict[str, Any]:
+        return {"module_name": self.module_name, "version": self.version}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_batch > 1 and self.max_wait_ms > 0
+
+    def stats(self) -> Dict[str, Any]:
+        batches = self.counters["batches"]
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait_ms,
+            **self.counters,
+            "avg_batch": round(self.counters["items"] / batches, 2) if batches else 0.0,
+        }
+
+    async def submit(self, item: Any) -> Any:
+        if not self.enabled:
+            self._record(1)
+            return (await self.pool.run(self.batch_fn, [item]))[0]
+
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((item, fut))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait_ms / 1000.0, self._flush)
+        return await fut
+
+    def _record(self, size: int):
+        self.counters["items"] += size
+        self.counters["batches"] += 1
+        self.counters["max_seen"] = max(self.counters["max_seen"], size)
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, batch: List[Tuple[Any, asyncio.Future]]):
+        self._record(len(batch))
+        try:
+            results = await self.pool.run(self.batch_fn, [item for item, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"{self.module_name}: batch_fn returned {len(results)} results for {len(batch)} items")
+        except Exception as e:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for (_, fut), result in zip(batch, results):
+            if not fut.done():  # the request may have been cancelled (client went away)
+                fut.set_result(result)
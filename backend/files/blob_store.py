@@ -0,0 +1,315 @@
+# files/blob_store.py
+import asyncio
+import hashlib
+import os
+import re
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import cv2
+import numpy as np
+
+from files.logger import logger
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_READ_CHUNK = 256 * 1024
+_SHA256 = re.compile(r"^[0-9a-f]{64}$")  # original photos; thumbnails are "<sha>.thumb<px>"
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+class LocalBlobStore:
+    """Content-addressed files under ``root/ab/cd/<key>``; writes are atomic (temp file + rename)."""
+
+    name = "local"
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def _write(self, key: str, data: bytes):
+        path = self._path(key)
+        try:
+            os.utime(path)  # already stored: mark it used now so the sweep leaves it alone
+            return
+        except FileNotFoundError:
+            pass
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    async def put(self, key: str, data: bytes, content_type: str):
+        await asyncio.to_thread(self._write, key, data)
+
+    async def exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    async def open(self, key: str) -> Optional[Tuple[int, AsyncIterator[bytes]]]:
+        path = self._path(key)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return None
+
+        async def chunks():
+            f = await asyncio.to_thread(open, path, "rb")
+            try:
+                while True:
+                    chunk = await asyncio.to_thread(f.read, _READ_CHUNK)
+                    if not chunk:
+                        break
+                    yield chunk
+            finally:
+                f.close()
+
+        return size, chunks()
+
+    def _read(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    async def read(self, key: str) -> Optional[bytes]:
+        return await asyncio.to_thread(self._read, key)
+
+    async def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _stale(self, cutoff: float) -> List[str]:
+        keys = []
+        for folder, _, names in os.walk(self.root):
+            for name in names:
+                if _SHA256.match(name):
+                    try:
+                        if os.path.getmtime(os.path.join(folder, name)) < cutoff:
+                            keys.append(name)
+                    except OSError:
+                        pass
+        return keys
+
+    async def stale_keys(self, cutoff: float) -> List[str]:
+        """Original blobs not written or re-put since `cutoff` (epoch seconds)."""
+        return await asyncio.to_thread(self._stale, cutoff)
+
+    def _delete_if_stale(self, key: str, cutoff: float) -> bool:
+        path = self._path(key)
+        trash = os.path.join(os.path.dirname(path), f".trash-{key}")
+        try:
+            os.replace(path, trash)  # a put from here on finds no file and writes a fresh one
+        except OSError:
+            return False
+        try:
+            if os.path.getmtime(trash) >= cutoff:
+                os.replace(trash, path)  # touched just before the rename: still in use
+                return False
+            os.remove(trash)
+            return True
+        except OSError:
+            return False
+
+    async def delete_if_stale(self, key: str, cutoff: float) -> bool:
+        return await asyncio.to_thread(self._delete_if_stale, key, cutoff)
+
+
+class GridFSBlobStore:
+    """Blobs in a GridFS bucket on the shared Motor client; the content key is the file ``_id``."""
+
+    name = "gridfs"
+
+    def __init__(self, db, bucket: str = "images"):
+        from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+
+        self.bucket = AsyncIOMotorGridFSBucket(db, bucket_name=bucket)
+        self.files = db[f"{bucket}.files"]
+        self.chunks = db[f"{bucket}.chunks"]
+
+    async def put(self, key: str, data: bytes, content_type: str):
+        now = datetime.now(timezone.utc)
+        # already stored: mark it used now so the sweep leaves it alone; no match means it is
+        # absent (or the sweep just removed it) and gets uploaded again
+        touched = await self.files.update_one({"_id": key}, {"$set": {"metadata.touched_at": now}})
+        if touched.matched_count:
+            return
+        from gridfs.errors import FileExists
+        from pymongo.errors import DuplicateKeyError
+
+        try:
+            await self.bucket.upload_from_stream_with_id(
+                key, key, data, metadata={"content_type": content_type, "touched_at": now}
+            )
+        except (FileExists, DuplicateKeyError):
+            # GridIn turns the duplicate _id into FileExists: stored concurrently by another
+            # request, and the same key means the same bytes
+            pass
+
+    async def exists(self, key: str) -> bool:
+        return await self.files.find_one({"_id": key}, {"_id": 1}) is not None
+
+    async def open(self, key: str) -> Optional[Tuple[int, AsyncIterator[bytes]]]:
+        from gridfs.errors import NoFile
+
+        try:
+            grid_out = await self.bucket.open_download_stream(key)
+        except NoFile:
+            return None
+
+        async def chunks():
+            while True:
+                chunk = await grid_out.readchunk()
+                if not chunk:
+                    break
+                yield chunk
+
+        return grid_out.length, chunks()
+
+    async def read(self, key: str) -> Optional[bytes]:
+        opened = await self.open(key)
+        if opened is None:
+            return None
+        return b"".join([chunk async for chunk in opened[1]])
+
+    async def delete(self, key: str):
+        from gridfs.errors import NoFile
+
+        try:
+            await self.bucket.delete(key)
+        except NoFile:
+            pass
+
+    @staticmethod
+    def _stale_filter(cutoff: float) -> Dict[str, Any]:
+        before = datetime.fromtimestamp(cutoff, tz=timezone.utc)
+        return {"$or": [
+            {"metadata.touched_at": {"$lt": before}},
+            {"metadata.touched_at": {"$exists": False}, "uploadDate": {"$lt": before}},  # uploaded before touch tracking
+        ]}
+
+    async def stale_keys(self, cutoff: float) -> List[str]:
+        """Original blobs not written or re-put since `cutoff` (epoch seconds)."""
+        query = {"_id": {"$regex": _SHA256.pattern}, **self._stale_filter(cutoff)}
+        return [doc["_id"] async for doc in self.files.find(query, {"_id": 1})]
+
+    async def delete_if_stale(self, key: str, cutoff: float) -> bool:
+        # removing the files doc is the atomic step: a put that touched it since cutoff no longer
+        # matches, and a put after it re-uploads; orphaned chunks are dropped right after
+        result = await self.files.delete_one({"_id": key, **self._stale_filter(cutoff)})
+        if not result.deleted_count:
+            return False
+        await self.chunks.delete_many({"files_id": key})
+        return True
+
+
+class ImageStore:
+    """
+    Student photos outside the students collection.
+
+    Images are keyed by their SHA-256, so re-uploading the same photo is free and
+    the key doubles as the HTTP ETag. Student docs keep only
+    ``image_ref = {"sha256", "size", "content_type"}``. Thumbnails are rendered
+    once, on first request, and stored under ``<sha256>.thumb<px>``.
+    Backend: IMAGE_STORE=gridfs (default) or local (IMAGE_STORE_DIR).
+
+    Photos are never deleted inline when a student is re-registered or removed,
+    since another request may be about to reference the same bytes. ``sweep``
+    drops the ones no student references and nobody has put for a grace period.
+    """
+
+    def __init__(self, db=None, backend: Optional[str] = None):
+        self.version = "0.0.1"
+        self.module_name = "ImageStore"
+        backend = (backend or os.environ.get("IMAGE_STORE", "gridfs")).strip().lower()
+        if backend == "local" or db is None:
+            self.backend = LocalBlobStore(os.environ.get("IMAGE_STORE_DIR") or os.path.join(BASE_DIR, "blobs"))
+        else:
+            self.backend = GridFSBlobStore(db, bucket=os.environ.get("IMAGE_STORE_BUCKET", "images"))
+        self.thumb_px = max(16, _env_int("IMAGE_THUMB_SIZE", 160))
+        self.thumb_quality = min(95, max(30, _env_int("IMAGE_THUMB_QUALITY", 80)))
+        logger.info(f"{self.module_name} initialized (v{self.version}) | backend={self.backend.name} thumb={self.thumb_px}px")
+
+    def info(self) -> Dict[str, Any]:
+        return {"module_name": self.module_name, "version": self.version, "backend": self.backend.name}
+
+    @staticmethod
+    def key_for(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def thumb_key(self, sha: str) -> str:
+        return f"{sha}.thumb{self.thumb_px}"
+
+    async def put(self, data: bytes, content_type: str) -> Dict[str, Any]:
+        sha = self.key_for(data)
+        await self.backend.put(sha, data, content_type)
+        return {"sha256": sha, "size": len(data), "content_type": content_type}
+
+    async def open(self, key: str):
+        return await self.backend.open(key)
+
+    async def delete(self, sha: str):
+        await self.backend.delete(sha)
+        await self.backend.delete(self.thumb_key(sha))
+
+    async def sweep(self, referenced: Callable[[List[str]], Awaitable[Set[str]]], grace_sec: float) -> int:
+        """
+        Delete photos (and their thumbnails) that no student references and that were not
+        put in the last `grace_sec` seconds. `referenced(shas)` returns the ones still in use.
+        """
+        cutoff = time.time() - grace_sec
+        keys = await self.backend.stale_keys(cutoff)
+        removed = 0
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            in_use = await referenced(chunk)
+            for sha in chunk:
+                if sha not in in_use and await self.backend.delete_if_stale(sha, cutoff):
+                    await self.backend.delete(self.thumb_key(sha))
+                    removed += 1
+        if removed:
+            logger.info(f"{self.module_name}: swept {removed} unreferenced images (of {len(keys)} past the grace period)")
+        return removed
+
+    def _render_thumb(self, data: bytes) -> Optional[bytes]:
+        img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            return None
+        h, w = img.shape[:2]
+        scale = self.thumb_px / float(max(h, w))
+        if scale < 1.0:
+            img = cv2.resize(img, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+        ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, self.thumb_quality])
+        return buf.tobytes() if ok else None
+
+    async def thumbnail(self, sha: str) -> Optional[str]:
+        """Key of the thumbnail for `sha`, rendering and storing it on first use."""
+        key = self.thumb_key(sha)
+        if await self.backend.exists(key):
+            return key
+        data = await self.backend.read(sha)
+        if data is None:
+            return None
+        thumb = await asyncio.to_thread(self._render_thumb, data)
+        if thumb is None:
+            return None
+        await self.backend.put(key, thumb, "image/jpeg")
+        return key
@@ -1,11 +1,12 @@
 # files/db_controller.py
-from typing import Dict, Any, List
-from motor.motor_asyncio import AsyncIOMotorClient
-from files.logger import logger
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Iterable, Optional, AsyncIterator, Set, Tuple
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from files.db_metrics import db_metrics
 from files.logger import logger
 from dotenv import load_dotenv
+from datetime import datetime, timezone
 import os
 
 load_dotenv()
@@ -13,15 +14,77 @@ MONGO_URI = os.getenv("MONGO_URI")
 DB_NAME = os.getenv("DB_NAME")
 COLLECTION_NAME_STUDENT = os.getenv("COLLECTION_NAME_STUDENT")
 COLLECTION_NAME_ATTENDANCE = os.getenv("COLLECTION_NAME_ATTENDANCE")
+COLLECTION_NAME_MARKS = os.getenv("COLLECTION_NAME_MARKS") or f"{COLLECTION_NAME_ATTENDANCE}_marks"
+# nested: one doc per date (courses.<course>.students.<roll>) | flat: one doc per mark
+ATTENDANCE_LAYOUT = (os.getenv("ATTENDANCE_LAYOUT") or "nested").strip().lower()
+
+_MARK_FIELDS = ("name", "roll", "timestamp", "status", "similarity")
+EXPORT_FIELDS = ("date", "course") + _MARK_FIELDS
+
+
+def _match_value(value):
+    # one value matches by equality, a list/tuple/set by $in
+    return {"$in": list(value)} if isinstance(value, (list, tuple, set)) else value
+
+_CLIENT: AsyncIOMotorClient | None = None
+
+
+def _env_int(name: str, default: Optional[int]) -> Optional[int]:
+    try:
+        value = os.getenv(name)
+        return int(value) if value not in (None, "") else default
+    except ValueError:
+        return default
+
+
+def pool_options() -> Dict[str, Any]:
+    """Connection-pool sizing for the shared client; unset values keep the PyMongo defaults."""
+    options = {
+        "maxPoolSize": _env_int("MONGO_MAX_POOL_SIZE", 100),
+        "minPoolSize": _env_int("MONGO_MIN_POOL_SIZE", 0),
+        "maxConnecting": _env_int("MONGO_MAX_CONNECTING", 2),
+        "maxIdleTimeMS": _env_int("MONGO_MAX_IDLE_TIME_MS", None),
+        "waitQueueTimeoutMS": _env_int("MONGO_WAIT_QUEUE_TIMEOUT_MS", None),
+    }
+    return {k: v for k, v in options.items() if v is not None}
+
+
+def get_mongo_client() -> AsyncIOMotorClient:
+    """Process-wide Motor client: one connection pool shared by every DBController."""
+    global _CLIENT
+    if _CLIENT is None:
+        if not MONGO_URI:
+            raise ValueError("MONGO_URI not found in env")
+        options = pool_options()
+        _CLIENT = AsyncIOMotorClient(
+            MONGO_URI,
+            serverSelectionTimeoutMS=5000,
+            event_listeners=[db_metrics],
+            **options,
+        )
+        logger.info(f"Mongo client created (pool: {options})")
+    return _CLIENT
+
+
+def close_mongo_client():
+    global _CLIENT
+    if _CLIENT is not None:
+        _CLIENT.close()
+        _CLIENT = None
+        logger.info("Mongo client closed.")
+
 
 class DBController:
-    def __init__(self):
-        self.version = "0.0.3"
+    def __init__(self, client: AsyncIOMotorClient | None = None):
+        self.version = "0.0.7"
         self.module_name = "DBController"
-        self.client: AsyncIOMotorClient | None = None
+        self.client: AsyncIOMotorClient | None = client
         self.db = None
         self.students = None
         self.attendance = None
+        self.marks = None
+        self.layout = ATTENDANCE_LAYOUT if ATTENDANCE_LAYOUT in ("nested", "flat") else "nested"
+        self.date_unique = False  # set by ensure_indexes(); enables the single-round-trip nested upsert
 
         logger.info(f"{self.module_name} initialized (v{self.version})")
         self.connect()
@@ -36,22 +99,68 @@ class DBController:
             if not DB_NAME or not COLLECTION_NAME_STUDENT or not COLLECTION_NAME_ATTENDANCE:
                 raise ValueError("DB_NAME or collection env vars missing")
 
-            # single place to create client
+            # reuse the process-wide client instead of opening a new pool per controller
             if self.client is None:
-                self.client = AsyncIOMotorClient(MONGO_URI, serverSelectionTimeoutMS=5000)
+                self.client = get_mongo_client()
 
             self.db = self.client[DB_NAME]
             self.students = self.db[COLLECTION_NAME_STUDENT]
             self.attendance = self.db[COLLECTION_NAME_ATTENDANCE]
+            self.marks = self.db[COLLECTION_NAME_MARKS]
 
-            logger.info(f"{self.module_name} connected to collections: {COLLECTION_NAME_STUDENT}, {COLLECTION_NAME_ATTENDANCE}")
+            logger.info(
+                f"{self.module_name} connected to collections: {COLLECTION_NAME_STUDENT}, {COLLECTION_NAME_ATTENDANCE}"
+                f" (attendance layout={self.layout})"
+            )
 
         except Exception as e:
             logger.error(f"{self.module_name} connection failed: {e}")
             raise
 
-    # ... (rest of your CRUD methods unchanged) ...
+    async def ensure_indexes(self):
+        """
+        Unique keys that make attendance writes atomic: one nested doc per date, and
+        one flat mark per (date, course, roll). Failures are logged, not raised, so an
+        old deployment with duplicate date docs still starts (on the legacy write path).
+        """
+        try:
+            await self.marks.create_index(
+                [("date", ASCENDING), ("course", ASCENDING), ("roll", ASCENDING)], unique=True, name="uniq_mark"
+            )
+        except Exception as e:
+            logger.error(f"{self.module_name}: could not create unique mark index: {e}")
+        try:
+            # serve the range/pagination queries (equality, date range, then the keyset tie-breaker)
+            await self.marks.create_index([("roll", ASCENDING), ("date", ASCENDING), ("course", ASCENDING)], name="roll_date")
+            await self.marks.create_index([("course", ASCENDING), ("date", ASCENDING), ("roll", ASCENDING)], name="course_date")
+        except Exception as e:
+            logger.error(f"{self.module_name}: could not create mark range indexes: {e}")
+        try:
+            await self.attendance.create_index([("date", ASCENDING)], unique=True, name="uniq_date")
+            self.date_unique = True
+        except Exception as e:
+            logger.error(
+                f"{self.module_name}: could not create unique date index ({e}); "
+                f"nested attendance writes fall back to read-then-write"
+            )
+        try:
+            await self.students.create_index([("image_ref.sha256", ASCENDING)], name="image_ref", sparse=True)
+        except Exception as e:
+            logger.error(f"{self.module_name}: could not create image_ref index: {e}")
+        logger.info(f"{self.module_name}: indexes ensured (date_unique={self.date_unique})")
 
+    @staticmethod
+    def _projection(fields: Optional[Iterable[str]] = None, exclude: Optional[Iterable[str]] = None) -> Dict[str, int]:
+        """
+        Build a Mongo projection so unused fields (image_data, embedding) never leave the server.
+        `fields` is an inclusion list, `exclude` an exclusion list; `_id` is always dropped.
+        """
+        if fields:
+            projection = {f: 1 for f in fields}
+        else:
+            projection = {f: 0 for f in (exclude or ())}
+        projection["_id"] = 0
+        return projection
 
     # ---------------- Student functions ---------------- #
     async def register_student(self, data: Dict[str, Any]) -> Dict[str, Any]:
@@ -61,10 +170,14 @@ class DBController:
                 raise ValueError("Missing 'roll' in data")
             roll = roll_raw.strip().lower()
             data["roll"] = roll  # ensure stored roll is normalized
+            data["updated_at"] = datetime.now(timezone.utc)  # lets galleries re-sync incrementally
 
+            update: Dict[str, Any] = {"$set": data}
+            if "image_ref" in data:
+                update["$unset"] = {"image_data": ""}  # photo now lives in the image store
             result = await self.students.update_one(
                 {"roll": roll},
-                {"$set": data},
+                update,
                 upsert=True
             )
 
@@ -79,7 +192,13 @@ class DBController:
             logger.error(f"{self.module_name} create_entry error: {e}")
             raise e
 
-    async def check_login(self, roll: str | None = None, name: str | None = None) -> dict | None:
+    async def check_login(
+        self,
+        roll: str | None = None,
+        name: str | None = None,
+        fields: Optional[Iterable[str]] = None,
+        exclude: Optional[Iterable[str]] = None,
+    ) -> dict | None:
         if not roll and not name:
             raise ValueError("Provide at least one of: roll or name")
 
@@ -89,40 +208,100 @@ class DBController:
         if name:
             query["name"] = name.strip()
 
-        doc = await self.students.find_one(query)
-        if doc:
-            doc.pop("_id", None)  # remove MongoDB ObjectId for clean output
-            return doc
-        return None
+        doc = await self.students.find_one(query, self._projection(fields, exclude))
+        return doc or None
 
-    async def read_entry(self, query: Dict[str, Any]) -> Dict[str, Any]:
+    async def read_entry(
+        self,
+        query: Dict[str, Any],
+        fields: Optional[Iterable[str]] = None,
+        exclude: Optional[Iterable[str]] = None,
+    ) -> Dict[str, Any]:
         try:
             # normalize roll query if present
             if "roll" in query and isinstance(query["roll"], str):
                 query["roll"] = query["roll"].strip().lower()
 
-            doc = await self.students.find_one(query)
-            if doc:
-                # Remove MongoDB _id to avoid serialization issues
-                doc.pop("_id", None)
-            return doc
+            # _id is projected out to avoid serialization issues
+            return await self.students.find_one(query, self._projection(fields, exclude))
         except Exception as e:
             logger.error(f"{self.module_name} read_entry error: {e}")
             raise e
 
-    async def fetch_all_entries(self) -> List[Dict[str, Any]]:
+    async def read_entries(self, rolls: Iterable[str], fields: Optional[Iterable[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """Several students in one query, keyed by normalized roll; missing rolls are simply absent."""
+        wanted = sorted({r.strip().lower() for r in rolls if r and r.strip()})
+        if not wanted:
+            return {}
         try:
-            cursor = self.students.find({})
-            docs = []
-            async for doc in cursor:
-                doc.pop("_id", None)
-                docs.append(doc)
+            projection = self._projection({"roll", *fields} if fields else None, exclude=("image_data",))
+            cursor = self.students.find({"roll": {"$in": wanted}}, projection)
+            return {doc["roll"]: doc async for doc in cursor}
+        except Exception as e:
+            logger.error(f"{self.module_name} read_entries error: {e}")
+            raise e
+
+    async def fetch_all_entries(
+        self,
+        fields: Optional[Iterable[str]] = None,
+        exclude: Optional[Iterable[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        try:
+            cursor = self.students.find({}, self._projection(fields, exclude))
+            docs = [doc async for doc in cursor]
             logger.info(f"{self.module_name}: fetched {len(docs)} students")
             return docs
         except Exception as e:
             logger.error(f"{self.module_name} fetch_all_entries error: {e}")
             raise e
 
+    async def iter_embeddings(self, batch_size: int = 1000, rolls: Optional[List[str]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Stream {roll, embedding, courses} only; image blobs and other fields stay in Mongo."""
+        query: Dict[str, Any] = {"embedding": {"$exists": True}}
+        if rolls is not None:
+            query["roll"] = {"$in": [r.strip().lower() for r in rolls]}
+        cursor = self.students.find(query, self._projection(("roll", "embedding", "courses")), batch_size=batch_size)
+        count = 0
+        async for doc in cursor:
+            count += 1
+            yield doc
+        logger.info(f"{self.module_name}: streamed {count} embeddings")
+
+    async def iter_roll_versions(self, batch_size: int = 5000) -> AsyncIterator[Dict[str, Any]]:
+        """Stream {roll, updated_at} for every student with an embedding (no vectors, no images)."""
+        cursor = self.students.find(
+            {"embedding": {"$exists": True}},
+            self._projection(("roll", "updated_at")),
+            batch_size=batch_size,
+        )
+        async for doc in cursor:
+            yield doc
+
+    async def set_enrollment(self, roll: str, course_id: str, enrolled: bool = True) -> Optional[List[str]]:
+        """Add/remove a course in the student's `courses` list; returns the new list or None if no such roll."""
+        try:
+            roll_n = roll.strip().lower()
+            op = "$addToSet" if enrolled else "$pull"
+            doc = await self.students.find_one_and_update(
+                {"roll": roll_n},
+                {op: {"courses": course_id.strip()}, "$set": {"updated_at": datetime.now(timezone.utc)}},
+                projection=self._projection(("courses",)),
+                return_document=ReturnDocument.AFTER,
+            )
+            if doc is None:
+                return None
+            logger.info(f"{self.module_name}: {'enrolled' if enrolled else 'unenrolled'} roll={roll_n} course={course_id}")
+            return doc.get("courses", [])
+        except Exception as e:
+            logger.error(f"{self.module_name} set_enrollment error: {e}")
+            raise e
+
+    async def images_in_use(self, shas: List[str]) -> Set[str]:
+        """The stored images among `shas` that some student still references."""
+        if not shas:
+            return set()
+        return set(await self.students.distinct("image_ref.sha256", {"image_ref.sha256": {"$in": list(shas)}}))
+
     async def delete_student(self, roll: str) -> str:
         try:
             if not roll:
@@ -140,6 +319,7 @@ class DBController:
 
     # ---------------- Attendance functions ---------------- #
     async def insert_attendance(self, data: Dict[str, Any]) -> str:
+        """Record one mark; returns "inserted", "duplicate" or "error"."""
         try:
             roll = data.get("roll")
             course = data.get("course")
@@ -147,8 +327,6 @@ class DBController:
             if not (roll and course and date_str):
                 raise ValueError("Missing roll/course/date in attendance data")
 
-            # nested path
-            path = f"courses.{course}.students.{roll}"
             student_attendance = {
                 "name": data.get("name"),
                 "roll": roll,
@@ -157,55 +335,328 @@ class DBController:
                 "similarity": data.get("similarity", None)
             }
 
-            # check if already exists
-            existing = await self.attendance.find_one({"date": date_str, path: {"$exists": True}})
-            if existing:
+            if self.layout == "flat":
+                inserted = await self._insert_mark(date_str, course, student_attendance)
+            else:
+                inserted = await self._insert_nested(date_str, course, student_attendance)
+
+            if not inserted:
                 logger.info(f"{self.module_name}: duplicate attendance for roll={roll}, course={course}, date={date_str}")
                 return "duplicate"
-
-            update_doc = {"$set": {path: student_attendance}}
-            result = await self.attendance.update_one({"date": date_str}, update_doc, upsert=True)
-
             logger.info(f"{self.module_name}: attendance inserted for roll={roll} date={date_str} course={course}")
             return "inserted"
         except Exception as e:
             logger.error(f"{self.module_name} insert_attendance error: {e}")
             return "error"
 
-    async def get_attendance_by_date(self, date: str) -> Dict[str, Any]:
+    async def _insert_mark(self, date_str: str, course: str, entry: Dict[str, Any]) -> bool:
+        # the unique (date, course, roll) index turns a repeat mark into DuplicateKeyError
         try:
-            doc = await self.attendance.find_one({"date": date})
-            if not doc:
-                return {}
-            doc.pop("_id", None)
+            await self.marks.insert_one({"date": date_str, "course": course, **entry})
+            return True
+        except DuplicateKeyError:
+            return False
+
+    async def _insert_nested(self, date_str: str, course: str, entry: Dict[str, Any]) -> bool:
+        path = f"courses.{course}.students.{entry['roll']}"
+        if not self.date_unique:
+            # no unique date index: a conditional upsert could create a second doc for the date
+            existing = await self.attendance.find_one({"date": date_str, path: {"$exists": True}}, {"_id": 1})
+            if existing:
+                return False
+            await self.attendance.update_one({"date": date_str}, {"$set": {path: entry}}, upsert=True)
+            return True
+
+        # Matches only while the path is unset. If it is already set, the upsert tries to insert a
+        # second doc for the date and the unique index rejects it. A DuplicateKeyError can also be
+        # a concurrent first mark of the day creating the date doc, so retry once against it.
+        for attempt in range(2):
+            try:
+                await self.attendance.update_one(
+                    {"date": date_str, path: {"$exists": False}}, {"$set": {path: entry}}, upsert=True
+                )
+                return True
+            except DuplicateKeyError:
+                if attempt:
+                    return False
+        return False
+
+    async def marked_rolls(self, date_str: str, course: str, rolls: Iterable[str]) -> Set[str]:
+        """Which of `rolls` already have a mark for `course` on `date_str`, in the layout writes go to."""
+        wanted = sorted({r for r in rolls if r})
+        if not wanted:
+            return set()
+        if self.layout == "flat":
+            cursor = self.marks.find({"date": date_str, "course": course, "roll": {"$in": wanted}}, {"_id": 0, "roll": 1})
+            return {doc["roll"] async for doc in cursor}
+        projection = {"_id": 0, **{f"courses.{course}.students.{r}": 1 for r in wanted}}
+        doc = await self.attendance.find_one({"date": date_str}, projection) or {}
+        students = ((doc.get("courses") or {}).get(course) or {}).get("students") or {}
+        return set(students) & set(wanted)
+
+    @staticmethod
+    def _split_bulk_error(e: BulkWriteError):
+        """(indices rejected by a unique key, indices that failed otherwise) from an unordered bulk write."""
+        if e.details.get("writeConcernErrors"):
+            raise e  # nothing is known to be durable
+        errors = e.details.get("writeErrors", [])
+        return [err["index"] for err in errors if err.get("code") == 11000], [err["index"] for err in errors if err.get("code") != 11000]
+
+    async def bulk_insert_attendance(self, records: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Write many marks in one unordered bulk_write (write-behind flush, multi-face check-in).
+        Returns {"inserted", "duplicate", "error", "outcomes"} with one "inserted"/"duplicate"/"error"
+        per record; repeat marks are skipped, not failed, and the other records are written even
+        when some fail.
+        """
+        if not records:
+            return {"inserted": 0, "duplicate": 0, "error": 0, "outcomes": []}
+        entries = [(r["date"], r["course"], {k: r.get(k) for k in _MARK_FIELDS}) for r in records]
+        for _, _, entry in entries:
+            entry["status"] = entry.get("status") or "marked"
+
+        if self.layout == "flat":
+            ops = [InsertOne({"date": d, "course": c, **entry}) for d, c, entry in entries]
+            rejected: List[int] = []
+            failed: List[int] = []
+            try:
+                await self.marks.bulk_write(ops, ordered=False)
+            except BulkWriteError as e:
+                rejected, failed = self._split_bulk_error(e)
+            return self._bulk_outcomes(len(ops), rejected, failed)
+
+        if not self.date_unique:
+            outcomes = [await self.insert_attendance({"date": d, "course": c, **entry}) for d, c, entry in entries]
+            return {"inserted": outcomes.count("inserted"), "duplicate": outcomes.count("duplicate"),
+                    "error": outcomes.count("error"), "outcomes": outcomes}
+
+        def op(d, c, entry):
+            path = f"courses.{c}.students.{entry['roll']}"
+            return UpdateOne({"date": d, path: {"$exists": False}}, {"$set": {path: entry}}, upsert=True)
+
+        # same semantics as _insert_nested: a unique-key rejection is either a repeat mark or a
+        # first-of-the-day race on the date doc, so rejected ops are retried once
+        pending = list(range(len(entries)))
+        failed: List[int] = []
+        for attempt in range(2):
+            try:
+                await self.attendance.bulk_write([op(*entries[i]) for i in pending], ordered=False)
+                pending = []
+            except BulkWriteError as e:
+                rejected, errored = self._split_bulk_error(e)
+                failed += [pending[i] for i in errored]
+                pending = [pending[i] for i in rejected]
+            if not pending:
+                break
+        return self._bulk_outcomes(len(entries), pending, failed)
+
+    @staticmethod
+    def _bulk_outcomes(count: int, rejected: Iterable[int], failed: Iterable[int] = ()) -> Dict[str, Any]:
+        outcomes = ["inserted"] * count
+        for i in rejected:
+            outcomes[i] = "duplicate"
+        for i in failed:
+            outcomes[i] = "error"
+        duplicate, error = outcomes.count("duplicate"), outcomes.count("error")
+        return {"inserted": count - duplicate - error, "duplicate": duplicate, "error": error, "outcomes": outcomes}
+
+    # ---------------- Attendance reads (both layouts) ---------------- #
+    @staticmethod
+    def _mark_entry(doc: Dict[str, Any]) -> Dict[str, Any]:
+        return {k: doc.get(k) for k in _MARK_FIELDS}
+
+    async def _marks_as_courses(self, query: Dict[str, Any]) -> Dict[str, Any]:
+        courses: Dict[str, Any] = {}
+        async for m in self.marks.find(query, {"_id": 0}):
+            courses.setdefault(m["course"], {"students": {}})["students"][m["roll"]] = self._mark_entry(m)
+        return courses
+
+    async def _date_doc(self, date: str) -> Dict[str, Any]:
+        """The nested per-date doc, with flat marks merged in when the flat layout is active."""
+        doc = await self.attendance.find_one({"date": date}, {"_id": 0}) or {}
+        if self.layout != "flat":
+            return doc
+        flat = await self._marks_as_courses({"date": date})
+        if not flat:
             return doc
+        merged = doc.get("courses", {}) if isinstance(doc.get("courses"), dict) else {}
+        for course, cdata in flat.items():
+            merged.setdefault(course, {"students": {}}).setdefault("students", {}).update(cdata["students"])
+        return {**doc, "date": date, "courses": merged}
+
+    async def get_attendance_by_date(self, date: str) -> Dict[str, Any]:
+        try:
+            return await self._date_doc(date)
         except Exception as e:
             logger.error(f"{self.module_name} get_attendance_by_date error: {e}")
             raise e
 
     async def get_attendance_by_course(self, date: str, course: str) -> Dict[str, Any]:
         try:
-            doc = await self.attendance.find_one({"date": date})
-            if not doc:
-                return {}
-            courses = doc.get("courses", {})
-            return courses.get(course, {}).get("students", {})
+            # project just this course out of the date doc instead of shipping every course
+            doc = await self.attendance.find_one({"date": date}, {"_id": 0, f"courses.{course}": 1}) or {}
+            students = dict(doc.get("courses", {}).get(course, {}).get("students", {}))
+            if self.layout == "flat":
+                async for m in self.marks.find({"date": date, "course": course}, {"_id": 0}):
+                    students[m["roll"]] = self._mark_entry(m)
+            return students
         except Exception as e:
             logger.error(f"{self.module_name} get_attendance_by_course error: {e}")
             raise e
 
     async def get_attendance_by_roll(self, date: str, roll: str) -> Dict[str, Any]:
         try:
-            doc = await self.attendance.find_one({"date": date})
-            if not doc:
-                return {}
-            courses = doc.get("courses", {})
-            # find roll under any course
-            for course_id, cdata in (courses.items() if isinstance(courses, dict) else []):
-                students = cdata.get("students", {})
-                if roll in students:
-                    return students[roll]
+            if self.layout == "flat":
+                mark = await self.marks.find_one({"date": date, "roll": roll}, {"_id": 0})
+                if mark:
+                    return self._mark_entry(mark)
+            # find roll under any course, server-side
+            pipeline = self._nested_rows_pipeline(date, date, roll=roll) + [{"$limit": 1}]
+            async for row in self.attendance.aggregate(pipeline):
+                return self._mark_entry(row)
             return {}
         except Exception as e:
             logger.error(f"{self.module_name} get_attendance_by_roll error: {e}")
             raise e
+
+    # ---------------- Range queries ---------------- #
+    @staticmethod
+    def _nested_rows_pipeline(start: str, end: str, course=None, roll=None) -> List[Dict[str, Any]]:
+        """
+        Aggregation stages that unroll nested date docs into flat {date, course, roll, ...} rows.
+        `course` / `roll` may be a single value or a list.
+        """
+        pipeline: List[Dict[str, Any]] = [
+            {"$match": {"date": {"$gte": start, "$lte": end}}},
+            {"$project": {"_id": 0, "date": 1, "c": {"$objectToArray": "$courses"}}},
+            {"$unwind": "$c"},
+        ]
+        if course:
+            pipeline.append({"$match": {"c.k": _match_value(course)}})
+        pipeline += [
+            {"$project": {"date": 1, "course": "$c.k", "s": {"$objectToArray": "$c.v.students"}}},
+            {"$unwind": "$s"},
+        ]
+        if roll:
+            pipeline.append({"$match": {"s.k": _match_value(roll)}})
+        pipeline.append({"$project": {"date": 1, "course": 1, "roll": "$s.k",
+                                      **{f: f"$s.v.{f}" for f in _MARK_FIELDS if f != "roll"}}})
+        return pipeline
+
+    @staticmethod
+    def _keyset(order: Tuple[str, str], after: Optional[List[str]]) -> Optional[Dict[str, Any]]:
+        # rows strictly after the last (primary, secondary) key of the previous page
+        if not after:
+            return None
+        first, second = order
+        return {"$or": [{first: {"$gt": after[0]}}, {first: after[0], second: {"$gt": after[1]}}]}
+
+    async def attendance_range(
+        self,
+        start: str,
+        end: str,
+        course: Optional[str] = None,
+        roll: Optional[str] = None,
+        after: Optional[List[str]] = None,
+        limit: int = 100,
+    ) -> Tuple[List[Dict[str, Any]], Optional[List[str]]]:
+        """
+        One page of marks in [start, end] for a course or a roll, sorted by date then
+        roll (course queries) or course (roll queries). Returns (rows, next_after); pass
+        next_after back as `after` for the following page. Pages are filtered and limited
+        in Mongo, so a semester report never pulls whole date documents.
+        """
+        try:
+            order = ("date", "roll") if course else ("date", "course")
+            keyset = self._keyset(order, after)
+            rows: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+            pipeline = self._nested_rows_pipeline(start, end, course=course, roll=roll)
+            if keyset:
+                pipeline.append({"$match": keyset})
+            pipeline += [{"$sort": {order[0]: 1, order[1]: 1}}, {"$limit": limit}]
+            async for row in self.attendance.aggregate(pipeline):
+                rows[(row[order[0]], row[order[1]])] = row
+
+            if self.layout == "flat":
+                query: Dict[str, Any] = {"date": {"$gte": start, "$lte": end}}
+                if course:
+                    query["course"] = course
+                if roll:
+                    query["roll"] = roll
+                if keyset:
+                    query = {"$and": [query, keyset]}
+                cursor = self.marks.find(query, {"_id": 0}).sort([(order[0], ASCENDING), (order[1], ASCENDING)]).limit(limit)
+                async for row in cursor:
+                    rows[(row[order[0]], row[order[1]])] = row
+
+            page = [{"date": rows[k]["date"], "course": rows[k]["course"], **self._mark_entry(rows[k])}
+                    for k in sorted(rows)[:limit]]
+            next_after = [page[-1][order[0]], page[-1][order[1]]] if len(page) == limit else None
+            return page, next_after
+        except Exception as e:
+            logger.error(f"{self.module_name} attendance_range error: {e}")
+            raise e
+
+    async def iter_attendance(
+        self,
+        start: str,
+        end: str,
+        courses: Optional[List[str]] = None,
+        rolls: Optional[List[str]] = None,
+        batch_size: int = 1000,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream every mark in [start, end] (optionally limited to some courses / rolls), sorted by
+        date, course, roll. Rows come off a server-side cursor `batch_size` at a time, and the sort
+        may spill to disk on the server, so memory here stays bounded by one batch.
+        """
+        stages = self._nested_rows_pipeline(start, end, course=courses or None, roll=rolls or None)
+        collection = self.attendance
+        if self.layout == "flat":
+            query: Dict[str, Any] = {"date": {"$gte": start, "$lte": end}}
+            if courses:
+                query["course"] = _match_value(courses)
+            if rolls:
+                query["roll"] = _match_value(rolls)
+            collection = self.marks
+            stages = [
+                {"$match": query},
+                {"$unionWith": {"coll": self.attendance.name, "pipeline": stages}},
+                {"$group": {"_id": {"date": "$date", "course": "$course", "roll": "$roll"},
+                            **{f: {"$first": f"${f}"} for f in _MARK_FIELDS if f != "roll"}}},
+                {"$project": {"_id": 0, "date": "$_id.date", "course": "$_id.course", "roll": "$_id.roll",
+                              **{f: 1 for f in _MARK_FIELDS if f != "roll"}}},
+            ]
+        stages.append({"$sort": {"date": 1, "course": 1, "roll": 1}})
+        try:
+            cursor = collection.aggregate(stages, allowDiskUse=True, batchSize=batch_size)
+            async for row in cursor:
+                yield {f: row.get(f) for f in EXPORT_FIELDS}
+        except Exception as e:
+            logger.error(f"{self.module_name} iter_attendance error: {e}")
+            raise e
+
+    async def attendance_summary(self, course: str, start: str, end: str) -> Dict[str, Any]:
+        """Per-roll and per-date mark counts for a course over [start, end], grouped in Mongo."""
+        try:
+            stages = self._nested_rows_pipeline(start, end, course=course)
+            collection = self.attendance
+            if self.layout == "flat":
+                # marks plus any not-yet-migrated date docs; a mark present in both counts once
+                collection = self.marks
+                stages = [
+                    {"$match": {"course": course, "date": {"$gte": start, "$lte": end}}},
+                    {"$unionWith": {"coll": self.attendance.name, "pipeline": stages}},
+                ]
+            dedupe = {"$group": {"_id": {"date": "$date", "roll": "$roll"}, "name": {"$first": "$name"}}}
+            by_roll = [dedupe, {"$group": {"_id": "$_id.roll", "name": {"$first": "$name"}, "days": {"$sum": 1}}},
+                       {"$sort": {"_id": 1}}]
+            by_date = [dedupe, {"$group": {"_id": "$_id.date", "count": {"$sum": 1}}}, {"$sort": {"_id": 1}}]
+            per_roll = [{"roll": g["_id"], "name": g.get("name"), "days": g["days"]}
+                        async for g in collection.aggregate(stages + by_roll)]
+            per_date = [{"date": g["_id"], "count": g["count"]} async for g in collection.aggregate(stages + by_date)]
+            return {"per_roll": per_roll, "per_date": per_date}
+        except Exception as e:
+            logger.error(f"{self.module_name} attendance_summary error: {e}")
+            raise e
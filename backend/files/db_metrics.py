@@ -0,0 +1,131 @@
+# files/db_metrics.py
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List
+
+from pymongo import monitoring
+
+
+def _percentiles(samples: List[float]) -> Dict[str, Any]:
+    if not samples:
+        return {"count": 0, "p50_ms": None, "p95_ms": None, "p99_ms": None, "max_ms": None}
+    ordered = sorted(samples)
+    last = len(ordered) - 1
+
+    def pick(q: float) -> float:
+        return round(ordered[min(last, int(round(q * last)))], 3)
+
+    return {"count": len(ordered), "p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "max_ms": round(ordered[-1], 3)}
+
+
+class MongoPoolMetrics(monitoring.CommandListener, monitoring.ConnectionPoolListener):
+    """
+    PyMongo event listener for the shared Motor client.
+
+    A command is "cold" when it runs on a connection's first checkout (the TCP/TLS
+    handshake and auth were just paid) and "warm" otherwise. Motor runs each
+    operation on one executor thread, so checkout and command events are tied
+    together through a thread-local.
+    """
+
+    def __init__(self, window: int = 2048):
+        self.version = "0.0.1"
+        self.module_name = "MongoPoolMetrics"
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._fresh: set = set()          # (address, connection_id) created but never checked out
+        self._pending: Dict[int, bool] = {}  # request_id -> cold?
+        self._latency = {"cold": deque(maxlen=window), "warm": deque(maxlen=window)}
+        self._checkout_wait = deque(maxlen=window)
+        self.counters = {
+            "connections_created": 0,
+            "connections_closed": 0,
+            "checkouts": 0,
+            "checkout_failed": 0,
+            "pool_cleared": 0,
+            "commands_failed": 0,
+        }
+
+    def info(self) -> Dict[str, Any]:
+        return {"module_name": self.module_name, "version": self.version}
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            cold = list(self._latency["cold"])
+            warm = list(self._latency["warm"])
+            wait = list(self._checkout_wait)
+            counters = dict(self.counters)
+        return {
+            "counters": counters,
+            "command_latency": {"cold": _percentiles(cold), "warm": _percentiles(warm)},
+            "checkout_wait": _percentiles(wait),
+        }
+
+    # ---------------- Command events ---------------- #
+    def started(self, event):
+        cold = getattr(self._local, "cold", False)
+        self._local.cold = False  # only the first command after checkout counts as cold
+        with self._lock:
+            self._pending[event.request_id] = cold
+
+    def succeeded(self, event):
+        with self._lock:
+            cold = self._pending.pop(event.request_id, False)
+            self._latency["cold" if cold else "warm"].append(event.duration_micros / 1000.0)
+
+    def failed(self, event):
+        with self._lock:
+            self._pending.pop(event.request_id, None)
+            self.counters["commands_failed"] += 1
+
+    # ---------------- Pool events ---------------- #
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.counters["pool_cleared"] += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self._fresh.add((event.address, event.connection_id))
+            self.counters["connections_created"] += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self._fresh.discard((event.address, event.connection_id))
+            self.counters["connections_closed"] += 1
+
+    def connection_check_out_started(self, event):
+        self._local.checkout_t0 = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.counters["checkout_failed"] += 1
+
+    def connection_checked_out(self, event):
+        t0 = getattr(self._local, "checkout_t0", None)
+        key = (event.address, event.connection_id)
+        with self._lock:
+            cold = key in self._fresh
+            self._fresh.discard(key)
+            self.counters["checkouts"] += 1
+            if t0 is not None:
+                self._checkout_wait.append((time.perf_counter() - t0) * 1000.0)
+        self._local.cold = cold
+
+    def connection_checked_in(self, event):
+        pass
+
+
+db_metrics = MongoPoolMetrics()
@@ -0,0 +1,511 @@
+# files/gallery.py
+import os
+import threading
+import time
+from datetime import timezone
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from files.ann_index import make_index, top_k
+from files.logger import logger
+
+_DEFAULT = object()
+
+
+class EmbeddingGallery:
+    """
+    Resident copy of every enrolled face embedding.
+
+    Rows of ``_matrix`` are L2-normalized float32 vectors addressed by stable
+    slot ids, and ``_rolls`` is the parallel list of (normalized) rolls, so an
+    exact cosine search is one mat-vec product. Deleted slots are masked out
+    and reused by later inserts, which keeps slot ids valid for the optional
+    ANN index (ANN_BACKEND=ivf|hnsw). Exact search stays the fallback below
+    ANN_MIN_SIZE entries or if the index fails, and is also the recall oracle.
+
+    With ANN_INDEX_DIR set, the gallery and index are snapshotted to disk. A
+    restart then only fetches students whose ``updated_at`` is newer than the
+    snapshot (plus a roll-only scan to drop deleted ones) instead of
+    re-reading every embedding from Mongo.
+
+    Each slot also carries the student's enrolled courses; ``search(course=...)``
+    scores only that course's partition (1:k instead of 1:N).
+    """
+
+    def __init__(self, dim: int = 512, index: Any = _DEFAULT, persist_dir: Optional[str] = None):
+        self.version = "0.2.0"
+        self.module_name = "EmbeddingGallery"
+        self.dim = dim
+
+        self._lock = threading.RLock()
+        self._matrix = np.zeros((0, dim), dtype=np.float32)  # capacity-sized buffer
+        self._valid = np.zeros(0, dtype=bool)
+        self._rolls: List[Optional[str]] = []                # slot -> roll (None when free)
+        self._free: List[int] = []
+        self._slot_of: Dict[str, int] = {}
+        self._courses: List[Tuple[str, ...]] = []             # slot -> enrolled courses
+        self._course_slots: Dict[str, Set[int]] = {}
+        self._course_arrays: Dict[str, np.ndarray] = {}       # cached partitions, dropped on change
+        self.loaded = False
+        self.synced_at: Optional[float] = None
+        self._retraining = False
+
+        self.index = make_index(dim) if index is _DEFAULT else index
+        try:
+            self.ann_min_size: int = int(os.environ.get("ANN_MIN_SIZE", 2000))
+        except ValueError:
+            self.ann_min_size = 2000
+        self.persist_dir = persist_dir or os.environ.get("ANN_INDEX_DIR") or None
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "module_name": self.module_name,
+            "version": self.version,
+            "size": len(self._slot_of),
+            "slots": len(self._rolls),
+            "courses": len(self._course_slots),
+            "loaded": self.loaded,
+            "index": self.index.info() if self.index is not None else {"backend": "exact"},
+            "ann_active": self._ann_active(),
+            "retraining": self._retraining,
+            "ann_min_size": self.ann_min_size,
+            "persist_dir": self.persist_dir,
+        }
+
+    def __len__(self) -> int:
+        return len(self._slot_of)
+
+    @staticmethod
+    def _norm_roll(roll: str) -> str:
+        return (roll or "").strip().lower()
+
+    @staticmethod
+    def _norm_courses(courses: Optional[Iterable[str]]) -> Tuple[str, ...]:
+        return tuple(sorted({str(c).strip() for c in (courses or ()) if str(c).strip()}))
+
+    def _prepare(self, embedding) -> Optional[np.ndarray]:
+        vec = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        if vec.shape[0] != self.dim:
+            return None
+        n = float(np.linalg.norm(vec))
+        if n == 0.0:
+            return None
+        return vec / n
+
+    def _ann_active(self) -> bool:
+        return self.index is not None and self.index.ready and len(self._slot_of) >= self.ann_min_size
+
+    # ---------------- Build / sync ---------------- #
+    async def load(self, db) -> int:
+        """
+        Bring the gallery in line with the students collection: a full rebuild the
+        first time (unless a disk snapshot exists), an incremental reconcile afterwards.
+        """
+        if self.loaded or self._load_snapshot():
+            await self._reconcile(db)
+        else:
+            started = time.time()
+            rolls: List[str] = []
+            rows: List[np.ndarray] = []
+            courses: List[Tuple[str, ...]] = []
+            async for s in db.iter_embeddings():
+                roll = self._norm_roll(s.get("roll"))
+                vec = self._prepare(s["embedding"]) if s.get("embedding") else None
+                if not roll or vec is None:
+                    continue
+                rolls.append(roll)
+                rows.append(vec)
+                courses.append(self._norm_courses(s.get("courses")))
+            self.replace(rolls, rows, courses)
+            self.synced_at = started
+        self.rebuild_index()
+        self.save()
+        logger.info(f"{self.module_name}: loaded {len(self)} embeddings")
+        return len(self)
+
+    async def _reconcile(self, db):
+        # margin for clock skew between the workers that stamp updated_at
+        since = (self.synced_at or 0.0) - 300.0
+        started = time.time()
+        seen = set()
+        stale: List[str] = []
+        async for doc in db.iter_roll_versions():
+            roll = self._norm_roll(doc.get("roll"))
+            if not roll:
+                continue
+            seen.add(roll)
+            ts = doc.get("updated_at")
+            if ts is not None and ts.tzinfo is None:
+                ts = ts.replace(tzinfo=timezone.utc)  # Mongo hands back naive UTC datetimes
+            if roll not in self._slot_of or (ts is not None and ts.timestamp() > since):
+                stale.append(roll)
+        removed = [roll for roll in list(self._slot_of) if roll not in seen]
+        for roll in removed:
+            self.remove(roll)
+        for start in range(0, len(stale), 1000):
+            async for s in db.iter_embeddings(rolls=stale[start:start + 1000]):
+                if s.get("embedding"):
+                    self.upsert(s.get("roll"), s["embedding"], courses=s.get("courses") or ())
+        self.synced_at = started
+        self.loaded = True
+        logger.info(f"{self.module_name}: reconciled (+{len(stale)} refreshed, -{len(removed)} removed)")
+
+    def replace(self, rolls: List[str], rows: List[np.ndarray], courses: Optional[List[Tuple[str, ...]]] = None):
+        matrix = np.vstack(rows).astype(np.float32, copy=False) if rows else np.zeros((0, self.dim), dtype=np.float32)
+        slot_of: Dict[str, int] = {}
+        keep_rolls: List[Optional[str]] = []
+        keep_rows: List[int] = []
+        # Later duplicates win, mirroring the upsert semantics of register_student
+        for i, roll in enumerate(rolls):
+            if roll in slot_of:
+                keep_rows[slot_of[roll]] = i
+                continue
+            slot_of[roll] = len(keep_rolls)
+            keep_rolls.append(roll)
+            keep_rows.append(i)
+        if len(keep_rows) != len(rolls):
+            matrix = matrix[keep_rows]
+        with self._lock:
+            self._matrix = np.ascontiguousarray(matrix)
+            self._valid = np.ones(len(keep_rolls), dtype=bool)
+            self._rolls = keep_rolls
+            self._free = []
+            self._slot_of = slot_of
+            self._reset_courses([courses[i] if courses else () for i in keep_rows])
+            self.loaded = True
+            if self.index is not None:
+                self.index.build(self._matrix, np.arange(len(keep_rolls), dtype=np.int64))
+
+    def rebuild_index(self, force: bool = False):
+        if self.index is None:
+            return
+        with self._lock:
+            if not (force or self.index.needs_rebuild(len(self._slot_of))):
+                return
+            matrix, slots = self._matrix, np.flatnonzero(self._valid[:len(self._rolls)])
+        t0 = time.perf_counter()
+        # k-means outside the lock so searches keep running; rows that change meanwhile
+        # are still assigned to a cell below, they just did not shape the centroids
+        trained = self.index.train(matrix, slots)
+        with self._lock:
+            slots = np.flatnonzero(self._valid[:len(self._rolls)])
+            self.index.build(self._matrix, slots, trained)
+        logger.info(f"{self.module_name}: {self.index.name} index built over {len(slots)} rows in {time.perf_counter() - t0:.2f}s")
+
+    def _maybe_retrain(self):
+        """Retrain on a background thread once upserts/removes have doubled or halved the gallery."""
+        if self.index is None or not self.loaded or self._retraining:
+            return
+        with self._lock:
+            if not self.index.needs_rebuild(len(self._slot_of)):
+                return
+            self._retraining = True
+        threading.Thread(target=self._retrain, name="gallery-retrain", daemon=True).start()
+
+    def _retrain(self):
+        try:
+            self.rebuild_index()
+        except Exception as e:
+            logger.error(f"{self.module_name}: background {self.index.name} retrain failed: {e}")
+        finally:
+            self._retraining = False
+
+    # ---------------- Course partitions ---------------- #
+    def _reset_courses(self, per_slot: List[Tuple[str, ...]]):
+        self._courses = [self._norm_courses(c) for c in per_slot]
+        self._course_slots = {}
+        self._course_arrays = {}
+        for slot, courses in enumerate(self._courses):
+            for course in courses:
+                self._course_slots.setdefault(course, set()).add(slot)
+
+    def _assign_courses(self, slot: int, courses: Tuple[str, ...]):
+        for course in self._courses[slot]:
+            members = self._course_slots.get(course)
+            if members is not None:
+                members.discard(slot)
+                if not members:
+                    del self._course_slots[course]
+            self._course_arrays.pop(course, None)
+        self._courses[slot] = courses
+        for course in courses:
+            self._course_slots.setdefault(course, set()).add(slot)
+            self._course_arrays.pop(course, None)
+
+    def set_courses(self, roll: str, courses: Iterable[str]) -> bool:
+        """Replace a student's enrolled courses without touching the embedding."""
+        with self._lock:
+            slot = self._slot_of.get(self._norm_roll(roll))
+            if slot is None:
+                return False
+            self._assign_courses(slot, self._norm_courses(courses))
+        return True
+
+    def has_course(self, course: str) -> bool:
+        return bool(self._course_slots.get(str(course).strip()))
+
+    def _course_partition(self, course: str) -> np.ndarray:
+        course = str(course).strip()
+        arr = self._course_arrays.get(course)
+        if arr is None:
+            arr = np.fromiter(sorted(self._course_slots.get(course, ())), dtype=np.int64)
+            self._course_arrays[course] = arr
+        return arr
+
+    # ---------------- Incremental updates ---------------- #
+    def _alloc_slot(self) -> int:
+        if self._free:
+            return self._free.pop()
+        slot = len(self._rolls)
+        if slot == self._matrix.shape[0]:
+            capacity = max(16, slot * 2)
+            grown = np.zeros((capacity, self.dim), dtype=np.float32)
+            grown[:slot] = self._matrix[:slot]
+            valid = np.zeros(capacity, dtype=bool)
+            valid[:slot] = self._valid[:slot]
+            self._matrix, self._valid = grown, valid
+        self._rolls.append(None)
+        self._courses.append(())
+        return slot
+
+    def upsert(self, roll: str, embedding, courses: Optional[Iterable[str]] = None) -> bool:
+        """Insert or overwrite a roll; `courses=None` keeps its current enrollment."""
+        roll = self._norm_roll(roll)
+        vec = self._prepare(embedding)
+        if not roll or vec is None:
+            logger.warning(f"{self.module_name}: rejected embedding for roll={roll}")
+            return False
+        with self._lock:
+            slot = self._slot_of.get(roll)
+            if slot is None:
+                slot = self._alloc_slot()
+                self._rolls[slot] = roll
+                self._slot_of[roll] = slot
+            self._matrix[slot] = vec
+            self._valid[slot] = True
+            if courses is not None:
+                self._assign_courses(slot, self._norm_courses(courses))
+            if self.index is not None:
+                self.index.add(slot, vec)
+        self._maybe_retrain()
+        return True
+
+    def remove(self, roll: str) -> bool:
+        roll = self._norm_roll(roll)
+        with self._lock:
+            slot = self._slot_of.pop(roll, None)
+            if slot is None:
+                return False
+            self._valid[slot] = False
+            self._rolls[slot] = None
+            self._assign_courses(slot, ())
+            self._free.append(slot)
+            if self.index is not None:
+                self.index.remove(slot)
+        self._maybe_retrain()
+        return True
+
+    def get(self, roll: str) -> Optional[np.ndarray]:
+        slot = self._slot_of.get(self._norm_roll(roll))
+        if slot is None:
+            return None
+        return self._matrix[slot].copy()
+
+    def enrolled(self, roll: str, course: str) -> bool:
+        slot = self._slot_of.get(self._norm_roll(roll))
+        return slot is not None and str(course).strip() in self._courses[slot]
+
+    def score(self, roll: str, embedding) -> Optional[float]:
+        """Cosine between `embedding` and one stored roll (1:1 verification), or None if the roll is absent."""
+        probe = self._prepare(embedding)
+        if probe is None:
+            return None
+        with self._lock:
+            slot = self._slot_of.get(self._norm_roll(roll))
+            if slot is None:
+                return None
+            return float(self._matrix[slot] @ probe)
+
+    # ---------------- Search ---------------- #
+    def _exact_top(self, probe: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        high = len(self._rolls)
+        scores = self._matrix[:high] @ probe
+        scores[~self._valid[:high]] = -np.inf
+        best = top_k(scores, k)
+        best = best[np.isfinite(scores[best])]
+        return best, scores[best]
+
+    def _top(self, probe: np.ndarray, k: int = 1, exact: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        if not exact and self._ann_active():
+            try:
+                slots, scores = self.index.search(probe, self._matrix, k)
+                keep = self._valid[slots]
+                if keep.any():
+                    return slots[keep], scores[keep]
+            except Exception as e:
+                logger.error(f"{self.module_name}: {self.index.name} search failed, using exact: {e}")
+        return self._exact_top(probe, k)
+
+    def search(self, embedding, exact: bool = False, course: Optional[str] = None) -> Tuple[Optional[str], float]:
+        """
+        Return (best_roll, cosine) for one probe embedding, or (None, -1.0) when empty.
+        With `course`, only students enrolled in that course are scored.
+        """
+        probe = self._prepare(embedding)
+        if probe is None:
+            return None, -1.0
+        with self._lock:
+            if not self._slot_of:
+                return None, -1.0
+            if course is not None:
+                part = self._course_partition(course)
+                if part.size == 0:
+                    return None, -1.0
+                scores = self._matrix[part] @ probe
+                best = int(np.argmax(scores))
+                return self._rolls[int(part[best])], float(scores[best])
+            slots, scores = self._top(probe, 1, exact=exact)
+            if slots.size == 0:
+                return None, -1.0
+            return self._rolls[int(slots[0])], float(scores[0])
+
+    def search_many(
+        self, embeddings, exact: bool = False, course: Optional[str] = None
+    ) -> List[Tuple[Optional[str], float]]:
+        """
+        `search` for a stack of probes (one per face in a frame): one (M, d) x (d, N)
+        product instead of M mat-vecs. Rows that cannot be scored give (None, -1.0).
+        """
+        probes = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+        out: List[Tuple[Optional[str], float]] = [(None, -1.0)] * len(probes)
+        norms = np.linalg.norm(probes, axis=1)
+        rows = np.flatnonzero(norms > 0)
+        if rows.size == 0:
+            return out
+        probes = probes[rows] / norms[rows, None]
+        with self._lock:
+            if not self._slot_of:
+                return out
+            if course is not None:
+                part = self._course_partition(course)
+                if part.size == 0:
+                    return out
+                scores = probes @ self._matrix[part].T
+                best = np.argmax(scores, axis=1)
+                for i, r in enumerate(rows):
+                    out[r] = (self._rolls[int(part[best[i]])], float(scores[i, best[i]]))
+                return out
+            if not exact and self._ann_active():
+                for i, r in enumerate(rows):
+                    slots, s = self._top(probes[i], 1)
+                    if slots.size:
+                        out[r] = (self._rolls[int(slots[0])], float(s[0]))
+                return out
+            high = len(self._rolls)
+            scores = probes @ self._matrix[:high].T
+            scores[:, ~self._valid[:high]] = -np.inf
+            best = np.argmax(scores, axis=1)
+            for i, r in enumerate(rows):
+                if np.isfinite(scores[i, best[i]]):
+                    out[r] = (self._rolls[int(best[i])], float(scores[i, best[i]]))
+            return out
+
+    def recall(self, sample: int = 200, noise: float = 0.05, seed: int = 0) -> Dict[str, Any]:
+        """
+        Recall oracle: perturb `sample` stored embeddings, search them with the ANN
+        index and with exact search, and report top-1 agreement plus mean latency.
+        """
+        with self._lock:
+            high = len(self._rolls)
+            valid = self._valid[:high].copy()
+            matrix = self._matrix  # rows may be overwritten meanwhile; fine for an estimate
+            slots = np.flatnonzero(valid)
+            if slots.size == 0:
+                return {"sample": 0, "recall_at_1": None}
+            rng = np.random.default_rng(seed)
+            picked = rng.choice(slots, min(sample, slots.size), replace=False)
+            probes = matrix[picked] + rng.normal(0.0, noise, (picked.size, self.dim)).astype(np.float32)
+        probes /= np.linalg.norm(probes, axis=1, keepdims=True)
+        # Only each ANN lookup takes the lock (the index is mutated in place); the exact scans
+        # run on the snapshot, so a large sample does not stall searches and upserts.
+        hits, ann_t, exact_t = 0, 0.0, 0.0
+        for probe in probes:
+            with self._lock:
+                t0 = time.perf_counter()
+                ann_slots, _ = self._top(probe, 1)
+                t1 = time.perf_counter()
+            scores = matrix[:high] @ probe
+            scores[~valid] = -np.inf
+            exact = int(np.argmax(scores))
+            exact_t += time.perf_counter() - t1
+            ann_t += t1 - t0
+            hits += int(ann_slots.size > 0 and ann_slots[0] == exact)
+        n = len(probes)
+        return {
+            "sample": n,
+            "ann_active": self._ann_active(),
+            "recall_at_1": round(hits / n, 4),
+            "ann_ms": round(1000 * ann_t / n, 4),
+            "exact_ms": round(1000 * exact_t / n, 4),
+        }
+
+    # ---------------- Persistence ---------------- #
+    def _snapshot_path(self) -> str:
+        return os.path.join(self.persist_dir, "gallery.npz")
+
+    def save(self):
+        if not self.persist_dir:
+            return
+        try:
+            os.makedirs(self.persist_dir, exist_ok=True)
+            with self._lock:
+                high = len(self._rolls)
+                state = {
+                    "dim": np.asarray(self.dim),
+                    "synced_at": np.asarray(self.synced_at or 0.0),
+                    "matrix": self._matrix[:high],
+                    "valid": self._valid[:high],
+                    "rolls": np.asarray([r or "" for r in self._rolls], dtype=str),
+                    "courses": np.asarray(["\x1f".join(c) for c in self._courses], dtype=str),
+                    "backend": np.asarray(self.index.name if self.index is not None else "exact"),
+                }
+                if self.index is not None:
+                    state.update(self.index.state())
+                    self.index.save_files(self.persist_dir)
+                tmp = self._snapshot_path() + ".tmp.npz"
+                np.savez(tmp, **state)
+                os.replace(tmp, self._snapshot_path())
+            logger.info(f"{self.module_name}: snapshot saved to {self._snapshot_path()}")
+        except Exception as e:
+            logger.error(f"{self.module_name}: snapshot save failed: {e}")
+
+    def _load_snapshot(self) -> bool:
+        if not self.persist_dir or not os.path.exists(self._snapshot_path()):
+            return False
+        try:
+            with np.load(self._snapshot_path()) as data:
+                state = {k: data[k] for k in data.files}
+            if int(state["dim"]) != self.dim:
+                return False
+            rolls = [str(r) or None for r in state["rolls"].tolist()]
+            with self._lock:
+                self._matrix = np.ascontiguousarray(state["matrix"], dtype=np.float32)
+                self._valid = state["valid"].astype(bool)
+                self._rolls = rolls
+                self._slot_of = {r: i for i, r in enumerate(rolls) if r is not None and self._valid[i]}
+                self._free = [i for i, r in enumerate(rolls) if r is None or not self._valid[i]]
+                packed = state["courses"].tolist() if "courses" in state else [""] * len(rolls)
+                self._reset_courses([tuple(c.split("\x1f")) if c else () for c in packed])
+                self.synced_at = float(state["synced_at"]) or None
+                self.loaded = True
+                same_backend = self.index is not None and str(state["backend"]) == self.index.name
+                if same_backend and not self.index.load_state(state, self.persist_dir):
+                    same_backend = False
+                if self.index is not None and not same_backend:
+                    self.rebuild_index(force=True)
+            logger.info(f"{self.module_name}: snapshot loaded ({len(self)} embeddings)")
+            return True
+        except Exception as e:
+            logger.error(f"{self.module_name}: snapshot load failed, rebuilding from DB: {e}")
+            return False
@@ -0,0 +1,211 @@
+# files/image_utils.py
+import os
+import struct
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from files.logger import logger
+
+# SOFn markers carry the frame size; C4 (DHT), C8 (JPG) and CC (DAC) share the range but do not
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+class ImageTooLargeError(ValueError):
+    """Upload exceeds MAX_IMAGE_BYTES or MAX_IMAGE_PIXELS; rejected before decoding."""
+
+
+def probe_dimensions(data: bytes) -> Optional[Tuple[str, int, int]]:
+    """(format, width, height) read from the JPEG SOF / PNG IHDR header only, or None if unknown."""
+    if data[:8] == _PNG_SIGNATURE and len(data) >= 24 and data[12:16] == b"IHDR":
+        width, height = struct.unpack(">II", data[16:24])
+        return "png", int(width), int(height)
+    if data[:2] != b"\xff\xd8":
+        return None
+    i, n = 2, len(data)
+    while i + 4 <= n:
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker in (0x01,) or 0xD0 <= marker <= 0xD9:  # standalone markers, no length
+            i += 2
+            continue
+        seg_len = struct.unpack(">H", data[i + 2:i + 4])[0]
+        if marker in _JPEG_SOF:
+            if i + 9 > n:
+                return None
+            height, width = struct.unpack(">HH", data[i + 5:i + 9])
+            return "jpeg", int(width), int(height)
+        if marker == 0xDA:  # start of scan without a frame header: malformed
+            return None
+        i += 2 + seg_len
+    return None
+
+
+_REDUCED_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+class DecodedImage:
+    """
+    A detection-sized decode of an upload plus the scale back to the original.
+
+    ``frame`` may come from libjpeg's DCT-domain 1/2, 1/4 or 1/8 decode
+    (``factor``). Boxes found on it are in reduced coordinates. ``crop_source``
+    hands FaceNet the reduced frame when the face is already big enough there,
+    and otherwise decodes the full-resolution image once and returns the box
+    scaled up.
+    """
+
+    __slots__ = ("data", "frame", "factor", "_full")
+
+    def __init__(self, data: bytes, frame: np.ndarray, factor: int = 1):
+        self.data = data
+        self.frame = frame
+        self.factor = factor
+        self._full: Optional[np.ndarray] = frame if factor == 1 else None
+
+    def full(self) -> np.ndarray:
+        if self._full is None:
+            full = cv2.imdecode(np.frombuffer(self.data, np.uint8), cv2.IMREAD_COLOR)
+            self._full = full if full is not None else self.frame
+        return self._full
+
+    def crop_source(self, box, min_side: int) -> Tuple[np.ndarray, Any]:
+        """(frame, box) to crop a face from: reduced if the face spans >= min_side px there, else full-res."""
+        if self.factor == 1:
+            return self.frame, box
+        x1, y1, x2, y2 = [float(v) for v in box]
+        if min(x2 - x1, y2 - y1) >= min_side:
+            return self.frame, box
+        full = self.full()
+        if full is self.frame:
+            return self.frame, box
+        # reduced decode sizes are ceil(n / factor); map back through the actual ratio
+        sy = full.shape[0] / float(self.frame.shape[0])
+        sx = full.shape[1] / float(self.frame.shape[1])
+        return full, (x1 * sx, y1 * sy, x2 * sx, y2 * sy)
+
+
+def decode_for_detection(data: bytes, target_side: int) -> Optional[DecodedImage]:
+    """
+    Decode a JPEG at the smallest 1/2, 1/4 or 1/8 scale whose long side still covers
+    `target_side` (the detector input size), so YOLO never upsamples. PNG and unknown
+    formats, and `target_side <= 0`, decode at full size.
+    """
+    factor = 1
+    probe = probe_dimensions(data)
+    if probe is not None and probe[0] == "jpeg" and target_side > 0:
+        long_side = max(probe[1], probe[2])
+        for candidate in (8, 4, 2):
+            if long_side / candidate >= target_side:
+                factor = candidate
+                break
+    try:
+        frame = cv2.imdecode(np.frombuffer(data, np.uint8), _REDUCED_FLAGS[factor])
+    except Exception:
+        return None
+    if frame is None:
+        return None
+    return DecodedImage(data, frame, factor)
+
+
+class ImageIngest:
+    """
+    One-pass normalization of uploaded photos.
+
+    ``check`` enforces MAX_IMAGE_BYTES and, using only the file header,
+    MAX_IMAGE_PIXELS. ``normalize`` then decodes once, at a reduced JPEG scale
+    when the source is far larger than needed (EXIF orientation is applied by
+    OpenCV), and downscales so the long side is at most
+    INGEST_MAX_SIDE. It re-encodes to JPEG at INGEST_JPEG_QUALITY. The returned
+    frame is what detection and embedding run on, and the returned bytes are
+    what gets stored. Timings are reported per stage.
+    """
+
+    def __init__(self):
+        self.version = "0.0.1"
+        self.module_name = "ImageIngest"
+        try:
+            self.max_bytes: int = int(os.environ.get("MAX_IMAGE_BYTES", 5 * 1024 * 1024))
+        except ValueError:
+            self.max_bytes = 5 * 1024 * 1024
+        try:
+            self.max_pixels: int = int(os.environ.get("MAX_IMAGE_PIXELS", 40_000_000))
+        except ValueError:
+            self.max_pixels = 40_000_000
+        try:
+            self.max_side: int = int(os.environ.get("INGEST_MAX_SIDE", 1280))
+        except ValueError:
+            self.max_side = 1280
+        try:
+            self.jpeg_quality: int = min(100, max(50, int(os.environ.get("INGEST_JPEG_QUALITY", 90))))
+        except ValueError:
+            self.jpeg_quality = 90
+
+    def info(self) -> Dict[str, Any]:
+        return {"module_name": self.module_name, "version": self.version}
+
+    def check(self, data: bytes) -> Optional[Tuple[str, int, int]]:
+        """Reject empty/oversized uploads without decoding; returns the probed header if any."""
+        if not data:
+            raise ValueError("Empty file")
+        if len(data) > self.max_bytes:
+            raise ImageTooLargeError(f"Image too large ({len(data)} bytes > {self.max_bytes})")
+        probe = probe_dimensions(data)
+        if probe is not None and probe[1] * probe[2] > self.max_pixels:
+            raise ImageTooLargeError(f"Image too large ({probe[1]}x{probe[2]} px > {self.max_pixels} px)")
+        return probe
+
+    def normalize(self, data: bytes) -> Tuple[np.ndarray, bytes, Dict[str, Any]]:
+        """Return (BGR frame, normalized JPEG bytes, meta with sizes and per-stage timings in ms)."""
+        timings: Dict[str, float] = {}
+        t0 = time.perf_counter()
+        probe = self.check(data)
+        timings["probe_ms"] = (time.perf_counter() - t0) * 1000.0
+
+        t0 = time.perf_counter()
+        # a phone JPEG far above max_side is decoded at 1/2..1/8 straight away
+        decoded = decode_for_detection(data, self.max_side)
+        timings["decode_ms"] = (time.perf_counter() - t0) * 1000.0
+        if decoded is None:
+            raise ValueError("Invalid image file")
+        frame = decoded.frame
+        if probe is not None:
+            src_w, src_h = probe[1], probe[2]
+        else:
+            src_h, src_w = frame.shape[:2]
+
+        t0 = time.perf_counter()
+        h, w = frame.shape[:2]
+        scale = self.max_side / float(max(h, w)) if self.max_side > 0 else 1.0
+        if scale < 1.0:
+            frame = cv2.resize(frame, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+        timings["resize_ms"] = (time.perf_counter() - t0) * 1000.0
+
+        t0 = time.perf_counter()
+        ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        timings["encode_ms"] = (time.perf_counter() - t0) * 1000.0
+        if not ok:
+            raise ValueError("Could not re-encode image")
+        encoded = buf.tobytes()
+
+        meta = {
+            "format": probe[0] if probe else None,
+            "decode_factor": decoded.factor,
+            "source": {"width": src_w, "height": src_h, "bytes": len(data)},
+            "stored": {"width": int(frame.shape[1]), "height": int(frame.shape[0]), "bytes": len(encoded)},
+            "timings": {k: round(v, 3) for k, v in timings.items()},
+        }
+        logger.info(f"{self.module_name}: {src_w}x{src_h} ({len(data)} B) -> {frame.shape[1]}x{frame.shape[0]} ({len(encoded)} B) | {meta['timings']}")
+        return frame, encoded, meta
@@ -0,0 +1,243 @@
+# files/inference_backend.py
+import importlib.abc
+import os
+import sys
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from files.logger import logger
+
+try:
+    import onnxruntime as ort
+except ImportError:  # optional dependency; only needed for INFERENCE_BACKEND=onnx
+    ort = None
+
+BACKENDS = ("native", "onnx")
+# training frameworks the onnx backend must never pull into a server process
+HEAVY_FRAMEWORKS = ("torch", "torchvision", "tensorflow", "keras", "keras_facenet", "ultralytics")
+
+
+class Detections:
+    """Backend-neutral YOLO output for one frame: xyxy (N, 4) float32, conf (N,) float32, cls (N,) int64."""
+
+    __slots__ = ("xyxy", "conf", "cls")
+
+    def __init__(self, xyxy: np.ndarray, conf: np.ndarray, cls: np.ndarray):
+        self.xyxy = xyxy
+        self.conf = conf
+        self.cls = cls
+
+    @classmethod
+    def empty(cls) -> "Detections":
+        return cls(np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, np.int64))
+
+    @classmethod
+    def concat(cls, parts: Sequence["Detections"]) -> "Detections":
+        if not parts:
+            return cls.empty()
+        return cls(
+            np.concatenate([p.xyxy for p in parts]),
+            np.concatenate([p.conf for p in parts]),
+            np.concatenate([p.cls for p in parts]),
+        )
+
+    def __len__(self) -> int:
+        return len(self.xyxy)
+
+
+def _to_numpy(value) -> np.ndarray:
+    if hasattr(value, "cpu"):
+        value = value.cpu()
+    if hasattr(value, "numpy"):
+        value = value.numpy()
+    return np.asarray(value)
+
+
+def from_ultralytics(result) -> Detections:
+    """Detections from an ``ultralytics`` Results object (one frame)."""
+    boxes = getattr(result, "boxes", None)
+    if boxes is None or not len(boxes):
+        return Detections.empty()
+    return Detections(
+        _to_numpy(boxes.xyxy).astype(np.float32).reshape(-1, 4),
+        _to_numpy(boxes.conf).astype(np.float32).reshape(-1),
+        _to_numpy(boxes.cls).astype(np.int64).reshape(-1),
+    )
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def ort_session(path: str):
+    """
+    ONNX Runtime session for `path`. ORT_INTRA_OP_THREADS / ORT_INTER_OP_THREADS size the
+    thread pools (0 = ORT default); ORT_PROVIDERS is a comma list, e.g.
+    "OpenVINOExecutionProvider,CPUExecutionProvider", filtered to what is installed.
+    """
+    if ort is None:
+        raise RuntimeError("onnxruntime is not installed (pip install onnxruntime)")
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"ONNX model not found at {path} (export with tools/export_onnx.py)")
+    opts = ort.SessionOptions()
+    opts.intra_op_num_threads = max(0, _env_int("ORT_INTRA_OP_THREADS", 0))
+    opts.inter_op_num_threads = max(0, _env_int("ORT_INTER_OP_THREADS", 0))
+    opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    available = ort.get_available_providers()
+    wanted = [p.strip() for p in os.environ.get("ORT_PROVIDERS", "CPUExecutionProvider").split(",") if p.strip()]
+    providers = [p for p in wanted if p in available] or ["CPUExecutionProvider"]
+    session = ort.InferenceSession(path, sess_options=opts, providers=providers)
+    logger.info(
+        f"ort_session: {os.path.basename(path)} | providers={session.get_providers()} "
+        f"intra={opts.intra_op_num_threads} inter={opts.inter_op_num_threads}"
+    )
+    return session
+
+
+def letterbox(img: np.ndarray, size: int) -> Tuple[np.ndarray, float, Tuple[float, float]]:
+    """Resize keeping aspect ratio and pad to size x size with 114 gray, as ultralytics does."""
+    h, w = img.shape[:2]
+    r = min(size / h, size / w)
+    nw, nh = int(round(w * r)), int(round(h * r))
+    if (nw, nh) != (w, h):
+        img = cv2.resize(img, (nw, nh), interpolation=cv2.INTER_LINEAR)
+    dw, dh = (size - nw) / 2.0, (size - nh) / 2.0
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    img = cv2.copyMakeBorder(img, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+    return img, r, (left, top)
+
+
+class OnnxYolo:
+    """
+    Ultralytics YOLO (detect) exported to ONNX, run through ONNX Runtime.
+
+    Pre/post-processing mirrors ultralytics predict: letterbox to ``imgsz``,
+    BGR->RGB, /255, NCHW; the (B, 4 + nc, anchors) head output is filtered by
+    ``conf``, reduced with class-aware NMS at ``iou`` and mapped back to frame
+    coordinates. Models exported with a dynamic batch run a whole micro-batch
+    in one call; fixed-batch models are run frame by frame.
+    """
+
+    def __init__(self, path: str, imgsz: int = 640, conf: float = 0.25, iou: float = 0.7, max_det: int = 300):
+        self.path = path
+        self.session = ort_session(path)
+        inp = self.session.get_inputs()[0]
+        self.input_name = inp.name
+        shape = inp.shape
+        # a fixed-size export overrides the requested imgsz; a dynamic one accepts any per call
+        self.dynamic_size = not isinstance(shape[2], int)
+        self.imgsz = int(imgsz) if self.dynamic_size else int(shape[2])
+        self.dynamic_batch = not isinstance(shape[0], int)
+        self.conf = conf
+        self.iou = iou
+        self.max_det = max_det
+
+    def _preprocess(self, frames: Sequence[np.ndarray], size: Optional[int] = None):
+        size = size or self.imgsz
+        batch = np.empty((len(frames), 3, size, size), dtype=np.float32)
+        meta = []
+        for i, frame in enumerate(frames):
+            img, r, pad = letterbox(frame, size)
+            batch[i] = img[:, :, ::-1].transpose(2, 0, 1) / 255.0
+            meta.append((r, pad, frame.shape[:2]))
+        return batch, meta
+
+    def _postprocess(self, pred: np.ndarray, conf: float, meta) -> Detections:
+        pred = pred.T  # (anchors, 4 + nc)
+        scores = pred[:, 4:]
+        cls = scores.argmax(axis=1)
+        best = scores[np.arange(len(scores)), cls]
+        keep = best > conf
+        if not keep.any():
+            return Detections.empty()
+        boxes, best, cls = pred[keep, :4], best[keep], cls[keep]
+        xywh = boxes.copy()
+        xywh[:, 0] -= xywh[:, 2] / 2.0
+        xywh[:, 1] -= xywh[:, 3] / 2.0
+        idx = cv2.dnn.NMSBoxesBatched(xywh.tolist(), best.tolist(), cls.tolist(), conf, self.iou)
+        idx = np.asarray(idx, dtype=np.int64).reshape(-1)[: self.max_det]
+        if idx.size == 0:
+            return Detections.empty()
+        idx = idx[np.argsort(-best[idx], kind="stable")]
+        r, (left, top), (h, w) = meta
+        xyxy = np.empty((idx.size, 4), dtype=np.float32)
+        xyxy[:, 0] = (xywh[idx, 0] - left) / r
+        xyxy[:, 1] = (xywh[idx, 1] - top) / r
+        xyxy[:, 2] = (xywh[idx, 0] + xywh[idx, 2] - left) / r
+        xyxy[:, 3] = (xywh[idx, 1] + xywh[idx, 3] - top) / r
+        xyxy[:, [0, 2]] = xyxy[:, [0, 2]].clip(0, w)
+        xyxy[:, [1, 3]] = xyxy[:, [1, 3]].clip(0, h)
+        return Detections(xyxy, best[idx].astype(np.float32), cls[idx].astype(np.int64))
+
+    def predict(self, frames: Sequence[np.ndarray], conf: Optional[float] = None, imgsz: Optional[int] = None) -> List[Detections]:
+        if not len(frames):
+            return []
+        conf = self.conf if conf is None else conf
+        # ultralytics needs sizes on the stride (32) grid; a fixed-size export ignores imgsz
+        size = -(-int(imgsz) // 32) * 32 if imgsz and self.dynamic_size else self.imgsz
+        batch, meta = self._preprocess(frames, size)
+        if self.dynamic_batch:
+            preds = self.session.run(None, {self.input_name: batch})[0]
+        else:
+            preds = np.concatenate([self.session.run(None, {self.input_name: batch[i:i + 1]})[0] for i in range(len(batch))])
+        return [self._postprocess(preds[i], conf, meta[i]) for i in range(len(frames))]
+
+
+class OnnxFaceNet:
+    """
+    keras-facenet exported to ONNX. ``embeddings`` takes (N, 160, 160, 3) RGB crops and
+    applies the same per-image standardization as ``keras_facenet.FaceNet.embeddings``.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.session = ort_session(path)
+        self.input_name = self.session.get_inputs()[0].name
+
+    def embeddings(self, images) -> np.ndarray:
+        x = np.asarray(images, dtype=np.float32)
+        mean = x.mean(axis=(1, 2, 3), keepdims=True)
+        std = x.std(axis=(1, 2, 3), keepdims=True)
+        x = (x - mean) / np.maximum(std, 1e-6)
+        return self.session.run(None, {self.input_name: x})[0]
+
+
+def backend_info() -> Dict[str, Any]:
+    return {
+        "onnxruntime": getattr(ort, "__version__", None),
+        "providers": ort.get_available_providers() if ort is not None else [],
+        "intra_op_threads": _env_int("ORT_INTRA_OP_THREADS", 0),
+        "inter_op_threads": _env_int("ORT_INTER_OP_THREADS", 0),
+    }
+
+
+class FrameworkImportError(ImportError):
+    """A training framework was imported while INFERENCE_STRICT forbids it."""
+
+
+class _FrameworkImportGuard(importlib.abc.MetaPathFinder):
+    def find_spec(self, fullname, path=None, target=None):
+        if fullname.split(".", 1)[0] in HEAVY_FRAMEWORKS:
+            raise FrameworkImportError(
+                f"import of {fullname!r} blocked: INFERENCE_BACKEND=onnx with INFERENCE_STRICT=true runs on ONNX Runtime only"
+            )
+        return None
+
+
+def loaded_frameworks() -> List[str]:
+    return [name for name in HEAVY_FRAMEWORKS if name in sys.modules]
+
+
+def forbid_framework_imports():
+    """Make any later import of torch / TensorFlow / ultralytics fail loudly instead of costing seconds and GBs."""
+    already = loaded_frameworks()
+    if already:
+        raise FrameworkImportError(f"{', '.join(already)} already imported before the ONNX-only guard was installed")
+    if not any(isinstance(f, _FrameworkImportGuard) for f in sys.meta_path):
+        sys.meta_path.insert(0, _FrameworkImportGuard())
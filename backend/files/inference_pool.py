@@ -0,0 +1,74 @@
+# files/inference_pool.py
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, Optional
+
+from files.logger import logger
+
+
+class InferenceBusyError(RuntimeError):
+    """Raised when the admission queue is full; endpoints map it to HTTP 503."""
+
+
+class InferencePool:
+    """
+    Dedicated executor for blocking model calls (YOLO, FaceNet, decode).
+
+    Torch/TF release the GIL inside their kernels, so a thread pool keeps the
+    event loop free without having to pickle models into worker processes.
+    Admission is counted per request on the event loop: at most
+    ``workers + queue_size`` requests may be in flight; the next one is
+    rejected immediately instead of waiting in an unbounded queue.
+    """
+
+    def __init__(self, workers: Optional[int] = None, queue_size: Optional[int] = None):
+        self.version = "0.0.1"
+        self.module_name = "InferencePool"
+        try:
+            self.workers: int = max(1, int(workers or os.environ.get("INFERENCE_WORKERS", 2)))
+        except ValueError:
+            self.workers = 2
+        try:
+            self.queue_size: int = max(0, int(queue_size if queue_size is not None else os.environ.get("INFERENCE_QUEUE_SIZE", 8)))
+        except ValueError:
+            self.queue_size = 8
+
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inference")
+        self._in_flight = 0
+        self.counters = {"admitted": 0, "rejected": 0}
+        logger.info(f"{self.module_name} initialized (v{self.version}) | workers={self.workers} queue={self.queue_size}")
+
+    def info(self) -> Dict[str, Any]:
+        return {"module_name": self.module_name, "version": self.version}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "in_flight": self._in_flight,
+            **self.counters,
+        }
+
+    @asynccontextmanager
+    async def admit(self):
+        """Reserve a slot for one request, or fail fast when the pool is saturated."""
+        if self._in_flight >= self.workers + self.queue_size:
+            self.counters["rejected"] += 1
+            raise InferenceBusyError("Inference queue full, retry shortly")
+        self._in_flight += 1
+        self.counters["admitted"] += 1
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run a blocking callable on the inference executor and await its result."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
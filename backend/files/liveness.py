@@ -0,0 +1,842 @@
+# files/liveness.py
+import asyncio
+import math
+import os
+import queue
+import random
+import secrets
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from files.image_utils import decode_for_detection
+from files.inference_pool import InferencePool
+from files.logger import logger
+
+# MediaPipe FaceMesh landmark ids (ported from notebooks/utility_files/others/livelyness.py)
+LEFT_EYE_OUTER, LEFT_EYE_INNER, LEFT_EYE_UPPER, LEFT_EYE_LOWER = 33, 133, 159, 145
+RIGHT_EYE_OUTER, RIGHT_EYE_INNER, RIGHT_EYE_UPPER, RIGHT_EYE_LOWER = 263, 362, 386, 374
+MOUTH_LEFT, MOUTH_RIGHT, MOUTH_UP, MOUTH_DOWN = 61, 291, 13, 14
+NOSE_TIP, CHIN = 1, 199
+
+# generic 3D face (mm) for the six solvePnP points, in POSE_IDS order
+POSE_IDS = (NOSE_TIP, CHIN, LEFT_EYE_OUTER, RIGHT_EYE_OUTER, MOUTH_LEFT, MOUTH_RIGHT)
+MODEL_POINTS_3D = np.array(
+    [[0, 0, 0], [0, -63.6, -12.5], [-43.3, 32.7, -26], [43.3, 32.7, -26], [-28.9, -28.9, -24.1], [28.9, -28.9, -24.1]],
+    dtype=np.float64,
+)
+_DIST_COEFFS = np.zeros((4, 1), dtype=np.float64)
+
+# challenges are drawn from the OS RNG so a client cannot predict the sequence
+_RNG = random.SystemRandom()
+
+
+class LivenessBusyError(RuntimeError):
+    """Raised when LIVENESS_MAX_SESSIONS sessions are already open; endpoints map it to HTTP 503."""
+
+
+# ---------------- Landmark metrics ----------------
+# Per-landmark reference versions ported from livelyness.py. The service computes the same
+# values with LandmarkFeatures; these are kept as the baseline tools/bench_liveness.py checks.
+
+def _euclidean(p, q) -> float:
+    return math.hypot(p[0] - q[0], p[1] - q[1])
+
+
+def _get_point(landmarks, idx: int, w: int, h: int) -> np.ndarray:
+    return np.array([landmarks[idx].x * w, landmarks[idx].y * h], dtype=np.float64)
+
+
+def eye_aspect_ratio(landmarks, w: int, h: int, side: str = "left") -> float:
+    """Reference EAR for tools/bench_liveness.py; the service uses LandmarkFeatures."""
+    if side == "left":
+        ids = (LEFT_EYE_UPPER, LEFT_EYE_LOWER, LEFT_EYE_OUTER, LEFT_EYE_INNER)
+    else:
+        ids = (RIGHT_EYE_UPPER, RIGHT_EYE_LOWER, RIGHT_EYE_OUTER, RIGHT_EYE_INNER)
+    upper, lower, outer, inner = (_get_point(landmarks, i, w, h) for i in ids)
+    horizontal = _euclidean(outer, inner)
+    return _euclidean(upper, lower) / horizontal if horizontal > 0 else 0.0
+
+
+def inter_ocular_distance(landmarks, w: int, h: int) -> float:
+    """Reference outer-eye-corner distance, used by smile_metric / mouth_open_metric."""
+    return _euclidean(_get_point(landmarks, LEFT_EYE_OUTER, w, h), _get_point(landmarks, RIGHT_EYE_OUTER, w, h))
+
+
+def smile_metric(landmarks, w: int, h: int) -> float:
+    """Reference mouth width / inter-ocular distance for tools/bench_liveness.py."""
+    iod = inter_ocular_distance(landmarks, w, h)
+    width = _euclidean(_get_point(landmarks, MOUTH_LEFT, w, h), _get_point(landmarks, MOUTH_RIGHT, w, h))
+    return width / iod if iod else 0.0
+
+
+def mouth_open_metric(landmarks, w: int, h: int) -> float:
+    """Reference lip gap / inter-ocular distance for tools/bench_liveness.py."""
+    iod = inter_ocular_distance(landmarks, w, h)
+    gap = _euclidean(_get_point(landmarks, MOUTH_UP, w, h), _get_point(landmarks, MOUTH_DOWN, w, h))
+    return gap / iod if iod else 0.0
+
+
+def camera_matrix(w: int, h: int) -> np.ndarray:
+    """Pinhole guess used by the webcam demo: focal length = frame width, principal point at the centre."""
+    return np.array([[w, 0, w / 2], [0, w, h / 2], [0, 0, 1]], dtype=np.float64)
+
+
+def _euler_degrees(rvec) -> Tuple[float, float, float]:
+    rot, _ = cv2.Rodrigues(rvec)
+    sy = math.sqrt(rot[0, 0] ** 2 + rot[1, 0] ** 2)
+    pitch = math.atan2(-rot[2, 0], sy)
+    if sy >= 1e-6:
+        yaw = math.atan2(rot[1, 0], rot[0, 0])
+        roll = math.atan2(rot[2, 1], rot[2, 2])
+    else:
+        yaw = math.atan2(-rot[0, 1], rot[1, 1])
+        roll = 0.0
+    return math.degrees(yaw), math.degrees(pitch), math.degrees(roll)
+
+
+def head_pose_angles(landmarks, w: int, h: int) -> Tuple[float, float, float]:
+    """
+    (yaw, pitch, roll) in degrees from solvePnP on six landmarks against a generic 3D face.
+    Reference for tools/bench_liveness.py; the service uses LandmarkFeatures / head_pose_batch.
+    """
+    pts_2d = np.array([_get_point(landmarks, i, w, h) for i in POSE_IDS], dtype=np.float64)
+    ok, rvec, _ = cv2.solvePnP(MODEL_POINTS_3D, pts_2d, camera_matrix(w, h), _DIST_COEFFS, flags=cv2.SOLVEPNP_ITERATIVE)
+    if not ok:
+        return 0.0, 0.0, 0.0
+    return _euler_degrees(rvec)
+
+
+# ---------------- Vectorized landmark features ----------------
+
+# every landmark the challenges read; one frame becomes a (len(FEATURE_IDS), 2) pixel array
+FEATURE_IDS = tuple(sorted({
+    LEFT_EYE_OUTER, LEFT_EYE_INNER, LEFT_EYE_UPPER, LEFT_EYE_LOWER,
+    RIGHT_EYE_OUTER, RIGHT_EYE_INNER, RIGHT_EYE_UPPER, RIGHT_EYE_LOWER,
+    MOUTH_LEFT, MOUTH_RIGHT, MOUTH_UP, MOUTH_DOWN, *POSE_IDS,
+}))
+_ROW = {lid: row for row, lid in enumerate(FEATURE_IDS)}
+# segments measured per frame: left eye v/h, right eye v/h, mouth width, mouth gap, eye outers
+_SEGMENTS = (
+    (LEFT_EYE_UPPER, LEFT_EYE_LOWER), (LEFT_EYE_OUTER, LEFT_EYE_INNER),
+    (RIGHT_EYE_UPPER, RIGHT_EYE_LOWER), (RIGHT_EYE_OUTER, RIGHT_EYE_INNER),
+    (MOUTH_LEFT, MOUTH_RIGHT), (MOUTH_UP, MOUTH_DOWN), (LEFT_EYE_OUTER, RIGHT_EYE_OUTER),
+)
+# +1/-1 difference matrix: _DIFF @ points gives every segment vector in one product
+_DIFF = np.zeros((len(_SEGMENTS), len(FEATURE_IDS)), dtype=np.float64)
+for _k, (_a, _b) in enumerate(_SEGMENTS):
+    _DIFF[_k, _ROW[_a]], _DIFF[_k, _ROW[_b]] = 1.0, -1.0
+_POSE_ROWS = np.array([_ROW[i] for i in POSE_IDS], dtype=np.intp)
+
+
+def landmark_array(landmarks, ids: Tuple[int, ...] = FEATURE_IDS) -> np.ndarray:
+    """Normalized (x, y) of `ids` from a MediaPipe landmark list, as one (len(ids), 2) float64 array."""
+    flat: List[float] = []
+    append = flat.append
+    for i in ids:
+        lm = landmarks[i]
+        append(lm.x)
+        append(lm.y)
+    return np.array(flat, dtype=np.float64).reshape(-1, 2)
+
+
+def _ratio(num: float, den: float) -> float:
+    return num / den if den > 0 else 0.0
+
+
+class LandmarkFeatures:
+    """
+    All per-frame liveness metrics from one (len(FEATURE_IDS), 2) array.
+
+    Segment lengths come from a single difference-matrix product and norm, so
+    the inter-ocular distance is measured once and shared by the smile and
+    mouth ratios. The pixel scale and camera matrix are cached per frame size.
+    Results match the per-landmark functions above (eye_aspect_ratio,
+    smile_metric, mouth_open_metric, head_pose_angles).
+    """
+
+    __slots__ = ("_cameras",)
+
+    def __init__(self):
+        self._cameras: Dict[Tuple[int, int], Tuple[np.ndarray, np.ndarray]] = {}
+
+    def constants(self, w: int, h: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(pixel scale (2,), camera matrix) for a w x h frame."""
+        key = (int(w), int(h))
+        cached = self._cameras.get(key)
+        if cached is None:
+            if len(self._cameras) >= 32:  # frames are normalized to LIVENESS_FRAME_SIDE; this only guards odd clients
+                self._cameras.clear()
+            cached = self._cameras[key] = (np.array(key, dtype=np.float64), camera_matrix(*key))
+        return cached
+
+    def metrics(self, points: np.ndarray, w: int, h: int, pose: bool = True) -> Dict[str, float]:
+        """`points` are normalized rows in FEATURE_IDS order (see landmark_array); pose=False skips solvePnP."""
+        scale, camera = self.constants(w, h)
+        px = points * scale
+        seg = _DIFF @ px
+        seg *= seg
+        lengths = np.sqrt(seg.sum(axis=1)).tolist()
+        ear_l_v, ear_l_h, ear_r_v, ear_r_h, mouth_w, mouth_gap, iod = lengths
+        out = {
+            "ear_left": _ratio(ear_l_v, ear_l_h),
+            "ear_right": _ratio(ear_r_v, ear_r_h),
+            "smile": _ratio(mouth_w, iod),
+            "mouth_open": _ratio(mouth_gap, iod),
+        }
+        if pose:
+            ok, rvec, _ = cv2.solvePnP(MODEL_POINTS_3D, px[_POSE_ROWS], camera, _DIST_COEFFS, flags=cv2.SOLVEPNP_ITERATIVE)
+            out["yaw"], out["pitch"], out["roll"] = _euler_degrees(rvec) if ok else (0.0, 0.0, 0.0)
+        return out
+
+    def extract(self, landmarks, w: int, h: int) -> Dict[str, float]:
+        return self.metrics(landmark_array(landmarks), w, h)
+
+    def batch(self, points: np.ndarray, sizes: np.ndarray, pose: str = "posit", iterations: int = 3) -> Dict[str, np.ndarray]:
+        """
+        metrics() for B frames at once: `points` (B, len(FEATURE_IDS), 2) normalized, `sizes` (B, 2) as (w, h).
+        pose="posit" solves every head pose together (head_pose_batch); "pnp" runs solvePnP per frame.
+        """
+        sizes = np.asarray(sizes, dtype=np.float64).reshape(-1, 2)
+        px = points * sizes[:, None, :]
+        seg = np.einsum("kn,bnd->bkd", _DIFF, px)
+        lengths = np.sqrt((seg * seg).sum(axis=2))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratios = lengths[:, [0, 2, 4, 5]] / lengths[:, [1, 3, 6, 6]]
+        ratios = np.where(lengths[:, [1, 3, 6, 6]] > 0, ratios, 0.0)
+        if pose == "pnp":
+            angles = np.array([
+                self.metrics(p, int(w), int(h)) for p, (w, h) in zip(points, sizes)
+            ], dtype=object)
+            yaw_pitch_roll = np.array([[m["yaw"], m["pitch"], m["roll"]] for m in angles], dtype=np.float64).reshape(-1, 3)
+        else:
+            yaw_pitch_roll = head_pose_batch(px[:, _POSE_ROWS], sizes, iterations=iterations)
+        return {
+            "ear_left": ratios[:, 0],
+            "ear_right": ratios[:, 1],
+            "yaw": yaw_pitch_roll[:, 0],
+            "pitch": yaw_pitch_roll[:, 1],
+            "roll": yaw_pitch_roll[:, 2],
+            "smile": ratios[:, 2],
+            "mouth_open": ratios[:, 3],
+        }
+
+
+# object vectors from the reference point (NOSE_TIP, the model origin) and their pseudo-inverse, for POSIT
+_POSIT_A = MODEL_POINTS_3D[1:] - MODEL_POINTS_3D[0]
+_POSIT_BT = np.linalg.pinv(_POSIT_A).T
+_C1, _C2 = [1, 2, 0], [2, 0, 1]
+
+
+def _cross_rows(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # row-wise 3D cross product; np.cross costs several times more on small batches
+    return a[:, _C1] * b[:, _C2] - a[:, _C2] * b[:, _C1]
+
+
+def head_pose_batch(pose_px: np.ndarray, sizes: np.ndarray, iterations: int = 3) -> np.ndarray:
+    """
+    (yaw, pitch, roll) in degrees for B faces at once: `pose_px` (B, 6, 2) pixel points in POSE_IDS
+    order, `sizes` (B, 2) frame (w, h), same pinhole guess as camera_matrix().
+
+    POSIT (DeMenthon & Davis): a scaled-orthographic (weak-perspective) fit of the
+    generic 3D face, refined `iterations` times with per-point perspective
+    corrections. Every step is a small matrix product over the whole batch, so
+    there is no per-face solver call; `iterations=0` is plain weak perspective.
+    Angles use the same Euler convention as head_pose_angles().
+    """
+    pose_px = np.asarray(pose_px, dtype=np.float64)
+    sizes = np.asarray(sizes, dtype=np.float64).reshape(-1, 2)
+    # (B, 2, 6): x and y rows relative to the principal point
+    xy = pose_px.transpose(0, 2, 1) - sizes[:, :, None] / 2.0
+    ref, rest = xy[:, :, :1], xy[:, :, 1:]
+    inv_focal = 1.0 / sizes[:, :1]
+    eps = 0.0
+    for _ in range(max(0, int(iterations)) + 1):
+        ij = (rest * (1.0 + eps) - ref) @ _POSIT_BT             # (B, 2, 3): scaled first two rotation rows
+        norms = np.sqrt((ij * ij).sum(axis=2))                  # (B, 2)
+        r1, r2 = ij[:, 0] / norms[:, :1], ij[:, 1] / norms[:, 1:]
+        r3 = _cross_rows(r1, r2)
+        r3 /= np.sqrt((r3 * r3).sum(axis=1, keepdims=True))
+        # eps_i = (M0Mi . k) / Z0 with Z0 = focal / scale
+        eps = ((r3 @ _POSIT_A.T) * (norms.mean(axis=1, keepdims=True) * inv_focal))[:, None, :]
+    r2 = _cross_rows(r3, r1)  # re-orthogonalize: rows r1, r2, r3 of the object-to-camera rotation
+    sy = np.hypot(r1[:, 0], r2[:, 0])
+    regular = sy >= 1e-6
+    pitch = np.arctan2(-r3[:, 0], sy)
+    yaw = np.where(regular, np.arctan2(r2[:, 0], r1[:, 0]), np.arctan2(-r1[:, 1], r2[:, 1]))
+    roll = np.where(regular, np.arctan2(r3[:, 1], r3[:, 2]), 0.0)
+    return np.degrees(np.stack([yaw, pitch, roll], axis=1))
+
+
+# ---------------- Challenge state machines ----------------
+
+class BlinkDetector:
+    """Counts a blink when the mean EAR stays below ``ear_thresh`` for ``min_consec_frames`` frames and reopens."""
+
+    __slots__ = ("ear_thresh", "min_consec_frames", "counter", "total_blinks")
+
+    def __init__(self, ear_thresh: float = 0.21, min_consec_frames: int = 2):
+        self.ear_thresh = ear_thresh
+        self.min_consec_frames = min_consec_frames
+        self.counter = 0
+        self.total_blinks = 0
+
+    def update(self, ear_left: float, ear_right: float) -> bool:
+        if (ear_left + ear_right) / 2 < self.ear_thresh:
+            self.counter += 1
+            return False
+        blinked = self.counter >= self.min_consec_frames
+        self.total_blinks += blinked
+        self.counter = 0
+        return blinked
+
+
+class Challenge:
+    """One prompt. ``update`` takes the frame's signal dict and a monotonic timestamp."""
+
+    __slots__ = ("timeout_sec", "start_time", "done", "success")
+
+    def __init__(self, timeout_sec: float = 6.0):
+        self.timeout_sec = timeout_sec
+        self.start_time = 0.0
+        self.done = False
+        self.success = False
+
+    def start(self, now: Optional[float] = None):
+        self.start_time = time.monotonic() if now is None else now
+        self.done = False
+        self.success = False
+
+    def expired(self, now: Optional[float] = None) -> bool:
+        return ((time.monotonic() if now is None else now) - self.start_time) > self.timeout_sec
+
+    def instructions(self) -> str:
+        return "Follow the instruction"
+
+    def passed(self, signal: Dict[str, Any]) -> bool:
+        return False
+
+    def update(self, signal: Dict[str, Any], now: Optional[float] = None):
+        if self.done:
+            return
+        if self.passed(signal):
+            self.done, self.success = True, True
+        elif self.expired(now):
+            self.done, self.success = True, False
+
+
+class BlinkN(Challenge):
+    __slots__ = ("n", "blinks_detected")
+
+    def __init__(self, n: int = 2, timeout_sec: float = 6.0):
+        super().__init__(timeout_sec)
+        self.n = n
+        self.blinks_detected = 0
+
+    def instructions(self) -> str:
+        return f"Blink {self.n} time(s)"
+
+    def passed(self, signal: Dict[str, Any]) -> bool:
+        self.blinks_detected += bool(signal.get("blinked"))
+        return self.blinks_detected >= self.n
+
+
+class TurnHead(Challenge):
+    __slots__ = ("direction", "angle_thresh")
+
+    def __init__(self, direction: str = "left", angle_thresh: float = 8.0, timeout_sec: float = 6.0):
+        super().__init__(timeout_sec)
+        self.direction = direction
+        self.angle_thresh = angle_thresh
+
+    def instructions(self) -> str:
+        return f"Turn head {self.direction.upper()}"
+
+    def passed(self, signal: Dict[str, Any]) -> bool:
+        yaw, pitch, t = signal.get("yaw", 0.0), signal.get("pitch", 0.0), self.angle_thresh
+        return (
+            (self.direction == "left" and yaw < -t) or (self.direction == "right" and yaw > t)
+            or (self.direction == "up" and pitch < -t) or (self.direction == "down" and pitch > t)
+        )
+
+
+class Smile(Challenge):
+    __slots__ = ("thresh",)
+
+    def __init__(self, thresh: float = 0.42, timeout_sec: float = 6.0):
+        super().__init__(timeout_sec)
+        self.thresh = thresh
+
+    def instructions(self) -> str:
+        return "Smile"
+
+    def passed(self, signal: Dict[str, Any]) -> bool:
+        return signal.get("smile", 0.0) > self.thresh
+
+
+class MouthOpen(Challenge):
+    __slots__ = ("thresh",)
+
+    def __init__(self, thresh: float = 0.20, timeout_sec: float = 6.0):
+        super().__init__(timeout_sec)
+        self.thresh = thresh
+
+    def instructions(self) -> str:
+        return "Open your mouth"
+
+    def passed(self, signal: Dict[str, Any]) -> bool:
+        return signal.get("mouth_open", 0.0) > self.thresh
+
+
+def next_random_challenge(timeout_sec: float) -> Challenge:
+    choice = _RNG.choice(("blink", "turn", "smile", "mouth"))
+    if choice == "blink":
+        return BlinkN(n=_RNG.choice((1, 2)), timeout_sec=timeout_sec)
+    if choice == "turn":
+        return TurnHead(direction=_RNG.choice(("left", "right", "up", "down")), angle_thresh=8.0, timeout_sec=timeout_sec)
+    if choice == "smile":
+        return Smile(thresh=0.20, timeout_sec=timeout_sec)
+    return MouthOpen(thresh=0.20, timeout_sec=timeout_sec)
+
+
+class LivenessSession:
+    """Per-client challenge state. Frames are never kept; only counters and the active challenge."""
+
+    __slots__ = (
+        "id", "created", "expires", "total", "index", "passed", "challenge", "blink", "face", "verdict", "busy",
+        "pending", "pending_at", "outbox",
+    )
+
+    def __init__(self, session_id: str, total: int, ttl: float, now: float):
+        self.id = session_id
+        self.created = now
+        self.expires = now + ttl
+        self.total = total
+        self.index = 0                  # 1-based number of the active challenge, 0 = not started
+        self.passed = 0
+        self.challenge: Optional[Challenge] = None
+        self.blink = BlinkDetector()
+        self.face: Optional[bool] = None
+        self.verdict: Optional[bool] = None
+        self.busy = False               # a WebSocket is streaming into this session
+        self.pending = None             # newest unprocessed frame (bytes or (points, w, h)); latest wins
+        self.pending_at = 0.0
+        self.outbox: Optional["asyncio.Queue"] = None
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires - time.monotonic())
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.id,
+            "challenge": self.index,
+            "total": self.total,
+            "passed": self.passed,
+            "done": self.verdict is not None,
+            "live": self.verdict,
+        }
+
+
+class LivenessManager:
+    """
+    Server-side challenge-response liveness (blink / turn head / smile / open mouth).
+
+    A client opens a session, then streams low-resolution JPEG frames over a
+    WebSocket and gets challenge prompts, per-challenge results and the final
+    verdict back as they happen. At most LIVENESS_MAX_SESSIONS sessions exist
+    at once; a session lives LIVENESS_SESSION_TTL_SEC from creation. FaceMesh
+    (optional ``mediapipe`` package) runs in static-image mode on a small
+    dedicated executor, one mesh instance per worker thread, shared by all
+    sessions. Frames of all sessions go through one LivenessScheduler.
+    """
+
+    def __init__(self, pool: Optional[InferencePool] = None):
+        self.version = "0.0.1"
+        self.module_name = "LivenessManager"
+        self.max_sessions = self._env_int("LIVENESS_MAX_SESSIONS", 64, minimum=1)
+        self.num_challenges = self._env_int("LIVENESS_CHALLENGES", 4, minimum=1)
+        self.frame_side = self._env_int("LIVENESS_FRAME_SIDE", 480, minimum=64)
+        self.max_frame_bytes = self._env_int("LIVENESS_MAX_FRAME_BYTES", 256 * 1024, minimum=1024)
+        try:
+            self.challenge_sec: float = float(os.environ.get("LIVENESS_CHALLENGE_SEC", 3.5))
+        except ValueError:
+            self.challenge_sec = 3.5
+        try:
+            self.ttl: float = float(os.environ.get("LIVENESS_SESSION_TTL_SEC", 60))
+        except ValueError:
+            self.ttl = 60.0
+
+        self.pool = pool or InferencePool(workers=self._env_int("LIVENESS_WORKERS", 2, minimum=1), queue_size=0)
+        pose = os.environ.get("LIVENESS_HEAD_POSE", "posit").strip().lower()
+        if pose not in ("posit", "pnp"):
+            logger.warning(f"{self.module_name}: unknown LIVENESS_HEAD_POSE={pose!r}; using 'posit'")
+            pose = "posit"
+        self.scheduler = LivenessScheduler(self, self._env_int("LIVENESS_BATCH_MAX", 64, minimum=1), pose)
+        self._sessions: Dict[str, LivenessSession] = {}
+        self._meshes: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._mesh_count = 0
+        self._mesh_lock = threading.Lock()
+        self.counters = {"created": 0, "rejected": 0, "expired": 0, "frames": 0, "no_face": 0, "live": 0, "not_live": 0}
+        logger.info(
+            f"{self.module_name} initialized (v{self.version}) | max_sessions={self.max_sessions} "
+            f"challenges={self.num_challenges}x{self.challenge_sec}s ttl={self.ttl}s frame_side={self.frame_side}"
+        )
+
+    @staticmethod
+    def _env_int(name: str, default: int, minimum: int = 0) -> int:
+        try:
+            return max(minimum, int(os.environ.get(name, default)))
+        except ValueError:
+            return default
+
+    def info(self) -> Dict[str, Any]:
+        return {"module_name": self.module_name, "version": self.version}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self._sessions),
+            "streaming": sum(s.busy for s in self._sessions.values()),
+            "max_sessions": self.max_sessions,
+            "meshes": self._mesh_count,
+            **self.counters,
+            "scheduler": self.scheduler.stats(),
+        }
+
+    @staticmethod
+    def available() -> bool:
+        import importlib.util
+
+        return importlib.util.find_spec("mediapipe") is not None
+
+    # ---------------- Session table ----------------
+
+    def purge_expired(self, now: Optional[float] = None) -> int:
+        now = time.monotonic() if now is None else now
+        stale = [sid for sid, s in self._sessions.items() if s.expires <= now and not s.busy]
+        for sid in stale:
+            del self._sessions[sid]
+        return len(stale)
+
+    def create(self, needs_mesh: bool = True) -> LivenessSession:
+        """Open a session; raises LivenessBusyError when the table is full of unfinished sessions."""
+        if needs_mesh and not self.available():
+            raise RuntimeError("Liveness needs the optional mediapipe package (pip install mediapipe)")
+        now = time.monotonic()
+        self.purge_expired(now)
+        if len(self._sessions) >= self.max_sessions:
+            # finished sessions only linger for status lookups; drop the oldest one to make room
+            finished = [s for s in self._sessions.values() if s.verdict is not None and not s.busy]
+            if not finished:
+                self.counters["rejected"] += 1
+                raise LivenessBusyError("Too many liveness sessions, retry shortly")
+            del self._sessions[min(finished, key=lambda s: s.created).id]
+        session = LivenessSession(secrets.token_urlsafe(16), self.num_challenges, self.ttl, now)
+        self._sessions[session.id] = session
+        self.counters["created"] += 1
+        return session
+
+    def get(self, session_id: str) -> Optional[LivenessSession]:
+        session = self._sessions.get(session_id)
+        if session is not None and session.expires <= time.monotonic() and session.verdict is None and not session.busy:
+            del self._sessions[session_id]
+            return None
+        return session
+
+    def close(self, session_id: str):
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self.scheduler.discard(session)
+
+    # ---------------- Challenge flow ----------------
+
+    def _prompt(self, session: LivenessSession) -> Dict[str, Any]:
+        return {
+            "type": "challenge",
+            "index": session.index,
+            "total": session.total,
+            "instruction": session.challenge.instructions(),
+            "timeout_sec": session.challenge.timeout_sec,
+        }
+
+    def _finish(self, session: LivenessSession, live: bool, reason: str = "") -> Dict[str, Any]:
+        session.verdict = live
+        session.challenge = None
+        self.counters["live" if live else "not_live"] += 1
+        event = {"type": "verdict", "live": live, "passed": session.passed, "total": session.total}
+        if reason:
+            event["reason"] = reason
+        return event
+
+    def start(self, session: LivenessSession, now: Optional[float] = None) -> Dict[str, Any]:
+        """Prompt for the active challenge, starting the first one (and its clock) if needed."""
+        if session.challenge is None:
+            session.index = 1
+            session.challenge = next_random_challenge(self.challenge_sec)
+            session.challenge.start(now)
+        return self._prompt(session)
+
+    def expire(self, session: LivenessSession) -> Dict[str, Any]:
+        self.counters["expired"] += 1
+        return self._finish(session, False, reason="Session expired")
+
+    def step(self, session: LivenessSession, signal: Optional[Dict[str, Any]], now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Feed one frame's signal (None = no face) to the active challenge; returns the events it caused."""
+        events: List[Dict[str, Any]] = []
+        if session.verdict is not None or session.challenge is None:
+            return events
+        present = signal is not None
+        if present != session.face:
+            session.face = present
+            events.append({"type": "face", "present": present})
+        challenge = session.challenge
+        challenge.update(signal or {}, now)
+        if not challenge.done:
+            return events
+        session.passed += challenge.success
+        events.append({"type": "result", "index": session.index, "passed": challenge.success})
+        if session.index >= session.total:
+            # same rule as the webcam demo: a strict majority of challenges must pass
+            events.append(self._finish(session, session.passed > session.total // 2))
+            return events
+        session.index += 1
+        session.challenge = next_random_challenge(self.challenge_sec)
+        session.challenge.start(now)
+        events.append(self._prompt(session))
+        return events
+
+    # ---------------- FaceMesh ----------------
+
+    def _new_mesh(self):
+        import mediapipe as mp  # optional dependency; create() refuses sessions without it
+
+        return mp.solutions.face_mesh.FaceMesh(
+            static_image_mode=True,  # frames of different sessions interleave, so no cross-frame tracking
+            max_num_faces=1,
+            refine_landmarks=True,
+            min_detection_confidence=0.5,
+        )
+
+    def _borrow_mesh(self):
+        try:
+            return self._meshes.get_nowait()
+        except queue.Empty:
+            pass
+        with self._mesh_lock:
+            if self._mesh_count < self.pool.workers:
+                self._mesh_count += 1
+                logger.info(f"{self.module_name}: FaceMesh instance {self._mesh_count} created")
+                return self._new_mesh()
+        return self._meshes.get()
+
+    def _landmarks(self, mesh, frame: np.ndarray) -> Optional[np.ndarray]:
+        result = mesh.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        faces = result.multi_face_landmarks
+        return landmark_array(faces[0].landmark) if faces else None
+
+    def decode(self, data: bytes) -> Optional[np.ndarray]:
+        image = decode_for_detection(data, self.frame_side)
+        if image is None:
+            return None
+        frame = image.frame
+        h, w = frame.shape[:2]
+        if max(h, w) > self.frame_side:
+            r = self.frame_side / float(max(h, w))
+            frame = cv2.resize(frame, (max(1, int(w * r)), max(1, int(h * r))), interpolation=cv2.INTER_AREA)
+        # mirror like the webcam loop this was ported from; TurnHead's yaw signs assume a selfie view
+        return cv2.flip(frame, 1)
+
+    def landmarks_many(self, frames: List[bytes]) -> List[Optional[Tuple[Optional[np.ndarray], int, int]]]:
+        """
+        Blocking: decode + FaceMesh for a chunk of frames with one borrowed mesh.
+        Per frame (points in FEATURE_IDS order or None when no face, w, h), or None if it did not decode.
+        """
+        out: List[Optional[Tuple[Optional[np.ndarray], int, int]]] = []
+        mesh = self._borrow_mesh()
+        try:
+            for data in frames:
+                frame = self.decode(data)
+                if frame is None:
+                    out.append(None)
+                    continue
+                h, w = frame.shape[:2]
+                out.append((self._landmarks(mesh, frame), w, h))
+        finally:
+            self._meshes.put(mesh)
+        return out
+
+    # ---------------- Streaming ----------------
+
+    def attach(self, session: LivenessSession) -> "asyncio.Queue":
+        """Start streaming into `session`: returns its event queue, already holding the first prompt."""
+        session.outbox = asyncio.Queue()
+        session.outbox.put_nowait(self.start(session))
+        return session.outbox
+
+    def detach(self, session: LivenessSession):
+        self.scheduler.discard(session)
+        session.outbox = None
+
+    def emit(self, session: LivenessSession, events: List[Dict[str, Any]]):
+        if session.outbox is not None:
+            for event in events:
+                session.outbox.put_nowait(event)
+
+    def submit(self, session: LivenessSession, data: bytes):
+        """Queue an encoded frame; replaces the session's previous frame if that was not picked up yet."""
+        if len(data) > self.max_frame_bytes:
+            self.emit(session, [{"type": "error", "reason": f"Frame over {self.max_frame_bytes} bytes; send low-resolution JPEGs"}])
+            return
+        self._submit(session, data)
+
+    def submit_points(self, session: LivenessSession, points: Optional[np.ndarray], w: int, h: int):
+        """Queue already-extracted landmarks (FEATURE_IDS order, normalized; None = no face), e.g. a recorded stream."""
+        self._submit(session, (points, int(w), int(h)))
+
+    def _submit(self, session: LivenessSession, item):
+        if session.verdict is not None:
+            return
+        if time.monotonic() >= session.expires:
+            self.emit(session, [self.expire(session)])
+            return
+        self.scheduler.submit(session, item)
+
+    def shutdown(self):
+        self.scheduler.stop()
+        self.pool.shutdown()
+        while True:
+            try:
+                self._meshes.get_nowait().close()
+            except queue.Empty:
+                break
+            except Exception:
+                pass
+
+
+class LivenessScheduler:
+    """
+    Runs the newest pending frame of every streaming session as one batch.
+
+    Each session holds at most one pending frame: a frame that arrives before
+    the previous one was picked up replaces it (latest frame wins), so a client
+    that sends faster than the server keeps up never builds a backlog; the
+    replaced frames are counted as dropped. While one batch is in flight the
+    next one accumulates, up to LIVENESS_BATCH_MAX sessions, oldest waiting
+    first. FaceMesh still runs once per frame, spread over the executor's
+    threads; the landmark metrics and head poses of the whole batch are then
+    one LandmarkFeatures.batch call, and every session steps its own challenge
+    state machine with its row.
+    """
+
+    def __init__(self, manager: "LivenessManager", max_batch: int, pose: str):
+        self.manager = manager
+        self.max_batch = max_batch
+        self.pose = pose
+        self.features = LandmarkFeatures()
+        self._ready: Dict[str, LivenessSession] = {}
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional["asyncio.Task"] = None
+        self._latency_ms: Deque[float] = deque(maxlen=2048)
+        self.counters = {"submitted": 0, "processed": 0, "dropped": 0, "batches": 0, "max_seen": 0}
+
+    def stats(self) -> Dict[str, Any]:
+        lat = sorted(self._latency_ms)
+        pick = (lambda q: round(lat[min(len(lat) - 1, int(q * len(lat)))], 2)) if lat else (lambda q: None)
+        batches = self.counters["batches"]
+        return {
+            "max_batch": self.max_batch,
+            "head_pose": self.pose,
+            "pending": len(self._ready),
+            **self.counters,
+            "avg_batch": round(self.counters["processed"] / batches, 2) if batches else 0.0,
+            "latency_ms": {"p50": pick(0.5), "p95": pick(0.95), "max": round(lat[-1], 2) if lat else None},
+        }
+
+    def submit(self, session: LivenessSession, item, now: Optional[float] = None):
+        self.counters["submitted"] += 1
+        if session.pending is not None:
+            self.counters["dropped"] += 1
+        session.pending = item
+        session.pending_at = time.monotonic() if now is None else now
+        self._ready.setdefault(session.id, session)  # keeps its place in line if it was already waiting
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        self._wake.set()
+
+    def discard(self, session: LivenessSession):
+        self._ready.pop(session.id, None)
+        session.pending = None
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            while self._ready:
+                batch = []
+                for sid in list(self._ready)[: self.max_batch]:
+                    batch.append(self._ready.pop(sid))
+                try:
+                    await self.run_batch(batch)
+                except Exception as e:
+                    logger.error(f"LivenessScheduler: batch of {len(batch)} failed: {e}")
+
+    async def run_batch(self, sessions: List[LivenessSession]):
+        manager = self.manager
+        items = [(s, s.pending, s.pending_at) for s in sessions]
+        for s in sessions:
+            s.pending = None
+
+        # FaceMesh for encoded frames, one chunk per executor thread
+        encoded = [i for i, (_, item, _) in enumerate(items) if isinstance(item, (bytes, bytearray))]
+        extracted: Dict[int, Any] = {i: item for i, (_, item, _) in enumerate(items) if not isinstance(item, (bytes, bytearray))}
+        if encoded:
+            n = min(manager.pool.workers, len(encoded))
+            chunks = [encoded[k::n] for k in range(n)]
+            results = await asyncio.gather(*(
+                manager.pool.run(manager.landmarks_many, [items[i][1] for i in chunk]) for chunk in chunks
+            ))
+            for chunk, result in zip(chunks, results):
+                extracted.update(zip(chunk, result))
+
+        faces = [i for i in range(len(items)) if extracted[i] is not None and extracted[i][0] is not None]
+        rows: Dict[str, List[float]] = {}
+        if faces:
+            points = np.stack([extracted[i][0] for i in faces])
+            sizes = np.array([extracted[i][1:] for i in faces], dtype=np.float64)
+            rows = {k: v.tolist() for k, v in (await manager.pool.run(self.features.batch, points, sizes, self.pose)).items()}
+        row_of = {i: r for r, i in enumerate(faces)}
+
+        now = time.monotonic()
+        self.counters["batches"] += 1
+        self.counters["processed"] += len(items)
+        self.counters["max_seen"] = max(self.counters["max_seen"], len(items))
+        for i, (session, _, at) in enumerate(items):
+            self._latency_ms.append((now - at) * 1000.0)
+            if extracted[i] is None:
+                manager.emit(session, [{"type": "error", "reason": "Invalid image frame"}])
+                continue
+            manager.counters["frames"] += 1
+            r = row_of.get(i)
+            signal = None
+            if r is None:
+                manager.counters["no_face"] += 1
+            else:
+                signal = {
+                    "blinked": session.blink.update(rows["ear_left"][r], rows["ear_right"][r]),
+                    "yaw": rows["yaw"][r],
+                    "pitch": rows["pitch"][r],
+                    "roll": rows["roll"][r],
+                    "smile": rows["smile"][r],
+                    "mouth_open": rows["mouth_open"][r],
+                }
+            # challenge clocks run on arrival time, so server queueing never eats into a client's window
+            manager.emit(session, manager.step(session, signal, now=at))
@@ -1,20 +1,25 @@
+import time
 from fastapi import UploadFile
-from typing import Dict, TYPE_CHECKING
+from typing import Dict, Optional, TYPE_CHECKING
 from files.logger import logger
 
 # Only for type hints; does NOT execute at runtime
 if TYPE_CHECKING:
     from files.AImodels import AIModules
+    from files.blob_store import ImageStore
 
 class DataProcessor:
-    def __init__(self, ai_modules: "AIModules"):
-        self.version = "0.0.1"
+    def __init__(self, ai_modules: "AIModules", image_store: Optional["ImageStore"] = None):
+        self.version = "0.0.3"
         self.module_name = "DataProcessor"
 
         # Require the caller to pass the lazily created instance from main.py
         if ai_modules is None:
             raise ValueError("DataProcessor requires an AIModules instance (inject via get_ai()).")
         self.ai_modules = ai_modules
+        # when set, the photo goes to the image store and the student doc keeps only a reference
+        self.image_store = image_store
+        self.timings: Dict[str, float] = {}   # per-stage ms of the last process_input call
 
         logger.info(f"{self.module_name} initialized (v{self.version})")
 
@@ -32,20 +37,26 @@ class DataProcessor:
             if image.content_type not in ("image/jpeg", "image/png"):
                 raise ValueError(f"Unsupported image type: {image.content_type}")
 
-            # Read bytes (we keep bytes for both ML and DB)
+            t0 = time.perf_counter()
             image_bytes = await image.read()
+            read_ms = (time.perf_counter() - t0) * 1000.0
             logger.info(f"{self.module_name}: read image for roll={roll}, size={len(image_bytes)} bytes")
-
-            # Embeddings via injected, lazily-initialized AI instance
-            embedding = await self.ai_modules.create_embeddings(roll, image_bytes)
+            # Decode + downscale + re-encode once; the same frame feeds detection and embedding
+            embedding, normalized, meta = await self.ai_modules.ingest_and_embed(roll, image_bytes)
+            self.timings = {"read_ms": round(read_ms, 3), **meta["timings"]}
             logger.info(f"{self.module_name}: embeddings created for roll={roll}")
 
             user_data = {
                 "name": name.strip(),
                 "roll": roll.strip(),
-                "image_data": image_bytes,   # raw bytes
                 "embedding": embedding       # list[float]
             }
+            t0 = time.perf_counter()
+            if self.image_store is not None:
+                user_data["image_ref"] = await self.image_store.put(normalized, "image/jpeg")
+            else:
+                user_data["image_data"] = normalized   # raw bytes (legacy inline storage)
+            self.timings["store_ms"] = round((time.perf_counter() - t0) * 1000.0, 3)
 
             logger.info(f"{self.module_name}: processing complete for roll={roll}")
             return user_data
@@ -0,0 +1,123 @@
+# tools/bench_backends.py
+"""
+Latency and memory of each inference backend on the same images.
+
+    python tools/bench_backends.py                      # native and onnx, 50 iterations
+    python tools/bench_backends.py --backends onnx --iters 200 --batch 8
+
+Every backend runs in a fresh subprocess so RSS is not shared between them.
+It reports model load time, RSS after load, peak RSS, and p50/p95 latency
+for face detection, spoof detection and FaceNet (one crop and a batch of
+--batch crops). Thread pools follow ORT_INTRA_OP_THREADS /
+ORT_INTER_OP_THREADS as in the server.
+"""
+import argparse
+import glob
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_IMAGES = os.path.join(os.path.dirname(BASE_DIR), "notebooks", "sample_dataset")
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return float("nan")
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0  # KiB on Linux
+
+
+def timed(fn, iters: int):
+    fn()  # warm-up (lazy allocations, first-call graph optimization)
+    samples = []
+    for _ in range(iters):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    return {"p50_ms": round(float(np.percentile(samples, 50)), 2), "p95_ms": round(float(np.percentile(samples, 95)), 2)}
+
+
+def child(backend: str, images: str, iters: int, batch: int):
+    import cv2
+
+    sys.path.append(BASE_DIR)
+    os.environ["INFERENCE_BACKEND"] = backend
+    rss0 = rss_mb()
+    t0 = time.perf_counter()
+    from files.AImodels import AIModules
+
+    ai = AIModules()
+    ai._require_face_models()
+    ai._ensure_spoof_model()
+    load_s = time.perf_counter() - t0
+
+    paths = sorted(p for ext in ("jpg", "jpeg", "png") for p in glob.glob(os.path.join(images, "**", f"*.{ext}"), recursive=True))
+    frames = [f for f in (cv2.imread(p, cv2.IMREAD_COLOR) for p in paths) if f is not None]
+    if not frames:
+        rng = np.random.default_rng(0)
+        frames = [(rng.random((480, 640, 3)) * 255).astype(np.uint8)]
+    frame = frames[0]
+    boxes = ai._detect_faces_batch([frame])[0]
+    box = boxes[0] if len(boxes) else (0, 0, frame.shape[1], frame.shape[0])
+    crop = ai._face_crop(frame, box)
+
+    out = {
+        "backend": backend,
+        "load_s": round(load_s, 2),
+        "rss_base_mb": round(rss0, 1),
+        "rss_loaded_mb": round(rss_mb(), 1),
+        "face": timed(lambda: ai._detect_faces_batch([frame]), iters),
+        "spoof": timed(lambda: ai._run_yolo_spoof_batch([frame]), iters),
+        "embed_1": timed(lambda: ai.embedder.embeddings(crop[None]), iters),
+        f"embed_{batch}": timed(lambda: ai.embedder.embeddings(np.repeat(crop[None], batch, axis=0)), max(1, iters // 2)),
+    }
+    out["rss_peak_mb"] = round(peak_rss_mb(), 1)
+    ai.pool.shutdown()
+    print(json.dumps(out))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", default="native,onnx")
+    parser.add_argument("--images", default=DEFAULT_IMAGES)
+    parser.add_argument("--iters", type=int, default=50)
+    parser.add_argument("--batch", type=int, default=8)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.images, args.iters, args.batch)
+        return
+
+    results = []
+    for backend in [b.strip() for b in args.backends.split(",") if b.strip()]:
+        cmd = [sys.executable, os.path.abspath(__file__), "--child", backend,
+               "--images", args.images, "--iters", str(args.iters), "--batch", str(args.batch)]
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        lines = [l for l in proc.stdout.splitlines() if l.startswith("{")]
+        if proc.returncode != 0 or not lines:
+            print(f"{backend}: failed\n{proc.stderr[-2000:]}")
+            continue
+        results.append(json.loads(lines[-1]))
+
+    for r in results:
+        stages = " ".join(f"{k}={v['p50_ms']}/{v['p95_ms']}ms" for k, v in r.items() if isinstance(v, dict))
+        print(f"{r['backend']:>7}: load={r['load_s']}s rss={r['rss_loaded_mb']}MB peak={r['rss_peak_mb']}MB | p50/p95 {stages}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# tools/bench_liveness.py
+"""
+Per-frame cost of the liveness landmark metrics, before and after vectorizing.
+
+    python tools/bench_liveness.py                   # 20000 frames at 480x360
+    python tools/bench_liveness.py --frames 50000 --size 640x480
+
+"before" is the per-landmark path (eye_aspect_ratio x2, head_pose_angles,
+smile_metric, mouth_open_metric: one NumPy array per point, inter-ocular
+distance measured twice, 3D model and camera matrix rebuilt per call).
+"after" is LandmarkFeatures.extract (one (N, 2) array per frame, cached
+constants). FaceMesh itself is not included. Landmarks are synthetic:
+a 478-point MediaPipe-style list per frame, with the pose points projected
+from the generic 3D face at a random head pose. Everything runs on one
+thread, and frames/s per core is frames divided by process CPU time. It
+is reported with and without the solvePnP head pose, which dominates both
+paths, and the tool prints the largest per-metric gap between them.
+"""
+import argparse
+import os
+import sys
+import time
+
+os.environ.setdefault("OMP_NUM_THREADS", "1")
+import cv2  # noqa: E402
+import numpy as np  # noqa: E402
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from files import liveness as lv  # noqa: E402
+
+
+class _Landmark:
+    __slots__ = ("x", "y", "z")
+
+    def __init__(self, x: float, y: float):
+        self.x, self.y, self.z = x, y, 0.0
+
+
+def synthetic_frames(n: int, w: int, h: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    camera = lv.camera_matrix(w, h)
+    frames = []
+    for _ in range(n):
+        pts = rng.normal(0.5, 0.08, size=(478, 2))
+        rvec = np.radians(rng.uniform(-20, 20, size=3)).reshape(3, 1)
+        tvec = np.array([[rng.uniform(-30, 30)], [rng.uniform(-20, 20)], [rng.uniform(450, 700)]])
+        proj, _ = cv2.projectPoints(lv.MODEL_POINTS_3D, rvec, tvec, camera, None)
+        pts[list(lv.POSE_IDS)] = proj.reshape(-1, 2) / (w, h)
+        frames.append([_Landmark(float(x), float(y)) for x, y in pts])
+    return frames
+
+
+def before(landmarks, w: int, h: int):
+    yaw, pitch, roll = lv.head_pose_angles(landmarks, w, h)
+    return {
+        "ear_left": lv.eye_aspect_ratio(landmarks, w, h, "left"),
+        "ear_right": lv.eye_aspect_ratio(landmarks, w, h, "right"),
+        "yaw": yaw,
+        "pitch": pitch,
+        "roll": roll,
+        "smile": lv.smile_metric(landmarks, w, h),
+        "mouth_open": lv.mouth_open_metric(landmarks, w, h),
+    }
+
+
+def before_no_pose(landmarks, w: int, h: int):
+    return {
+        "ear_left": lv.eye_aspect_ratio(landmarks, w, h, "left"),
+        "ear_right": lv.eye_aspect_ratio(landmarks, w, h, "right"),
+        "smile": lv.smile_metric(landmarks, w, h),
+        "mouth_open": lv.mouth_open_metric(landmarks, w, h),
+    }
+
+
+def timed(fn, frames, w: int, h: int):
+    out = [fn(f, w, h) for f in frames[: min(200, len(frames))]]  # warm-up
+    cpu0, wall0 = time.process_time(), time.perf_counter()
+    out = [fn(f, w, h) for f in frames]
+    cpu, wall = time.process_time() - cpu0, time.perf_counter() - wall0
+    return out, len(frames) / cpu if cpu > 0 else float("inf"), wall / len(frames) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=20000)
+    parser.add_argument("--size", default="480x360", help="frame WxH the landmarks are scaled to")
+    args = parser.parse_args()
+
+    cv2.setNumThreads(1)
+    w, h = (int(v) for v in args.size.lower().split("x"))
+    frames = synthetic_frames(max(1, args.frames), w, h)
+    features = lv.LandmarkFeatures()
+
+    ref, fps_before, us_before = timed(before, frames, w, h)
+    new, fps_after, us_after = timed(features.extract, frames, w, h)
+    _, fps_before_np, us_before_np = timed(before_no_pose, frames, w, h)
+    _, fps_after_np, us_after_np = timed(lambda f, w_, h_: features.metrics(lv.landmark_array(f), w_, h_, pose=False), frames, w, h)
+
+    print(f"{len(frames)} frames at {w}x{h}, 1 thread")
+    print(f"{'':>22}{'before':>22}{'after':>22}")
+    for label, (fb, ub), (fa, ua) in (
+        ("all metrics", (fps_before, us_before), (fps_after, us_after)),
+        ("without head pose", (fps_before_np, us_before_np), (fps_after_np, us_after_np)),
+    ):
+        print(f"{label:>20}: {fb:9.0f} f/s ({ub:6.1f} us) {fa:9.0f} f/s ({ua:6.1f} us)  {fa / fb:.2f}x")
+    diffs = {k: max(abs(a[k] - b[k]) for a, b in zip(ref, new)) for k in ref[0]}
+    print("max |before - after|: " + " ".join(f"{k}={v:.2e}" for k, v in diffs.items()))
+
+
+if __name__ == "__main__":
+    main()
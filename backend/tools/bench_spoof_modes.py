@@ -0,0 +1,116 @@
+# tools/bench_spoof_modes.py
+"""
+Full-frame vs crop-then-classify spoof detection on the same labelled images.
+
+    python tools/bench_spoof_modes.py                       # notebooks/sample_dataset, 20 iterations
+    python tools/bench_spoof_modes.py --images /data/attendance_yolo --iters 50
+    python tools/bench_spoof_modes.py --crop-size 256 --offset-w 10 --offset-h 15
+
+Both modes go through AIModules.detect_spoof (decode, face YOLO in crop mode,
+spoof YOLO, verdict), so latency is what /spoof pays per image. Micro-batch
+waits are turned off (BATCH_MAX_WAIT_MS=0) since requests run one at a time.
+The dataset is YOLO-layout (``images/*.jpg`` + ``labels/*.txt``, class 0 =
+spoof, 1 = real), searched recursively; an image is "spoof" when any label is
+class 0. Reported per mode: p50/p95 latency over all images and verdict
+accuracy (``overall`` equal to the labelled verdict; "no_face" counts as wrong).
+"""
+import argparse
+import asyncio
+import glob
+import os
+import sys
+import time
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+os.environ.setdefault("BATCH_MAX_WAIT_MS", "0")
+from files.AImodels import AIModules  # noqa: E402
+
+DEFAULT_IMAGES = os.path.join(os.path.dirname(BASE_DIR), "notebooks", "sample_dataset")
+
+
+def load_dataset(root: str):
+    """[(path, jpeg bytes, "spoof"|"real"|None)] from a YOLO-layout folder."""
+    samples = []
+    paths = sorted(p for ext in ("jpg", "jpeg", "png") for p in glob.glob(os.path.join(root, "**", f"*.{ext}"), recursive=True))
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        label_path = os.path.splitext(path.replace(f"{os.sep}images{os.sep}", f"{os.sep}labels{os.sep}"))[0] + ".txt"
+        truth = None
+        if os.path.exists(label_path):
+            with open(label_path) as f:
+                classes = [int(line.split()[0]) for line in f if line.split()]
+            if classes:
+                truth = "spoof" if 0 in classes else "real"
+        samples.append((path, data, truth))
+    return samples
+
+
+async def run_mode(ai: AIModules, mode: str, samples, iters: int):
+    ai.spoof_mode = mode
+    await ai.detect_spoof(samples[0][1], compact=True)  # warm-up (model load, first-call optimization)
+    latencies, verdicts = [], []
+    for _, data, _ in samples:
+        for i in range(iters):
+            t0 = time.perf_counter()
+            out = await ai.detect_spoof(data, compact=True)
+            latencies.append((time.perf_counter() - t0) * 1000.0)
+            if i == 0:
+                verdicts.append(out["overall"])
+    scored = [(v, t) for v, (_, _, t) in zip(verdicts, samples) if t is not None]
+    return {
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 2),
+        "accuracy": sum(v == t for v, t in scored) / len(scored) if scored else float("nan"),
+        "scored": len(scored),
+        "verdicts": verdicts,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default=DEFAULT_IMAGES)
+    parser.add_argument("--iters", type=int, default=20, help="timed runs per image and mode")
+    parser.add_argument("--crop-size", type=int, help="override SPOOF_CROP_SIZE")
+    parser.add_argument("--offset-w", type=float, help="override SPOOF_OFFSET_W (%% of face width)")
+    parser.add_argument("--offset-h", type=float, help="override SPOOF_OFFSET_H (%% of face height)")
+    parser.add_argument("--verbose", action="store_true", help="print each image's verdict per mode")
+    args = parser.parse_args()
+
+    samples = load_dataset(args.images)
+    if not samples:
+        sys.exit(f"no images under {args.images}")
+
+    ai = AIModules()
+    if args.crop_size:
+        ai.spoof_crop_size = args.crop_size
+    if args.offset_w is not None:
+        ai.spoof_offset_w = args.offset_w
+    if args.offset_h is not None:
+        ai.spoof_offset_h = args.offset_h
+
+    async def run_all():
+        return {mode: await run_mode(ai, mode, samples, max(1, args.iters)) for mode in ("full", "crop")}
+
+    try:
+        results = asyncio.run(run_all())
+    finally:
+        ai.pool.shutdown()
+
+    print(f"{len(samples)} images ({results['full']['scored']} labelled) from {args.images}")
+    print(f"crop: SPOOF_CROP_SIZE={ai.spoof_crop_size} margins w={ai.spoof_offset_w}% h={ai.spoof_offset_h}%; full: IMG_SIZE={ai.img_size}")
+    for mode, r in results.items():
+        print(f"{mode:>5}: p50={r['p50_ms']}ms p95={r['p95_ms']}ms accuracy={r['accuracy']:.3f}")
+    if args.verbose:
+        for i, (path, _, truth) in enumerate(samples):
+            print(f"  {os.path.relpath(path, args.images)}: label={truth} full={results['full']['verdicts'][i]} "
+                  f"crop={results['crop']['verdicts'][i]}")
+    speedup = results["full"]["p50_ms"] / results["crop"]["p50_ms"] if results["crop"]["p50_ms"] else float("nan")
+    print(f"crop vs full p50: {speedup:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
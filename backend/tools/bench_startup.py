@@ -0,0 +1,115 @@
+# tools/bench_startup.py
+"""
+Cold-start cost of a worker per inference backend.
+
+    python tools/bench_startup.py                        # native and onnx
+    python tools/bench_startup.py --backends onnx --image some_face.jpg
+
+Each backend starts in a fresh interpreter, which measures:
+  import_s       import of files.AImodels (plus whatever it drags in)
+  init_s         AIModules() construction
+  first_infer_s  first spoof_and_match on the image: model load + first call
+  second_infer_s the same call again (steady state)
+  rss_*_mb       RSS at start, after import, and after the first inference
+  frameworks     torch / tensorflow / ultralytics modules present at the end
+Run with INFERENCE_STRICT=true in the environment to confirm the ONNX worker
+never imports a training framework.
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_IMAGES = os.path.join(os.path.dirname(BASE_DIR), "notebooks", "sample_dataset")
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024.0, 1)
+    except OSError:
+        pass
+    return float("nan")
+
+
+def child(backend: str, image_path: str):
+    rss_start = rss_mb()
+    os.environ["INFERENCE_BACKEND"] = backend
+    if backend != "onnx":
+        os.environ["INFERENCE_STRICT"] = "false"
+    sys.path.append(BASE_DIR)
+
+    t0 = time.perf_counter()
+    from files.AImodels import AIModules
+    from files.inference_backend import loaded_frameworks
+    import_s = time.perf_counter() - t0
+    rss_import = rss_mb()
+
+    t0 = time.perf_counter()
+    ai = AIModules()
+    init_s = time.perf_counter() - t0
+
+    with open(image_path, "rb") as f:
+        data = f.read()
+
+    async def infer():
+        t = time.perf_counter()
+        await ai.spoof_and_match(data, roll="unknown")
+        return time.perf_counter() - t
+
+    ai.gallery.loaded = True  # no Mongo here; an empty gallery is enough to exercise every model
+    first = asyncio.run(infer())
+    second = asyncio.run(infer())
+    out = {
+        "backend": backend,
+        "import_s": round(import_s, 3),
+        "init_s": round(init_s, 3),
+        "first_infer_s": round(first, 3),
+        "second_infer_s": round(second, 3),
+        "rss_start_mb": rss_start,
+        "rss_import_mb": rss_import,
+        "rss_ready_mb": rss_mb(),
+        "frameworks": loaded_frameworks(),
+    }
+    ai.pool.shutdown()
+    print(json.dumps(out))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", default="native,onnx")
+    parser.add_argument("--image", help="face image to run (default: first sample_dataset image)")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    image = args.image or next(iter(sorted(glob.glob(os.path.join(DEFAULT_IMAGES, "**", "*.jpg"), recursive=True))), None)
+    if not image:
+        sys.exit("no image given and none found in notebooks/sample_dataset")
+    if args.child:
+        child(args.child, image)
+        return
+
+    for backend in [b.strip() for b in args.backends.split(",") if b.strip()]:
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", backend, "--image", image],
+                              capture_output=True, text=True)
+        lines = [l for l in proc.stdout.splitlines() if l.startswith("{")]
+        if proc.returncode != 0 or not lines:
+            print(f"{backend}: failed\n{proc.stderr[-2000:]}")
+            continue
+        r = json.loads(lines[-1])
+        print(
+            f"{r['backend']:>7}: import={r['import_s']}s init={r['init_s']}s first={r['first_infer_s']}s "
+            f"next={r['second_infer_s']}s | rss start={r['rss_start_mb']} import={r['rss_import_mb']} "
+            f"ready={r['rss_ready_mb']} MB | frameworks={r['frameworks'] or 'none'}"
+        )
+
+
+if __name__ == "__main__":
+    main()
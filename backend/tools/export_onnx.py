@@ -0,0 +1,87 @@
+# tools/export_onnx.py
+"""
+Export the face detector, spoof detector and FaceNet embedder to ONNX once,
+for INFERENCE_BACKEND=onnx.
+
+    python tools/export_onnx.py                 # all three, next to the .pt files
+    python tools/export_onnx.py --only facenet  # just one model
+    python tools/export_onnx.py --static-batch  # fixed batch of 1 (no micro-batching)
+
+Source and target paths follow FACE_MODEL_PATH / SPOOF_MODEL_PATH and
+FACE_ONNX_PATH / SPOOF_ONNX_PATH / FACENET_ONNX_PATH, like the server.
+YOLO models go through ultralytics' exporter; FaceNet through tf2onnx
+(pip install tf2onnx). This step needs the native stack (torch +
+tensorflow); the ONNX runtime path does not.
+"""
+import argparse
+import os
+import shutil
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["ONNX_PRECISION"] = "fp32"  # exports are the FP32 models; INT8 comes from tools/quantize_onnx.py
+from files.AImodels import AIModules  # noqa: E402
+from files.logger import logger  # noqa: E402
+
+
+def export_yolo(pt_path: str, onnx_path: str, imgsz: int, dynamic: bool, opset: int) -> str:
+    from ultralytics import YOLO
+
+    if not os.path.exists(pt_path):
+        raise FileNotFoundError(f"{pt_path} not found")
+    out = YOLO(pt_path).export(format="onnx", imgsz=imgsz, dynamic=dynamic, simplify=True, opset=opset)
+    if os.path.abspath(out) != os.path.abspath(onnx_path):
+        os.makedirs(os.path.dirname(onnx_path) or ".", exist_ok=True)
+        shutil.move(out, onnx_path)
+    return onnx_path
+
+
+def export_facenet(onnx_path: str, dynamic: bool, opset: int) -> str:
+    import tensorflow as tf
+    import tf2onnx
+    from keras_facenet import FaceNet
+
+    model = FaceNet().model
+    spec = [tf.TensorSpec((None if dynamic else 1, 160, 160, 3), tf.float32, name="input")]
+    os.makedirs(os.path.dirname(onnx_path) or ".", exist_ok=True)
+    tf2onnx.convert.from_keras(model, input_signature=spec, opset=opset, output_path=onnx_path)
+    return onnx_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", choices=("face", "spoof", "facenet"), action="append",
+                        help="export only this model (repeatable)")
+    parser.add_argument("--static-batch", action="store_true", help="export with batch size 1 instead of a dynamic batch")
+    parser.add_argument("--opset", type=int, default=17)
+    args = parser.parse_args()
+
+    ai = AIModules()
+    wanted = args.only or ["face", "spoof", "facenet"]
+    dynamic = not args.static_batch
+    jobs = {
+        # face YOLO is called without imgsz in the native path, i.e. at ultralytics' default 640
+        "face": lambda: export_yolo(ai.face_model_path, ai.face_onnx_path, 640, dynamic, args.opset),
+        "spoof": lambda: export_yolo(ai.spoof_model_path, ai.spoof_onnx_path, ai.img_size, dynamic, args.opset),
+        "facenet": lambda: export_facenet(ai.facenet_onnx_path, dynamic, min(args.opset, 15)),
+    }
+    failed = 0
+    for name in wanted:
+        t0 = time.perf_counter()
+        try:
+            path = jobs[name]()
+        except Exception as e:
+            failed += 1
+            print(f"{name}: export failed: {e}")
+            logger.error(f"export_onnx: {name} failed: {e}")
+            continue
+        size_mb = os.path.getsize(path) / 1e6
+        print(f"{name}: {path} ({size_mb:.1f} MB, {time.perf_counter() - t0:.1f}s)")
+        logger.info(f"export_onnx: {name} -> {path}")
+    ai.pool.shutdown()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
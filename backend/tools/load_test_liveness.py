@@ -0,0 +1,243 @@
+# tools/load_test_liveness.py
+"""
+Load-test the liveness scheduler by replaying landmark streams from many
+concurrent sessions, and check the batched head pose against solvePnP.
+
+    python tools/load_test_liveness.py                                # 200 sessions, synthetic streams
+    python tools/load_test_liveness.py --sessions 500 --fps 20 --seconds 30 --pose pnp
+    python tools/load_test_liveness.py --streams rec/*.npz --validate-pose
+    python tools/load_test_liveness.py --record 0 --out rec/me.npz --seconds 20   # webcam (needs mediapipe)
+
+A stream is an .npz with ``points`` (T, len(FEATURE_IDS), 2) normalized
+landmarks in FEATURE_IDS order (NaN rows = no face), ``size`` (w, h), ``fps``
+and ``ids``. --record captures one from a camera index or video file. Without
+--streams, synthetic streams are generated: a generic 3D face that keeps
+cycling through blinks, head turns and an open mouth, with landmark noise.
+
+Replay runs in-process, without HTTP or FaceMesh, and goes through the same
+LivenessManager.submit_points -> LivenessScheduler path as the WebSocket.
+Each of --sessions client slots streams at --fps with jitter. It opens a new
+session after every verdict, so concurrency stays constant for --seconds.
+The report covers frames offered, processed and dropped (latest frame wins),
+batch sizes, submit-to-processed latency, CPU per processed frame and the
+verdicts.
+
+--validate-pose compares the batched POSIT head pose with per-frame
+solvePnP on every stream frame. Synthetic streams also compare both with
+the true pose.
+"""
+import argparse
+import asyncio
+import glob
+import os
+import random
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from files import liveness as lv  # noqa: E402
+from files.inference_pool import InferencePool  # noqa: E402
+
+# generic face (mm) for every FEATURE_IDS landmark; pose points match MODEL_POINTS_3D
+_FACE_3D = {
+    lv.NOSE_TIP: (0.0, 0.0, 0.0), lv.CHIN: (0.0, -63.6, -12.5),
+    lv.LEFT_EYE_OUTER: (-43.3, 32.7, -26.0), lv.LEFT_EYE_INNER: (-15.3, 32.7, -26.0),
+    lv.LEFT_EYE_UPPER: (-29.3, 36.7, -24.0), lv.LEFT_EYE_LOWER: (-29.3, 28.7, -24.0),
+    lv.RIGHT_EYE_OUTER: (43.3, 32.7, -26.0), lv.RIGHT_EYE_INNER: (15.3, 32.7, -26.0),
+    lv.RIGHT_EYE_UPPER: (29.3, 36.7, -24.0), lv.RIGHT_EYE_LOWER: (29.3, 28.7, -24.0),
+    lv.MOUTH_LEFT: (-28.9, -28.9, -24.1), lv.MOUTH_RIGHT: (28.9, -28.9, -24.1),
+    lv.MOUTH_UP: (0.0, -26.0, -20.0), lv.MOUTH_DOWN: (0.0, -30.0, -20.0),
+}
+_FACING_CAMERA = np.diag([1.0, -1.0, -1.0])  # model y up / z out of the face -> camera y down / z forward
+# (action, seconds): the synthetic user keeps doing all of these so most challenges can pass
+_SCRIPT = (("neutral", 0.4), ("blink", 0.3), ("neutral", 0.3), ("blink", 0.3), ("roll+", 0.6), ("roll-", 0.6),
+           ("pitch+", 0.6), ("pitch-", 0.6), ("yaw+", 0.6), ("yaw-", 0.6), ("mouth", 0.6))
+
+
+def synthetic_stream(seconds: float, fps: float, w: int = 480, h: int = 360, noise_px: float = 0.8, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    camera = lv.camera_matrix(w, h)
+    base = np.array([_FACE_3D[i] for i in lv.FEATURE_IDS], dtype=np.float64)
+    row = {lid: r for r, lid in enumerate(lv.FEATURE_IDS)}
+    timeline = [a for a, d in _SCRIPT for _ in range(max(1, int(round(d * fps))))]
+    offset = int(rng.integers(len(timeline)))
+    points, truth = [], []
+    for t in range(int(seconds * fps)):
+        action = timeline[(t + offset) % len(timeline)]
+        face = base.copy()
+        if action == "blink":
+            for up, low in ((lv.LEFT_EYE_UPPER, lv.LEFT_EYE_LOWER), (lv.RIGHT_EYE_UPPER, lv.RIGHT_EYE_LOWER)):
+                mid = (face[row[up], 1] + face[row[low], 1]) / 2
+                face[row[up], 1], face[row[low], 1] = mid + 0.4, mid - 0.4
+        if action == "mouth":
+            face[row[lv.MOUTH_DOWN], 1] -= 20.0
+        angles = rng.normal(0.0, 2.0, size=3)
+        if action[:-1] in ("roll", "pitch", "yaw"):
+            angles[("pitch", "yaw", "roll").index(action[:-1])] += 18.0 if action[-1] == "+" else -18.0
+        rot = cv2.Rodrigues(np.radians(angles).reshape(3, 1))[0] @ _FACING_CAMERA
+        rvec = cv2.Rodrigues(rot)[0]
+        tvec = np.array([[rng.normal(0, 10)], [rng.normal(0, 10)], [rng.uniform(450, 550)]])
+        proj, _ = cv2.projectPoints(face, rvec, tvec, camera, None)
+        px = proj.reshape(-1, 2) + rng.normal(0.0, noise_px, size=(len(base), 2))
+        points.append(px / (w, h))
+        truth.append(lv._euler_degrees(rvec))
+    return {"points": np.asarray(points), "w": w, "h": h, "fps": fps, "truth": np.asarray(truth), "name": f"synthetic-{seed}"}
+
+
+def load_stream(path: str):
+    data = np.load(path)
+    if tuple(int(i) for i in data["ids"]) != lv.FEATURE_IDS:
+        raise ValueError(f"{path}: landmark ids differ from FEATURE_IDS; re-record it")
+    w, h = (int(v) for v in data["size"])
+    return {"points": data["points"].astype(np.float64), "w": w, "h": h, "fps": float(data["fps"]), "truth": None, "name": path}
+
+
+def record(source: str, out: str, seconds: float, side: int):
+    import mediapipe as mp  # optional dependency, only for recording
+
+    cap = cv2.VideoCapture(int(source) if source.isdigit() else source)
+    if not cap.isOpened():
+        sys.exit(f"cannot open {source}")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 15.0
+    mesh = mp.solutions.face_mesh.FaceMesh(static_image_mode=False, max_num_faces=1, refine_landmarks=True,
+                                           min_detection_confidence=0.5, min_tracking_confidence=0.5)
+    points, size = [], None
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < seconds:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        frame = cv2.flip(frame, 1)  # same selfie view LivenessManager.decode gives FaceMesh
+        h, w = frame.shape[:2]
+        if max(h, w) > side:
+            r = side / float(max(h, w))
+            frame = cv2.resize(frame, (int(w * r), int(h * r)), interpolation=cv2.INTER_AREA)
+        size = frame.shape[1], frame.shape[0]
+        faces = mesh.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)).multi_face_landmarks
+        points.append(lv.landmark_array(faces[0].landmark) if faces else np.full((len(lv.FEATURE_IDS), 2), np.nan))
+    cap.release()
+    if not points:
+        sys.exit("no frames captured")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    np.savez_compressed(out, points=np.asarray(points, np.float32), size=np.array(size), fps=fps,
+                        ids=np.array(lv.FEATURE_IDS))
+    print(f"recorded {len(points)} frames at {size[0]}x{size[1]} ({fps:.1f} fps) -> {out}")
+
+
+def _angle_gap(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    d = np.abs(a - b) % 360.0
+    return np.minimum(d, 360.0 - d)
+
+
+def validate_pose(streams, iterations: int):
+    features = lv.LandmarkFeatures()
+    for s in streams:
+        pts = s["points"]
+        keep = ~np.isnan(pts).any(axis=(1, 2))
+        pts = pts[keep]
+        if not len(pts):
+            continue
+        sizes = np.tile([s["w"], s["h"]], (len(pts), 1))
+        posit = lv.head_pose_batch(pts[:, lv._POSE_ROWS] * sizes[:, None, :], sizes, iterations=iterations)
+        pnp = np.array([[m["yaw"], m["pitch"], m["roll"]] for m in (features.metrics(p, s["w"], s["h"]) for p in pts)])
+        rows = [("posit vs pnp", _angle_gap(posit, pnp))]
+        if s["truth"] is not None:
+            truth = s["truth"][keep]
+            rows += [("posit vs true", _angle_gap(posit, truth)), ("pnp vs true", _angle_gap(pnp, truth))]
+        print(f"{s['name']}: {len(pts)} frames")
+        for label, gap in rows:
+            print(f"  {label:>14}: yaw/pitch/roll p50 {np.percentile(gap, 50, axis=0).round(2)} "
+                  f"p95 {np.percentile(gap, 95, axis=0).round(2)} max {gap.max(axis=0).round(2)}")
+
+
+async def replay(streams, sessions: int, fps: float, seconds: float, workers: int, batch_max: int, pose: str):
+    manager = lv.LivenessManager(pool=InferencePool(workers=workers, queue_size=0))
+    manager.max_sessions = sessions
+    manager.ttl = seconds + 60.0
+    manager.scheduler.max_batch = batch_max
+    manager.scheduler.pose = pose
+    verdicts = {"live": 0, "not_live": 0}
+    offered = [0]
+    deadline = time.monotonic() + seconds
+
+    async def client(k: int):
+        rng = random.Random(k)
+        stream = streams[k % len(streams)]
+        pts, w, h = stream["points"], stream["w"], stream["h"]
+        t = rng.randrange(len(pts))
+        await asyncio.sleep(rng.random() / fps)  # spread the first frames over one period
+        while time.monotonic() < deadline:
+            session = manager.create(needs_mesh=False)
+            session.busy = True
+            outbox = manager.attach(session)
+            while session.verdict is None and time.monotonic() < deadline:
+                frame = pts[t % len(pts)]
+                t += 1
+                manager.submit_points(session, None if np.isnan(frame).any() else frame, w, h)
+                offered[0] += 1
+                await asyncio.sleep(rng.uniform(0.8, 1.2) / fps)
+            while not outbox.empty():
+                event = outbox.get_nowait()
+                if event.get("type") == "verdict":
+                    verdicts["live" if event["live"] else "not_live"] += 1
+            manager.detach(session)
+            session.busy = False
+            manager.close(session.id)
+
+    cpu0, wall0 = time.process_time(), time.perf_counter()
+    await asyncio.gather(*(client(k) for k in range(sessions)))
+    cpu, wall = time.process_time() - cpu0, time.perf_counter() - wall0
+    stats = manager.scheduler.stats()
+    manager.shutdown()
+    return stats, offered[0], verdicts, cpu, wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", nargs="*", help="recorded .npz streams (globs ok); default: synthetic")
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--fps", type=float, default=15.0, help="frames per second each client sends")
+    parser.add_argument("--seconds", type=float, default=20.0)
+    parser.add_argument("--workers", type=int, default=2, help="executor threads (LIVENESS_WORKERS)")
+    parser.add_argument("--batch-max", type=int, default=64, help="LIVENESS_BATCH_MAX")
+    parser.add_argument("--pose", choices=("posit", "pnp"), default="posit", help="LIVENESS_HEAD_POSE")
+    parser.add_argument("--validate-pose", action="store_true", help="only compare POSIT with solvePnP, no replay")
+    parser.add_argument("--posit-iterations", type=int, default=3)
+    parser.add_argument("--record", metavar="SOURCE", help="camera index or video file to record a stream from")
+    parser.add_argument("--out", default="liveness_stream.npz")
+    parser.add_argument("--side", type=int, default=480, help="long side frames are resized to when recording")
+    args = parser.parse_args()
+
+    if args.record:
+        record(args.record, args.out, args.seconds, args.side)
+        return
+    if args.streams:
+        paths = sorted(p for pattern in args.streams for p in glob.glob(pattern))
+        if not paths:
+            sys.exit("no streams matched")
+        streams = [load_stream(p) for p in paths]
+    else:
+        streams = [synthetic_stream(20.0, args.fps, seed=k) for k in range(8)]
+
+    if args.validate_pose:
+        validate_pose(streams, args.posit_iterations)
+        return
+
+    cv2.setNumThreads(1)
+    stats, offered, verdicts, cpu, wall = asyncio.run(
+        replay(streams, args.sessions, args.fps, args.seconds, args.workers, args.batch_max, args.pose)
+    )
+    processed = stats["processed"]
+    print(f"{args.sessions} sessions x {args.fps:g} fps for {wall:.1f}s | {len(streams)} stream(s) | head pose: {args.pose}")
+    print(f"frames: offered={offered} processed={processed} dropped={stats['dropped']} "
+          f"({stats['dropped'] / max(1, stats['submitted']):.1%}) | {processed / wall:.0f} frames/s")
+    print(f"batches={stats['batches']} avg={stats['avg_batch']} max={stats['max_seen']} | latency p50={stats['latency_ms']['p50']}ms "
+          f"p95={stats['latency_ms']['p95']}ms max={stats['latency_ms']['max']}ms")
+    print(f"cpu={cpu:.1f}s ({cpu / max(1, processed) * 1e6:.0f} us/processed frame, incl. the replay clients) | verdicts {verdicts}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# tools/migrate_attendance.py
+"""
+Copy nested per-date attendance documents into the flat marks collection.
+
+    python tools/migrate_attendance.py                      # every date
+    python tools/migrate_attendance.py --date 2025-01-31    # one date
+    python tools/migrate_attendance.py --delete-nested      # drop each date doc once copied
+
+Marks that already exist are skipped (unique (date, course, roll) index), so the
+tool can be re-run safely. Switch the server with ATTENDANCE_LAYOUT=flat.
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from files.db_controller import DBController, close_mongo_client  # noqa: E402
+from files.logger import logger  # noqa: E402
+
+
+async def migrate(date=None, delete_nested=False, batch_size=1000):
+    db = DBController()
+    await db.ensure_indexes()
+    totals = {"dates": 0, "inserted": 0, "skipped": 0}
+    query = {"date": date} if date else {}
+    async for doc in db.attendance.find(query, {"_id": 0}):
+        date_str = doc.get("date")
+        ops = []
+        for course, cdata in (doc.get("courses") or {}).items():
+            for roll, entry in ((cdata or {}).get("students") or {}).items():
+                mark = {"date": date_str, "course": course, **db._mark_entry(entry)}
+                mark["roll"] = mark.get("roll") or roll
+                ops.append(InsertOne(mark))
+
+        inserted = 0
+        for start in range(0, len(ops), batch_size):
+            chunk = ops[start:start + batch_size]
+            try:
+                result = await db.marks.bulk_write(chunk, ordered=False)
+                inserted += result.inserted_count
+            except BulkWriteError as e:
+                dupes = [err for err in e.details.get("writeErrors", []) if err.get("code") == 11000]
+                if len(dupes) != len(e.details.get("writeErrors", [])):
+                    raise
+                inserted += e.details.get("nInserted", 0)
+
+        totals["dates"] += 1
+        totals["inserted"] += inserted
+        totals["skipped"] += len(ops) - inserted
+        print(f"{date_str}: {len(ops)} marks, {inserted} inserted, {len(ops) - inserted} already present")
+        if delete_nested:
+            await db.attendance.delete_one({"date": date_str})
+
+    logger.info(f"migrate_attendance: {totals}")
+    print(f"done: {totals}")
+    close_mongo_client()
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--date", help="only migrate this YYYY-MM-DD")
+    parser.add_argument("--delete-nested", action="store_true", help="delete each nested date doc after copying")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(migrate(args.date, args.delete_nested, args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
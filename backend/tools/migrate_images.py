@@ -0,0 +1,70 @@
+# tools/migrate_images.py
+"""
+Move inline student photos (students.image_data) into the image store.
+
+    python tools/migrate_images.py             # every student that still has image_data
+    python tools/migrate_images.py --dry-run   # only count them
+
+Each photo is stored under its SHA-256 and the student doc gets
+image_ref = {"sha256", "size", "content_type"} while image_data is unset.
+Safe to re-run: migrated students no longer match the query.
+Backend follows IMAGE_STORE / IMAGE_STORE_DIR / IMAGE_STORE_BUCKET.
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from files.blob_store import ImageStore  # noqa: E402
+from files.db_controller import DBController, close_mongo_client  # noqa: E402
+from files.logger import logger  # noqa: E402
+
+
+def _content_type(data: bytes) -> str:
+    return "image/png" if data[:8] == b"\x89PNG\r\n\x1a\n" else "image/jpeg"
+
+
+async def migrate(dry_run=False, batch_size=100):
+    db = DBController()
+    await db.ensure_indexes()
+    store = ImageStore(db.db)
+    query = {"image_data": {"$exists": True}}
+    pending = await db.students.count_documents(query)
+    print(f"{pending} students with inline image_data (store backend: {store.backend.name})")
+    if dry_run or not pending:
+        close_mongo_client()
+        return {"pending": pending, "moved": 0, "bytes": 0}
+
+    moved = 0
+    total_bytes = 0
+    cursor = db.students.find(query, {"_id": 0, "roll": 1, "image_data": 1}, batch_size=batch_size)
+    async for doc in cursor:
+        data = bytes(doc.get("image_data") or b"")
+        if not data:
+            await db.students.update_one({"roll": doc["roll"]}, {"$unset": {"image_data": ""}})
+            continue
+        ref = await store.put(data, _content_type(data))
+        await db.students.update_one({"roll": doc["roll"]}, {"$set": {"image_ref": ref}, "$unset": {"image_data": ""}})
+        moved += 1
+        total_bytes += len(data)
+        if moved % 500 == 0:
+            print(f"  {moved}/{pending} moved")
+
+    totals = {"pending": pending, "moved": moved, "bytes": total_bytes}
+    logger.info(f"migrate_images: {totals}")
+    print(f"done: {totals}")
+    close_mongo_client()
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="only count students still holding image_data")
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(migrate(args.dry_run, args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# tools/onnx_parity.py
+"""
+Check the ONNX models against the native ones on real images.
+
+    python tools/onnx_parity.py                          # notebooks/sample_dataset
+    python tools/onnx_parity.py --images /path/to/jpgs   # any folder (searched recursively)
+    python tools/onnx_parity.py --min-iou 0.9 --min-cos 0.99
+
+Per image it compares face boxes (IoU of each native box with its best ONNX
+match), the spoof verdict and top-box confidence, and the FaceNet embedding
+of the same face crop (cosine). Exits 1 when any image falls below the
+budgets, so it can gate a re-export.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+
+import cv2
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+from files.AImodels import AIModules  # noqa: E402
+
+DEFAULT_IMAGES = os.path.join(os.path.dirname(BASE_DIR), "notebooks", "sample_dataset")
+
+
+def load_modules(backend: str) -> AIModules:
+    ai = AIModules()
+    ai.backend = backend
+    ai._require_face_models()
+    ai._ensure_spoof_model()
+    if ai._spoof_model is None:
+        raise RuntimeError(f"{backend}: spoof model not initialized")
+    return ai
+
+
+def best_iou(box, boxes) -> float:
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    return float(AIModules._ious(box, boxes).max()) if len(boxes) else 0.0
+
+
+def compare(native: AIModules, onnx: AIModules, frame: np.ndarray):
+    out = {}
+    nb = native._detect_faces_batch([frame])[0]
+    ob = onnx._detect_faces_batch([frame])[0]
+    out["faces"] = [len(nb), len(ob)]
+    out["face_iou"] = min((best_iou(a, ob) for a in nb), default=1.0 if len(ob) == 0 else 0.0)
+
+    ns = native._summarize_spoof(native._run_yolo_spoof_batch([frame])[0])
+    os_ = onnx._summarize_spoof(onnx._run_yolo_spoof_batch([frame])[0])
+    out["spoof"] = [ns["overall"], os_["overall"]]
+    top_n = max((d["conf"] for d in ns["detections"]), default=0.0)
+    top_o = max((d["conf"] for d in os_["detections"]), default=0.0)
+    out["spoof_conf_diff"] = abs(top_n - top_o)
+
+    out["cosine"] = None
+    if len(nb):
+        crop = native._face_crop(frame, nb[0])
+        if crop is not None:
+            a = np.asarray(native.embedder.embeddings(crop[None]), dtype=np.float32)[0]
+            b = np.asarray(onnx.embedder.embeddings(crop[None]), dtype=np.float32)[0]
+            out["cosine"] = float(a @ b / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-12))
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default=DEFAULT_IMAGES)
+    parser.add_argument("--min-iou", type=float, default=0.9, help="worst acceptable face-box IoU")
+    parser.add_argument("--min-cos", type=float, default=0.99, help="worst acceptable embedding cosine")
+    parser.add_argument("--max-conf-diff", type=float, default=0.05, help="largest acceptable spoof confidence gap")
+    parser.add_argument("--json", action="store_true", help="print one JSON line per image")
+    args = parser.parse_args()
+
+    paths = sorted(p for ext in ("jpg", "jpeg", "png") for p in glob.glob(os.path.join(args.images, "**", f"*.{ext}"), recursive=True))
+    if not paths:
+        sys.exit(f"no images under {args.images}")
+    native, onnx = load_modules("native"), load_modules("onnx")
+
+    failures = 0
+    for path in paths:
+        frame = cv2.imread(path, cv2.IMREAD_COLOR)
+        if frame is None:
+            continue
+        r = compare(native, onnx, frame)
+        ok = (
+            r["faces"][0] == r["faces"][1]
+            and r["face_iou"] >= args.min_iou
+            and r["spoof"][0] == r["spoof"][1]
+            and r["spoof_conf_diff"] <= args.max_conf_diff
+            and (r["cosine"] is None or r["cosine"] >= args.min_cos)
+        )
+        failures += not ok
+        if args.json:
+            print(json.dumps({"image": path, "ok": ok, **r}))
+        else:
+            cos = "-" if r["cosine"] is None else f"{r['cosine']:.4f}"
+            print(f"{'ok  ' if ok else 'FAIL'} {os.path.relpath(path, args.images)}: faces={r['faces']} "
+                  f"iou={r['face_iou']:.3f} spoof={r['spoof']} dconf={r['spoof_conf_diff']:.3f} cos={cos}")
+
+    print(f"{len(paths) - failures}/{len(paths)} images within budget")
+    native.pool.shutdown()
+    onnx.pool.shutdown()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
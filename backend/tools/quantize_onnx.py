@@ -0,0 +1,246 @@
+# tools/quantize_onnx.py
+"""
+Build INT8 variants of the ONNX models, calibrated on real images, and only
+keep them when they stay within an accuracy budget.
+
+    python tools/quantize_onnx.py                         # all three, notebooks/sample_dataset
+    python tools/quantize_onnx.py --only spoof --max-acc-drop 0.0
+    python tools/quantize_onnx.py --images /data/attendance_yolo --min-cos 0.985
+
+The FP32 sources are FACE_ONNX_PATH / SPOOF_ONNX_PATH / FACENET_ONNX_PATH
+(tools/export_onnx.py). Each one is written next to its source as
+``<name>.int8.onnx``; select them with ONNX_PRECISION=int8 or by pointing
+the *_ONNX_PATH variables at them.
+
+The dataset is YOLO-layout (``images/*.jpg`` + ``labels/*.txt``, class 0 =
+spoof, 1 = real as in CLASS_NAMES), searched recursively. Calibration uses
+every image (letterboxed frames for YOLO, labelled face crops for FaceNet).
+Checks against FP32:
+  spoof   accuracy: top box matches a label (IoU >= 0.5) with the right class
+  face    recall: labelled faces found (IoU >= 0.5)
+  facenet cosine between FP32 and INT8 embeddings of each crop (min and mean)
+A model whose accuracy/recall drops by more than --max-acc-drop, or whose
+worst cosine is below --min-cos, is discarded and the tool exits 1. So is one
+that could not be measured at all (no labelled images or faces to score).
+"""
+import argparse
+import glob
+import math
+import os
+import re
+import sys
+import tempfile
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["ONNX_PRECISION"] = "fp32"  # the sources are always the FP32 exports
+from files.AImodels import AIModules  # noqa: E402
+from files.inference_backend import OnnxFaceNet, OnnxYolo  # noqa: E402
+from files.logger import logger  # noqa: E402
+
+DEFAULT_IMAGES = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "notebooks", "sample_dataset")
+
+
+def load_dataset(root: str):
+    """[(frame, [(cls, x1, y1, x2, y2), ...])] from a YOLO-layout folder."""
+    samples = []
+    paths = sorted(p for ext in ("jpg", "jpeg", "png") for p in glob.glob(os.path.join(root, "**", f"*.{ext}"), recursive=True))
+    for path in paths:
+        frame = cv2.imread(path, cv2.IMREAD_COLOR)
+        if frame is None:
+            continue
+        h, w = frame.shape[:2]
+        label_path = os.path.splitext(path.replace(f"{os.sep}images{os.sep}", f"{os.sep}labels{os.sep}"))[0] + ".txt"
+        boxes = []
+        if os.path.exists(label_path):
+            with open(label_path) as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) < 5:
+                        continue
+                    c, cx, cy, bw, bh = int(parts[0]), *map(float, parts[1:5])
+                    boxes.append((c, (cx - bw / 2) * w, (cy - bh / 2) * h, (cx + bw / 2) * w, (cy + bh / 2) * h))
+        samples.append((frame, boxes))
+    return samples
+
+
+class _Reader:
+    """CalibrationDataReader over precomputed input tensors."""
+
+    def __init__(self, input_name: str, tensors):
+        self.input_name = input_name
+        self._it = iter(tensors)
+
+    def get_next(self):
+        t = next(self._it, None)
+        return None if t is None else {self.input_name: t}
+
+
+def _head_nodes(model_path: str):
+    # ultralytics names nodes /model.<layer>/...; the highest layer is the Detect head, whose
+    # box/class outputs are the most sensitive to INT8 and cheap to keep in FP32
+    import onnx
+
+    names = [n.name for n in onnx.load(model_path, load_external_data=False).graph.node]
+    layers = [int(m.group(1)) for m in (re.match(r"/model\.(\d+)/", n) for n in names) if m]
+    if not layers:
+        return []
+    head = f"/model.{max(layers)}/"
+    return [n for n in names if n.startswith(head)]
+
+
+def quantize(src: str, dst: str, reader, exclude, per_channel: bool):
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    with tempfile.TemporaryDirectory() as tmp:
+        prepped = os.path.join(tmp, "prep.onnx")
+        try:
+            quant_pre_process(src, prepped, skip_symbolic_shape=True)
+        except Exception as e:  # pre-processing is an optimization, not a requirement
+            logger.warning(f"quantize_onnx: pre-process of {src} skipped: {e}")
+            prepped = src
+        quantize_static(
+            prepped, dst, reader,
+            quant_format=QuantFormat.QDQ,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            per_channel=per_channel,
+            calibrate_method=CalibrationMethod.MinMax,
+            nodes_to_exclude=exclude,
+        )
+
+
+def _best_iou(box, boxes) -> float:
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    return float(AIModules._ious(box, boxes).max()) if len(boxes) else 0.0
+
+
+def spoof_accuracy(model: OnnxYolo, samples, conf: float) -> float:
+    scored, hits = 0, 0
+    for frame, labels in samples:
+        if not labels:
+            continue
+        scored += 1
+        det = model.predict([frame], conf=conf)[0]
+        if not len(det):
+            continue
+        top = int(np.argmax(det.conf))
+        box, cls = det.xyxy[top], int(det.cls[top])
+        hits += _best_iou(box, [gt for c, *gt in labels if c == cls]) >= 0.5
+    return hits / scored if scored else float("nan")
+
+
+def face_recall(model: OnnxYolo, samples) -> float:
+    total, found = 0, 0
+    for frame, labels in samples:
+        det = model.predict([frame])[0]
+        for _, *gt in labels:
+            total += 1
+            found += _best_iou(gt, det.xyxy) >= 0.5
+    return found / total if total else float("nan")
+
+
+def face_crops(samples):
+    crops = []
+    for frame, labels in samples:
+        for _, *gt in labels:
+            crop = AIModules._face_crop(frame, gt)
+            if crop is not None:
+                crops.append(crop)
+    return crops
+
+
+def embedding_cosine(fp32: OnnxFaceNet, int8: OnnxFaceNet, crops):
+    a = np.asarray(fp32.embeddings(np.stack(crops)), dtype=np.float32)
+    b = np.asarray(int8.embeddings(np.stack(crops)), dtype=np.float32)
+    cos = (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1) + 1e-12)
+    return float(cos.min()), float(cos.mean())
+
+
+def int8_path(path: str) -> str:
+    root, _ = os.path.splitext(path)
+    return f"{root}.int8.onnx"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default=DEFAULT_IMAGES)
+    parser.add_argument("--only", choices=("face", "spoof", "facenet"), action="append")
+    parser.add_argument("--max-acc-drop", type=float, default=float(os.environ.get("QUANT_MAX_ACC_DROP", 0.02)),
+                        help="largest allowed drop in spoof accuracy / face recall (absolute)")
+    parser.add_argument("--min-cos", type=float, default=float(os.environ.get("QUANT_MIN_COS", 0.98)),
+                        help="smallest allowed FP32-vs-INT8 embedding cosine")
+    parser.add_argument("--quantize-head", action="store_true", help="also quantize the YOLO Detect head")
+    parser.add_argument("--per-tensor", action="store_true", help="per-tensor instead of per-channel weights")
+    args = parser.parse_args()
+
+    samples = load_dataset(args.images)
+    if not samples:
+        sys.exit(f"no images under {args.images}")
+    crops = face_crops(samples)
+    print(f"{len(samples)} images, {sum(len(l) for _, l in samples)} labelled faces from {args.images}")
+
+    ai = AIModules()
+    per_channel = not args.per_tensor
+    rejected = 0
+    for name in args.only or ["face", "spoof", "facenet"]:
+        src = {"face": ai.face_onnx_path, "spoof": ai.spoof_onnx_path, "facenet": ai.facenet_onnx_path}[name]
+        dst = int8_path(src)
+        tmp = dst + ".tmp"
+        try:
+            if name == "facenet":
+                fp32 = OnnxFaceNet(src)
+                if not crops:
+                    raise RuntimeError("no labelled faces to calibrate FaceNet with")
+                x = np.asarray(crops, dtype=np.float32)
+                x = (x - x.mean(axis=(1, 2, 3), keepdims=True)) / np.maximum(x.std(axis=(1, 2, 3), keepdims=True), 1e-6)
+                quantize(src, tmp, _Reader(fp32.input_name, [t[None] for t in x]), [], per_channel)
+                worst, mean = embedding_cosine(fp32, OnnxFaceNet(tmp), crops)
+                report = f"cosine min={worst:.4f} mean={mean:.4f} (budget >= {args.min_cos})"
+                ok = worst >= args.min_cos
+            else:
+                conf = ai.conf_thresh if name == "spoof" else 0.25
+                fp32 = OnnxYolo(src, imgsz=ai.img_size if name == "spoof" else 640, conf=conf)
+                tensors = [fp32._preprocess([frame])[0] for frame, _ in samples]
+                exclude = [] if args.quantize_head else _head_nodes(src)
+                quantize(src, tmp, _Reader(fp32.input_name, tensors), exclude, per_channel)
+                int8 = OnnxYolo(tmp, imgsz=fp32.imgsz, conf=conf)
+                if name == "spoof":
+                    before, after = spoof_accuracy(fp32, samples, conf), spoof_accuracy(int8, samples, conf)
+                else:
+                    before, after = face_recall(fp32, samples), face_recall(int8, samples)
+                label = "accuracy" if name == "spoof" else "recall"
+                report = f"{label} fp32={before:.3f} int8={after:.3f} drop={before - after:+.3f} (budget {args.max_acc_drop})"
+                # nan = nothing labelled to score; an unmeasured model never passes
+                measured = math.isfinite(before) and math.isfinite(after)
+                ok = measured and before - after <= args.max_acc_drop
+                if not measured:
+                    report += " | nothing labelled to measure"
+        except Exception as e:
+            rejected += 1
+            print(f"{name}: failed: {e}")
+            logger.error(f"quantize_onnx: {name} failed: {e}")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            continue
+
+        if ok:
+            os.replace(tmp, dst)
+            ratio = os.path.getsize(dst) / os.path.getsize(src)
+            print(f"{name}: wrote {dst} ({ratio:.0%} of FP32) | {report}")
+            logger.info(f"quantize_onnx: {name} -> {dst} | {report}")
+        else:
+            rejected += 1
+            os.remove(tmp)
+            print(f"{name}: REJECTED, over budget or unmeasured | {report}")
+            logger.warning(f"quantize_onnx: {name} rejected | {report}")
+
+    ai.pool.shutdown()
+    sys.exit(1 if rejected else 0)
+
+
+if __name__ == "__main__":
+    main()
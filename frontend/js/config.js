@@ -4,6 +4,7 @@ export const LOGIN_API = `${API_BASE_URL}/login`;
 export const REGISTER_API = `${API_BASE_URL}/register`;
 export const ATTENDANCE_API = `${API_BASE_URL}/mark_attendance`;
 export const DETECT_API = `${API_BASE_URL}/spoof`;
+export const VERIFY_API = `${API_BASE_URL}/verify_and_mark`;
 
 export const SPOOF_THRESHOLD = 0.5;
 export const BLUR_THRESHOLD = 2;